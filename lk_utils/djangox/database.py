@@ -3,6 +3,11 @@ from functools import wraps
 from django import db
 from django.db import models
 from django.db.models import QuerySet
+from django.dispatch import Signal
+
+
+# QuerySet.delete 软删除不会触发 post_delete, 改为发送该信号: sender=模型类, instances=对象列表, using=数据库
+post_soft_delete = Signal()
 
 
 def close_db(func):
@@ -29,7 +34,15 @@ class BasicModel(models.Model):
 
 class _SoftDeleteQuerySet(QuerySet):
     def delete(self):
-        return super().update(deleted=1)
+        if not post_soft_delete.has_listeners(self.model):
+            return super().update(deleted=1)
+
+        instances = list(self)
+        rows = super().update(deleted=1)
+        for instance in instances:
+            instance.deleted = 1
+        post_soft_delete.send(sender=self.model, instances=instances, using=self.db)
+        return rows
 
     def hard_delete(self):
         return super().delete()
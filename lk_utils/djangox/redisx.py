@@ -1,4 +1,5 @@
 from collections.abc import Iterable
+from lk_utils.redisx import hooks
 from lk_utils.redisx import operations
 
 
@@ -26,8 +27,8 @@ def query_item(model, filter_dict):
 
 
 @setattr_params
-def get_item(model, filter_dict=None, force_reload=False, cache_name='default'):
-    return operations.get_item(model, filter_dict, force_reload, cache_name, query_item)
+def get_item(model, filter_dict=None, force_reload=False, cache_name='default', **kwargs):
+    return operations.get_item(model, filter_dict, force_reload, cache_name, query_item, **kwargs)
 
 
 def query_items(model, miss_ids):
@@ -35,8 +36,19 @@ def query_items(model, miss_ids):
 
 
 @setattr_params
-def get_items_by_ids(model, ids, force_reload=False, cache_name='default'):
-    return operations.get_items_by_ids(model, ids, force_reload, cache_name, query_items)
+def get_items_by_ids(model, ids, force_reload=False, cache_name='default', chunk_size=None, **kwargs):
+    return operations.get_items_by_ids(model, ids, force_reload, cache_name, query_items, chunk_size, **kwargs)
+
+
+def query_items_by_field(model, field, values):
+    return model.objects.filter(deleted=0, **{f'{field}__in': values})
+
+
+@setattr_params
+def get_items_by_field(model, field, values, force_reload=False, cache_name='default', chunk_size=None, **kwargs):
+    return operations.get_items_by_field(
+        model, field, values, force_reload, cache_name, query_items_by_field, chunk_size, **kwargs
+    )
 
 
 @setattr_params
@@ -44,3 +56,115 @@ def delete_item_cache(model, filter_dict=None, cache_name='default'):
     return operations.delete_item_cache(model, filter_dict, cache_name)
 
 
+def enable_cache_hooks(model, lists=None, item_keys=None, cache_name='default', write_through=False):
+    """
+    开启事务提交后的自动缓存维护, 见 redisx.hooks
+
+    监听 post_save、post_delete 以及软删除的 post_soft_delete(SoftDeleteModel.objects.filter(...).delete()),
+    同一个事务内的变更在提交后通过一个 pipeline 执行; QuerySet.update 不会触发
+    post_init 时记录过滤字段的初始值, 保存时删除旧值对应的缓存
+
+    Args:
+        model: 模型类
+        lists: 列表缓存, set_all_item_cache 的参数列表
+        item_keys: 对象缓存的过滤字段, 默认 [('id',)]
+        cache_name: 缓存配置名称
+        write_through: 保存时写入最新对象, 默认删除对象缓存
+
+    Returns:
+
+    """
+    from django.db.models.signals import post_delete
+    from django.db.models.signals import post_init
+    from django.db.models.signals import post_save
+    from lk_utils.djangox.database import post_soft_delete
+
+    model.table_name = model._meta.db_table
+    model.db_name = model.objects.db
+    hooks.register(model, lists, item_keys, cache_name, write_through)
+    uid = f'redisx.hooks.{model._meta.label}'
+    post_init.connect(_on_init, sender=model, dispatch_uid=uid)
+    post_save.connect(_on_save, sender=model, dispatch_uid=uid)
+    post_delete.connect(_on_delete, sender=model, dispatch_uid=uid)
+    post_soft_delete.connect(_on_soft_delete, sender=model, dispatch_uid=uid)
+
+
+def disable_cache_hooks(model):
+    from django.db.models.signals import post_delete
+    from django.db.models.signals import post_init
+    from django.db.models.signals import post_save
+    from lk_utils.djangox.database import post_soft_delete
+
+    uid = f'redisx.hooks.{model._meta.label}'
+    post_init.disconnect(sender=model, dispatch_uid=uid)
+    post_save.disconnect(sender=model, dispatch_uid=uid)
+    post_delete.disconnect(sender=model, dispatch_uid=uid)
+    post_soft_delete.disconnect(sender=model, dispatch_uid=uid)
+    hooks.unregister(model)
+
+
+INITIAL_ATTR = '_redisx_initial'
+
+
+def _on_init(sender, instance, **kwargs):
+    _remember(instance)
+
+
+def _remember(instance):
+    spec = hooks.get_spec(type(instance))
+    if spec is not None:
+        # 只读取已加载的字段, 不触发延迟字段的查询
+        values = instance.__dict__
+        setattr(instance, INITIAL_ATTR, {field: values[field] for field in spec.fields if field in values})
+
+
+def _on_save(sender, instance, using, **kwargs):
+    _queue(hooks.collect(instance, previous=getattr(instance, INITIAL_ATTR, None)), using)
+    _remember(instance)
+
+
+def _on_delete(sender, instance, using, **kwargs):
+    _queue(hooks.collect(instance, deleted=True, previous=getattr(instance, INITIAL_ATTR, None)), using)
+
+
+def _on_soft_delete(sender, instances, using, **kwargs):
+    ops = []
+    for instance in instances:
+        ops.extend(hooks.collect(instance, deleted=True, previous=getattr(instance, INITIAL_ATTR, None)))
+    _queue(ops, using)
+
+
+class _PendingOps(object):
+    """一个事务内待执行的缓存操作"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.ops = []
+
+    def flush(self):
+        self.connection.redisx_pending = None
+        hooks.apply(self.ops)
+
+
+def _queue(ops, using):
+    from django.db import connections
+    from django.db import transaction
+
+    if not ops:
+        return
+
+    connection = connections[using]
+    if not connection.in_atomic_block:
+        hooks.apply(ops)
+        return
+
+    # savepoint 内的变更可能被单独回滚, 只做删除
+    if connection.savepoint_ids:
+        ops = hooks.conservative(ops)
+
+    pending = getattr(connection, 'redisx_pending', None)
+    # 事务回滚后 on_commit 回调被丢弃, 需要重新注册
+    if pending is None or not any(entry[1] == pending.flush for entry in connection.run_on_commit):
+        pending = connection.redisx_pending = _PendingOps(connection)
+        transaction.on_commit(pending.flush, using=using)
+    pending.ops.extend(ops)
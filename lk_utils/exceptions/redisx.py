@@ -1,2 +1,14 @@
 class RedisConnectionDoesNotExist(Exception):
     """Redis 链接未找到"""
+
+
+class RateLimitExceeded(Exception):
+    """超出频率限制或并发限制"""
+
+    def __init__(self, name, retry_after=None):
+        self.name = name
+        self.retry_after = retry_after
+        message = f'rate limit exceeded: {name}'
+        if retry_after is not None:
+            message += f', retry after {retry_after}s'
+        super().__init__(message)
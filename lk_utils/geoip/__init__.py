@@ -1,21 +1,53 @@
 # -*- coding: utf-8 -*-
 import os
+import threading
 
 from lk_utils.geoip.ip2Region import Ip2Region
 
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
-searcher = Ip2Region(os.path.join(current_dir, "ip2region.db"))
+db_path = os.path.join(current_dir, "ip2region.db")
+searcher = Ip2Region(db_path)
+
+_mmap_searcher = None
+_mmap_searcher_lock = threading.Lock()
+
+
+def get_searcher():
+    """mmap 查询实例, 第一次使用时加载, 多线程共用"""
+    global _mmap_searcher
+    if _mmap_searcher is None:
+        from lk_utils.geoip.searcher import MmapSearcher
+
+        with _mmap_searcher_lock:
+            if _mmap_searcher is None:
+                _mmap_searcher = MmapSearcher(db_path)
+    return _mmap_searcher
+
+
+def _parse_location(region):
+    """region 格式: 国家|区域|省份|城市|ISP, 返回 (省份, 城市)"""
+    location = region.split("|")
+    if len(location) < 4:
+        return "", ""
+    return location[2].replace("0", ""), location[3].replace("0", "")
 
 
 def get_ip_info(ip):
     try:
-        data = searcher.memorySearch(ip)
-        location = data["region"].decode("utf-8").split("|")
-        city = location[3].replace("0", "")
-        province = location[2].replace("0", "")
+        data = get_searcher().search(ip)
+        province, city = _parse_location(data["region"].decode("utf-8"))
     except Exception:  # noqa
         city = ""
         province = ""
 
     return province, city
+
+
+def batch_get_ip_info(ips):
+    """
+    批量查询 ip 的省份与城市, 用于日志分析等大批量场景
+
+    Returns: (省份, 城市) 的 object 数组, 与 ips 一一对应, 查询不到时为 ("", "")
+    """
+    return get_searcher().batch_search(ips, parse=_parse_location)["region"]
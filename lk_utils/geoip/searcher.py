@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+基于 mmap 的 ip2region 查询
+
+数据库文件通过 mmap 只读映射, 索引区直接作为 NumPy 结构化数组使用, 不复制也不 seek,
+多线程共用同一个实例是安全的; 只有起始 ip 一列复制为连续数组(每条 4 字节), 供 searchsorted 使用
+
+    searcher = MmapSearcher('ip2region.db')
+    searcher.search('1.2.3.4')  # {'city_id': 0, 'region': b'...'}
+    searcher.batch_search(ip_list)  # {'found', 'city_id', 'region'}, 均为与输入等长的数组
+
+数据库结构(ip2region v1):
+    super block: 第一条与最后一条索引的偏移, 各 4 字节
+    index block: 每条 12 字节, 起始 ip | 结束 ip | 数据指针(高 8 位为长度, 低 24 位为偏移)
+    data block: city_id(4 字节) + region
+"""
+import mmap
+import socket
+import struct
+
+import numpy as np
+
+
+INDEX_DTYPE = np.dtype([("sip", "<u4"), ("eip", "<u4"), ("ptr", "<u4")])
+
+# 点分十进制最长 15 个字符
+_IP_WIDTH = 15
+
+
+def ips_to_long(ips):
+    """
+    批量将点分十进制 ip 转为整数, 按字符列向量化计算, 没有逐个 ip 的循环
+
+    Args:
+        ips: ip 字符串列表或数组
+
+    Returns: (uint32 数组, 是否为合法 ip 的 bool 数组)
+    """
+    ips = np.asarray(ips)
+    if ips.dtype.kind not in "US":
+        ips = ips.astype(str)
+    # 超过 15 个字符的不是合法 ip, 转为定长时会被截断
+    valid = np.char.str_len(ips) <= _IP_WIDTH
+    if ips.dtype.kind == "U" and ips.dtype.itemsize:
+        # 含非 ASCII 字符的不是合法 ip, 置空后再转为字节, 避免 UnicodeEncodeError
+        non_ascii = (ips.view(np.uint32).reshape(len(ips), ips.dtype.itemsize // 4) > 127).any(axis=1)
+        valid &= ~non_ascii
+        ips = np.where(non_ascii, "", ips)
+    chars = ips.astype("S%d" % _IP_WIDTH)
+    chars = chars.view(np.uint8).reshape(len(chars), _IP_WIDTH)
+
+    result = np.zeros(len(chars), dtype=np.int64)
+    octet = np.zeros(len(chars), dtype=np.int64)
+    digits = np.zeros(len(chars), dtype=np.int64)
+    dots = np.zeros(len(chars), dtype=np.int64)
+    for column in chars.T:
+        is_digit = (column >= 48) & (column <= 57)
+        is_dot = column == 46
+        octet = np.where(is_digit, octet * 10 + column - 48, octet)
+        digits += is_digit
+        # 每段 1-3 位数字, 不超过 255
+        valid &= (is_digit | is_dot | (column == 0)) & (~is_dot | ((digits > 0) & (digits <= 3) & (octet <= 255)))
+        result = np.where(is_dot, result * 256 + octet, result)
+        octet = np.where(is_dot, 0, octet)
+        digits = np.where(is_dot, 0, digits)
+        dots += is_dot
+    valid &= (dots == 3) & (digits > 0) & (digits <= 3) & (octet <= 255)
+    result = result * 256 + octet
+    return np.where(valid, result, 0).astype(np.uint32), valid
+
+
+class MmapSearcher(object):
+    """ip2region 查询, 单个查询与批量查询都通过 searchsorted 在索引上二分"""
+
+    def __init__(self, dbfile):
+        with open(dbfile, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        first, last = struct.unpack_from("<II", self._mmap, 0)
+        count = (last - first) // INDEX_DTYPE.itemsize + 1
+        self.index = np.frombuffer(self._mmap, dtype=INDEX_DTYPE, count=count, offset=first)
+        # searchsorted 需要连续数组, 否则每次查询都会复制
+        self._sip = np.ascontiguousarray(self.index["sip"])
+        self._eip = self.index["eip"]
+        self._ptr = self.index["ptr"]
+
+    @staticmethod
+    def ip2long(ip):
+        if isinstance(ip, int):
+            return ip
+        if ip.isdigit():
+            return int(ip)
+        return struct.unpack("!L", socket.inet_aton(ip))[0]
+
+    def _lookup(self, ips):
+        """返回数据指针数组, 未找到时为 0"""
+        pos = np.searchsorted(self._sip, ips, side="right") - 1
+        found = pos >= 0
+        pos = np.maximum(pos, 0)
+        found &= ips <= self._eip[pos]
+        return np.where(found, self._ptr[pos], 0)
+
+    def _read(self, ptr):
+        length = ptr >> 24
+        offset = ptr & 0x00FFFFFF
+        city_id, = struct.unpack_from("<I", self._mmap, offset)
+        return city_id, self._mmap[offset + 4:offset + length]
+
+    def search(self, ip):
+        """
+        查询单个 ip, 返回值与 Ip2Region.memorySearch 一致
+
+        Returns: {'city_id', 'region': bytes}
+        """
+        ptr = int(self._lookup(np.uint32(self.ip2long(ip))))
+        if ptr == 0:
+            raise Exception("Data pointer not found")
+        city_id, region = self._read(ptr)
+        return {"city_id": city_id, "region": region}
+
+    def batch_search(self, ips, decode=True, parse=None):
+        """
+        批量查询
+
+        Args:
+            ips: ip 字符串列表/数组, 或整数形式的 ip 数组
+            decode: region 是否解码为字符串
+            parse: 处理 region 的函数, 每个不同的 region 只调用一次, 未找到时参数为空值
+
+        Returns: {'found': bool 数组, 'city_id': uint32 数组, 'region': object 数组, 未找到时为 ''}
+        """
+        ips = np.asarray(ips)
+        if ips.dtype.kind in "iu":
+            valid = (ips >= 0) & (ips <= 0xFFFFFFFF)
+            ips = ips.astype(np.uint32)
+        else:
+            ips, valid = ips_to_long(ips)
+
+        ptrs = np.where(valid, self._lookup(ips), 0)
+        # 大量 ip 对应少量数据块, 只读取去重后的数据
+        unique_ptrs, inverse = np.unique(ptrs, return_inverse=True)
+        empty = "" if decode else b""
+        city_ids = np.zeros(len(unique_ptrs), dtype=np.uint32)
+        regions = np.empty(len(unique_ptrs), dtype=object)
+        for i, ptr in enumerate(unique_ptrs.tolist()):
+            region = empty
+            if ptr:
+                city_ids[i], region = self._read(ptr)
+                if decode:
+                    region = region.decode("utf-8")
+            regions[i] = parse(region) if parse is not None else region
+
+        return {"found": ptrs != 0, "city_id": city_ids[inverse], "region": regions[inverse]}
+
+    def close(self):
+        # index 等数组引用 mmap 时无法关闭, 由垃圾回收释放
+        self.index = self._sip = self._eip = self._ptr = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
@@ -1,12 +1,181 @@
+import random
+import threading
 from functools import wraps
 from asgiref.local import Local
 
+from redis import BlockingConnectionPool
+from redis import ConnectionPool
 from redis import Redis
+from redis.connection import Connection
+from redis.connection import SSLConnection
+from redis.connection import UnixDomainSocketConnection
 from lk_utils.register import config
 from lk_utils.register import ConfigKeys
 from lk_utils.exceptions.redisx import RedisConnectionDoesNotExist
 
 
+class PoolStatsMixin(object):
+    """连接池统计: 使用中、已创建、等待空闲连接的次数"""
+
+    def reset(self):
+        self.stats_lock = threading.Lock()
+        self.in_use = 0
+        self.created = 0
+        self.waits = 0
+        super().reset()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        with self.stats_lock:
+            self.created += 1
+        return connection
+
+    def get_connection(self, *args, **kwargs):
+        with self.stats_lock:
+            if self.max_connections and self.in_use >= self.max_connections:
+                self.waits += 1
+        connection = super().get_connection(*args, **kwargs)
+        with self.stats_lock:
+            self.in_use += 1
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        with self.stats_lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'in_use': self.in_use,
+                'created': self.created,
+                'waits': self.waits,
+                'max_connections': self.max_connections,
+            }
+
+
+class StatsConnectionPool(PoolStatsMixin, ConnectionPool):
+    pass
+
+
+class StatsBlockingConnectionPool(PoolStatsMixin, BlockingConnectionPool):
+    pass
+
+
+# 集群、哨兵、从库等路由配置, 不属于单个连接的参数
+ROUTING_KEYS = (
+    'cluster', 'startup_nodes', 'sentinels', 'service_name', 'sentinel_password',
+    'replicas', 'read_from_replicas',
+)
+
+
+def create_connection_pool(params):
+    """
+    根据 parser_redis_url 解析出的配置创建连接池
+
+    配置了 pool_timeout 时使用阻塞连接池, 连接数达到 max_connections 后等待空闲连接,
+    否则超出 max_connections 直接报错
+    """
+    params = dict(params)
+    for key in ROUTING_KEYS:
+        params.pop(key, None)
+    pool_timeout = params.pop('pool_timeout', None)
+    max_connections = params.pop('max_connections', None)
+    unix_socket_path = params.pop('unix_socket_path', None)
+    if unix_socket_path:
+        params.pop('host', None)
+        params.pop('port', None)
+        params['path'] = unix_socket_path
+        params['connection_class'] = UnixDomainSocketConnection
+    elif params.pop('ssl', False):
+        params['connection_class'] = SSLConnection
+    else:
+        params['connection_class'] = Connection
+
+    if pool_timeout:
+        return StatsBlockingConnectionPool(max_connections=max_connections or 50, timeout=pool_timeout, **params)
+    return StatsConnectionPool(max_connections=max_connections, **params)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(alias, params):
+    """进程内按配置名称共享连接池, fork 后由 redis-py 自动重建连接"""
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                pool = _pools[alias] = create_connection_pool(params)
+    return pool
+
+
+def get_shared_client(alias, params, readonly=False):
+    """
+    集群和哨兵模式的客户端, 进程内共享
+
+    集群: RedisCluster, 配置 read_from_replicas 后读命令由客户端自动发送到从节点
+    哨兵: 主库使用 master_for, 只读客户端使用 slave_for
+    """
+    key = (alias, readonly)
+    client = _shared_clients.get(key)
+    if client is not None:
+        return client
+
+    with _pools_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            client = _shared_clients[key] = _create_shared_client(params, readonly)
+    return client
+
+
+def _create_shared_client(params, readonly):
+    params = dict(params)
+    params.pop('pool_timeout', None)
+    params.pop('replicas', None)
+    if params.pop('cluster', False):
+        from redis.cluster import ClusterNode
+        from redis.cluster import RedisCluster
+
+        params.pop('db', None)
+        nodes = [ClusterNode(host, port) for host, port in params.pop('startup_nodes')]
+        return RedisCluster(startup_nodes=nodes, **params)
+
+    from redis.sentinel import Sentinel
+
+    sentinels = params.pop('sentinels')
+    service_name = params.pop('service_name')
+    sentinel_password = params.pop('sentinel_password', None)
+    params.pop('read_from_replicas', None)
+    max_connections = params.pop('max_connections', None)
+    sentinel_kwargs = {'password': sentinel_password} if sentinel_password else None
+    sentinel = Sentinel(sentinels, sentinel_kwargs=sentinel_kwargs, **params)
+    if readonly:
+        return sentinel.slave_for(service_name, max_connections=max_connections)
+    return sentinel.master_for(service_name, max_connections=max_connections)
+
+
+_shared_clients = {}
+
+
+def pool_stats(alias=None):
+    """
+    连接池统计
+
+    Args:
+        alias: 配置名称, 不传返回全部
+
+    Returns: {alias: {'in_use': 1, 'created': 2, 'waits': 0, 'max_connections': 100}}
+
+    """
+    if alias is not None:
+        pool = _pools.get(alias)
+        return pool.stats() if pool is not None else None
+    return {name: pool.stats() for name, pool in list(_pools.items())}
+
+
 class ConnectionManager(object):
 
     def __init__(self):
@@ -18,12 +187,52 @@ class ConnectionManager(object):
 
     def create_connection(self, alias):
         params = self._config[alias]
-        return Redis(**params)
+        if params.get('cluster') or params.get('sentinels'):
+            return get_shared_client(alias, params)
+        # 同一配置的所有连接共用进程内的连接池
+        return Redis(connection_pool=get_connection_pool(alias, params))
+
+    def create_read_connection(self, alias):
+        """
+        只读连接, 用于读取缓存; 写入和锁始终使用主库(__getitem__)
+
+        集群: 与主库为同一个 RedisCluster 客户端, 由 read_from_replicas 决定是否读从节点
+        哨兵: 从库
+        单机: 随机选择 replicas 配置中的一个从库, 未配置时返回主库
+        """
+        params = self._config[alias]
+        if params.get('cluster'):
+            return get_shared_client(alias, params)
+        if params.get('sentinels'):
+            return get_shared_client(alias, params, readonly=True)
+
+        replicas = params.get('replicas')
+        if not replicas:
+            return self[alias]
+
+        index = random.randrange(len(replicas))
+        host, port = replicas[index]
+        replica_params = {**params, 'host': host, 'port': port}
+        return Redis(connection_pool=get_connection_pool(f'{alias}:replica{index}', replica_params))
+
+    def has_replicas(self, alias):
+        """读请求是否会发送到主库以外的节点"""
+        params = self._config[alias]
+        return bool(params.get('replicas') or params.get('sentinels') or params.get('read_from_replicas'))
+
+    def read(self, alias):
+        if alias not in self._config:
+            raise RedisConnectionDoesNotExist(
+                f"The connection '{alias}' doesn't exist."
+            )
+        return self.create_read_connection(alias)
 
     def close_connection(self, alias):
         conn = getattr(self._connections, alias, None)
         if conn is not None:
-            conn.close()
+            # 共享的集群、哨兵客户端不关闭
+            if conn not in _shared_clients.values():
+                conn.close()
             delattr(self._connections, alias)
 
     def __getitem__(self, alias):
@@ -63,4 +272,9 @@ def connection_redisx(alias):
     return decorator
 
 
-client = ConnectionManager()['default']
+def __getattr__(name):
+    # default 连接在首次使用时创建, 导入 redisx 的模块(如 warmup 命令行)不要求先完成配置
+    if name == 'client':
+        conn = globals()['client'] = ConnectionManager()['default']
+        return conn
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,86 @@
+"""
+redisx 的 asyncio 版本, 基于 redis.asyncio
+
+与同步版本使用相同的配置、缓存key格式以及序列化方式, 同步和异步服务可以共用同一份缓存
+"""
+import asyncio
+import weakref
+
+from redis.asyncio import Redis
+from lk_utils.register import config
+from lk_utils.register import ConfigKeys
+from lk_utils.exceptions.redisx import RedisConnectionDoesNotExist
+
+
+class ConnectionManager(object):
+    """
+    每个事件循环、每个配置共享一个连接(连接池), 不能跨事件循环使用
+    """
+
+    _connections = weakref.WeakKeyDictionary()
+
+    @property
+    def _config(self):
+        return getattr(config, ConfigKeys.Redis, None)
+
+    def create_connection(self, alias):
+        """
+        集群、哨兵模式同样只返回主库客户端; 从库读取只在同步版本中支持,
+        异步服务的读请求都发送到主库(集群模式由 read_from_replicas 决定)
+        """
+        params = dict(self._config[alias])
+        params.pop('pool_timeout', None)
+        params.pop('replicas', None)
+        if params.pop('cluster', False):
+            from redis.asyncio.cluster import ClusterNode
+            from redis.asyncio.cluster import RedisCluster
+
+            params.pop('db', None)
+            nodes = [ClusterNode(host, port) for host, port in params.pop('startup_nodes')]
+            return RedisCluster(startup_nodes=nodes, **params)
+
+        if params.get('sentinels'):
+            from redis.asyncio.sentinel import Sentinel
+
+            sentinels = params.pop('sentinels')
+            service_name = params.pop('service_name')
+            sentinel_password = params.pop('sentinel_password', None)
+            params.pop('read_from_replicas', None)
+            max_connections = params.pop('max_connections', None)
+            sentinel_kwargs = {'password': sentinel_password} if sentinel_password else None
+            sentinel = Sentinel(sentinels, sentinel_kwargs=sentinel_kwargs, **params)
+            return sentinel.master_for(service_name, max_connections=max_connections)
+
+        params.pop('read_from_replicas', None)
+        params.pop('sentinel_password', None)
+        return Redis(**params)
+
+    @staticmethod
+    def _loop_connections():
+        loop = asyncio.get_running_loop()
+        connections = ConnectionManager._connections.get(loop)
+        if connections is None:
+            connections = ConnectionManager._connections[loop] = {}
+        return connections
+
+    async def close_connection(self, alias):
+        conn = self._loop_connections().pop(alias, None)
+        if conn is not None:
+            await conn.aclose()
+
+    def __getitem__(self, alias):
+        connections = self._loop_connections()
+        conn = connections.get(alias)
+        if conn is not None:
+            return conn
+
+        if alias not in self._config:
+            raise RedisConnectionDoesNotExist(
+                f"The connection '{alias}' doesn't exist."
+            )
+
+        conn = connections[alias] = self.create_connection(alias)
+        return conn
+
+    def __iter__(self):
+        return iter(self._config)
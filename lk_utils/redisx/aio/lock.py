@@ -0,0 +1,38 @@
+from redis.exceptions import LockError
+from redis.asyncio.lock import Lock as LockBase
+
+
+class Lock(LockBase):
+    """
+    redisx.lock.Lock 的异步版本, 默认20秒超时、非阻塞
+
+    async with Lock('name') as lock:
+        if not lock:
+            return
+    """
+
+    def __init__(self, name, *args, **kwargs):
+        """
+        :param name: 锁名称
+        :param timeout: 锁的存在时间（秒）
+        :param blocking: 锁阻塞, 默认关闭
+        :param client: redis 连接, 默认使用 default 配置
+        """
+        kwargs.setdefault("timeout", 20)
+        kwargs.setdefault("blocking", False)
+        client = kwargs.pop("client", None)
+        if client is None:
+            from lk_utils.redisx.aio import ConnectionManager
+            client = ConnectionManager()["default"]
+        super().__init__(client, name, *args, **kwargs)
+
+    async def __aenter__(self):
+        if await self.acquire():
+            return self
+        return False
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            await self.release()
+        except LockError:
+            return False
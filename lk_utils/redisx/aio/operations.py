@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+redisx.operations 的异步版本
+
+缓存key、序列化、空值缓存以及进程内缓存与同步版本完全一致;
+query_func 可以是普通函数或协程函数. 列表缓存的重建需要执行同步的 ORM 查询,
+在线程中调用同步版本的 set_all_item_cache 完成, 不阻塞事件循环
+"""
+import asyncio
+import inspect
+import time
+from functools import wraps
+
+from lk_utils.redisx import hooks
+from lk_utils.redisx import local
+from lk_utils.redisx import operations
+from lk_utils.redisx import serializers
+from lk_utils.redisx import stampede
+from lk_utils.redisx.memoize import cached  # noqa: F401
+from lk_utils.redisx.aio import ConnectionManager
+from lk_utils.redisx.operations import build_all_item_cache_key
+from lk_utils.redisx.operations import build_item_cache_key
+from lk_utils.redisx.operations import decode_cursor
+from lk_utils.redisx.operations import encode_cursor  # noqa: F401
+from lk_utils.redisx.operations import gen_add_all_item_args
+from lk_utils.redisx.operations import gen_cursor_args
+from lk_utils.redisx.operations import gen_next_cursor
+from lk_utils.redisx.operations import gen_rem_all_item_args
+from lk_utils.redisx.operations import parse_cursor_items
+from lk_utils.redisx.operations import split_chunks
+from lk_utils.tools.base import is_collection_type
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def _mget(client, keys):
+    """集群模式下 key 分布在不同 slot, 使用 mget_nonatomic 按 slot 拆分"""
+    mget_nonatomic = getattr(client, 'mget_nonatomic', None)
+    if mget_nonatomic is not None:
+        return await mget_nonatomic(keys)
+    return await client.mget(keys)
+
+
+async def get_namespace_version(model, cache_name='default'):
+    """与 operations.get_namespace_version 共用进程内缓存"""
+    version_key = operations.gen_namespace_version_key(model)
+    entry = operations._namespace_versions.get((cache_name, version_key))
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+
+    client = ConnectionManager()[cache_name]
+    version = int(await client.get(version_key) or 0)
+    operations._namespace_versions[(cache_name, version_key)] = (
+        version, time.monotonic() + operations.version_cache_time
+    )
+    return version
+
+
+async def gen_namespace_prefix(model, cache_name='default'):
+    if not getattr(model, 'cache_versioned', False):
+        return ''
+
+    return 'v%d:' % await get_namespace_version(model, cache_name)
+
+
+async def gen_item_cache_key(model, filter_dict, cache_name='default'):
+    namespace = await gen_namespace_prefix(model, cache_name)
+    return build_item_cache_key(model, filter_dict, namespace)
+
+
+async def gen_all_item_cache_key(model, filter_dict=None, value='id', key_str=None, cache_name='default'):
+    namespace = await gen_namespace_prefix(model, cache_name)
+    return build_all_item_cache_key(model, filter_dict, value, key_str, namespace)
+
+
+async def get_item(model, filter_dict=None, force_reload=False, cache_name='default', query_func=None,
+                   negative_ttl=None):
+    """
+    获取数据库对象
+
+    Args:
+        model: 模型类
+        filter_dict: 过滤字典
+        force_reload: 是否强制刷新缓存
+        cache_name: 缓存配置名称
+        query_func: 未查询到缓存时，调用的DB查询函数, 支持协程函数
+        negative_ttl: 查询不到数据时缓存空值的时间（秒）, 默认使用 operations.negative_cache_time
+
+    Returns:
+
+    """
+    if filter_dict is None:
+        filter_dict = {}
+    if not force_reload:
+        force_reload = operations.FORCE_RELOAD
+    if negative_ttl is None:
+        negative_ttl = operations.negative_cache_time
+
+    cache_key = await gen_item_cache_key(model, filter_dict, cache_name)
+    local_cache = local.get_local_cache(cache_name)
+    if local_cache is not None and not force_reload:
+        item = local_cache.get(cache_key)
+        if item is not None:
+            return item
+
+    client = ConnectionManager()[cache_name]
+    item = await client.get(cache_key)
+    if item == serializers.NEGATIVE_VALUE and not force_reload:
+        return None
+    if item and not force_reload:
+        item = await _load_item(model, item, filter_dict, cache_name)
+        if item is not stampede.MISS:
+            if local_cache is not None:
+                local_cache.set(cache_key, item)
+            return item
+
+    if not query_func:
+        return None
+
+    await client.delete(cache_key)
+    item = await _maybe_await(query_func(model, filter_dict))
+    if item:
+        await client.set(cache_key, serializers.dumps(item, cache_name), operations.cache_time)
+    elif negative_ttl:
+        await client.set(cache_key, serializers.NEGATIVE_VALUE, negative_ttl)
+    if force_reload:
+        await _invalidate_local(client, [cache_key], cache_name)
+    if not item:
+        return None
+
+    if local_cache is not None:
+        local_cache.set(cache_key, item)
+    return item
+
+
+async def _load_item(model, data, filter_dict, cache_name='default'):
+    """与 operations._load_item 一致, 指针指向的对象不存在或字段值已修改时返回 stampede.MISS"""
+    pk = serializers.load_pointer(data)
+    if pk is None:
+        return serializers.loads(data, model)
+    item = (await get_items_by_ids(model, [pk], cache_name=cache_name)).get(pk)
+    if item is None or not operations._field_matches(item, filter_dict):
+        return stampede.MISS
+    return item
+
+
+async def get_items_by_ids(model, ids, force_reload=False, cache_name='default', query_func=None, chunk_size=None,
+                           negative_ttl=None):
+    """
+    批量获取数据
+
+    Args:
+        model: 模型类
+        ids: 单个或多个id列表
+        force_reload: 是否强制刷新缓存
+        cache_name: 使用的缓存配置名称
+        query_func: 未查询到缓存时，调用的DB查询函数, 支持协程函数; 返回列表或异步迭代器
+        chunk_size: 单条 MGET/UNLINK/pipeline 命令的最大 key 数量, 默认不拆分
+        negative_ttl: 查询不到的id缓存空值的时间（秒）, 默认使用 operations.negative_cache_time
+
+    Returns: {id1: obj, id2: obj}
+
+    """
+    if not force_reload:
+        force_reload = operations.FORCE_RELOAD
+    if negative_ttl is None:
+        negative_ttl = operations.negative_cache_time
+
+    if isinstance(ids, int):
+        ids = [ids]
+
+    key_prefix = await gen_item_cache_key(model, None, cache_name)
+    cache_keys = ['%s?id=%s' % (key_prefix, pk) for pk in ids]
+
+    item_dict, miss_ids = {}, []
+    client = ConnectionManager()[cache_name]
+    serializer = serializers.get_serializer(cache_name)
+    if cache_keys:
+        if force_reload:
+            item_list = None
+            for keys in split_chunks(cache_keys, chunk_size):
+                await client.unlink(*keys)
+        else:
+            item_list = []
+            for keys in split_chunks(cache_keys, chunk_size):
+                item_list.extend(await _mget(client, keys))
+
+        for i, pk in enumerate(ids):
+            if item_list and item_list[i] == serializers.NEGATIVE_VALUE:
+                continue
+            if item_list and item_list[i]:
+                item_dict[pk] = serializers.loads(item_list[i], model)
+            else:
+                miss_ids.append(pk)
+
+    if all([miss_ids, query_func]):
+        queryset = await _maybe_await(query_func(model, miss_ids))
+        if hasattr(queryset, '__aiter__'):
+            queryset = [item async for item in queryset]
+
+        pipe = client.pipeline(transaction=False)
+        found_ids = set()
+        for item in queryset:
+            item_dict[item.id] = item
+            found_ids.add(str(item.id))
+            pipe.set('%s?id=%s' % (key_prefix, item.id), serializer.dumps(item), operations.cache_time)
+            if chunk_size and len(pipe) >= chunk_size:
+                await pipe.execute()
+
+        if negative_ttl:
+            for pk in miss_ids:
+                if str(pk) in found_ids:
+                    continue
+                pipe.set('%s?id=%s' % (key_prefix, pk), serializers.NEGATIVE_VALUE, negative_ttl)
+                if chunk_size and len(pipe) >= chunk_size:
+                    await pipe.execute()
+
+        if len(pipe):
+            await pipe.execute()
+
+    if force_reload:
+        await _invalidate_local(client, cache_keys, cache_name)
+    return item_dict
+
+
+async def delete_item_cache(model, filter_dict=None, cache_name='default'):
+    """
+    删除单个对象缓存, 同时失效各进程的进程内缓存
+    """
+    client = ConnectionManager()[cache_name]
+    cache_key = await gen_item_cache_key(model, filter_dict, cache_name)
+    pipe = client.pipeline(transaction=False)
+    pipe.delete(cache_key)
+    # 集群模式下几个 key 不在同一个 slot, 分开删除
+    pipe.unlink(cache_key + stampede.STALE_SUFFIX)
+    pipe.unlink(cache_key + stampede.DELTA_SUFFIX)
+    result = (await pipe.execute())[0]
+    await _invalidate_local(client, [cache_key], cache_name)
+    return result
+
+
+async def _invalidate_local(client, cache_keys, cache_name='default'):
+    """与 local.invalidate_many 一致, 删除本进程缓存并广播失效通知"""
+    local_cache = local.get_local_cache(cache_name)
+    if local_cache is not None:
+        for cache_key in cache_keys:
+            local_cache.delete(cache_key)
+    if local.should_publish(cache_name) and cache_keys:
+        pipe = client.pipeline(transaction=False)
+        for cache_key in cache_keys:
+            pipe.publish(local.INVALIDATE_CHANNEL % cache_name, cache_key)
+        await pipe.execute()
+
+
+async def clear_negative_cache(model, filter_dict=None, cache_name='default', item_keys=None):
+    """删除空值缓存, 不影响正常缓存, 参数同 operations.clear_negative_cache"""
+    if filter_dict is None:
+        return await clear_negative_caches([model], cache_name=cache_name, item_keys=item_keys)
+
+    client = ConnectionManager()[cache_name]
+    cache_key = await gen_item_cache_key(model, filter_dict, cache_name)
+    script = client.register_script(operations.CLEAR_NEGATIVE_SCRIPT)
+    return bool(await script(keys=[cache_key], args=[serializers.NEGATIVE_VALUE]))
+
+
+async def clear_negative_caches(items, cache_name='default', item_keys=None):
+    """按对象批量删除 id 以及 item_keys 各字段的空值缓存, 参数同 operations.clear_negative_caches"""
+    items = list(items) if is_collection_type(items) else [items]
+    cache_keys = [
+        await gen_item_cache_key(item, filter_dict, cache_name)
+        for item in items for filter_dict in hooks.item_filters(item, item_keys)
+    ]
+    if not cache_keys:
+        return False
+
+    client = ConnectionManager()[cache_name]
+    script = client.register_script(operations.CLEAR_NEGATIVE_SCRIPT)
+    if len(cache_keys) == 1:
+        return bool(await script(keys=cache_keys, args=[serializers.NEGATIVE_VALUE]))
+
+    pipe = client.pipeline(transaction=False)
+    for cache_key in cache_keys:
+        await script(keys=[cache_key], args=[serializers.NEGATIVE_VALUE], client=pipe)
+    return any(await pipe.execute())
+
+
+async def set_all_item_cache(model, filter_dict=None, value='id', order_func=None, key_str=None,
+                             force_reload=False, limit_num=None, cache_name='default', chunk_size=None):
+    """
+    设置id列表缓存; 列表已存在时只做一次 EXISTS, 否则在线程中执行同步版本重建
+
+    Returns: 缓存key
+
+    """
+    client = ConnectionManager()[cache_name]
+    cache_key = await gen_all_item_cache_key(model, filter_dict, value, key_str, cache_name)
+    if not force_reload and not operations.FORCE_RELOAD and await client.exists(cache_key):
+        return cache_key
+
+    return await asyncio.to_thread(
+        operations.set_all_item_cache, model, filter_dict, value, order_func, key_str,
+        force_reload=True, limit_num=limit_num, cache_name=cache_name, chunk_size=chunk_size
+    )
+
+
+async def get_item_ids(model, p=1, page_size=10, filter_dict=None, value='id', order_func=None,
+                       key_str=None, reverse=True, limit_num=None, cache_name='default'):
+
+    if filter_dict is None:
+        filter_dict = {}
+
+    client = ConnectionManager()[cache_name]
+    cache_key = await set_all_item_cache(model, filter_dict, value, order_func, key_str, limit_num=limit_num,
+                                         cache_name=cache_name)
+    if reverse:
+        item_ids = await client.zrevrange(cache_key, (p - 1) * page_size, p * page_size - 1)
+    else:
+        item_ids = await client.zrange(cache_key, (p - 1) * page_size, p * page_size - 1)
+
+    item_ids = [int(item_id) for item_id in item_ids]
+    return item_ids
+
+
+async def get_item_ids_by_score(model, min_score=None, max_score=None, filter_dict=None,
+                                value='id', order_func=None, key_str=None, cache_name='default'):
+
+    if (min_score is None) and (max_score is None):
+        return await get_item_ids(model, 1, 0, filter_dict=filter_dict, value=value, order_func=order_func,
+                                  key_str=key_str, cache_name=cache_name)
+
+    client = ConnectionManager()[cache_name]
+    cache_key = await set_all_item_cache(model, filter_dict, value, order_func, key_str, cache_name=cache_name)
+    item_ids = await client.zrangebyscore(cache_key, min_score, max_score)
+    return item_ids
+
+
+async def get_item_ids_with_score(model, p=1, page_size=10, filter_dict=None, value='id', order_func=None,
+                                  key_str=None, reverse=True, limit_num=None, cache_name='default'):
+
+    if filter_dict is None:
+        filter_dict = {}
+
+    client = ConnectionManager()[cache_name]
+    cache_key = await set_all_item_cache(model, filter_dict, value, order_func, key_str, limit_num=limit_num,
+                                         cache_name=cache_name)
+    if reverse:
+        items = await client.zrevrange(cache_key, (p - 1) * page_size, p * page_size - 1, withscores=True)
+    else:
+        items = await client.zrange(cache_key, (p - 1) * page_size, p * page_size - 1, withscores=True)
+
+    item_ids = [(int(item_id), int(score)) for item_id, score in items]
+    return item_ids
+
+
+async def get_item_amount(model, filter_dict=None, value='id', order_func=None, cache_name='default'):
+    client = ConnectionManager()[cache_name]
+    cache_key = await set_all_item_cache(model, filter_dict, value, order_func, cache_name=cache_name)
+    amount = await client.zcard(cache_key)
+    return amount
+
+
+async def get_items_by_cursor(model, cursor=None, page_size=10, filter_dict=None, value='id', order_func=None,
+                              key_str=None, reverse=True, limit_num=None, cache_name='default', query_func=None):
+    """
+    游标分页, 参数与返回值同 operations.get_items_by_cursor
+    """
+    if filter_dict is None:
+        filter_dict = {}
+
+    score, last_id, skip = decode_cursor(cursor)
+    client = ConnectionManager()[cache_name]
+    cache_key = await gen_all_item_cache_key(model, filter_dict, value, key_str, cache_name)
+    args = gen_cursor_args(page_size, score, last_id, skip, reverse)
+
+    script = client.register_script(operations.CURSOR_RANGE_SCRIPT)
+    items = await script(keys=[cache_key], args=args)
+    if items is None:
+        await set_all_item_cache(model, filter_dict, value, order_func, key_str, limit_num=limit_num,
+                                 cache_name=cache_name)
+        items = await script(keys=[cache_key], args=args) or []
+
+    items = parse_cursor_items(items)
+    next_cursor = gen_next_cursor(items, page_size, score, skip)
+
+    if value != 'id':
+        return [item_value for item_value, _ in items], next_cursor
+
+    item_ids = [int(item_id) for item_id, _ in items]
+    item_dict = await get_items_by_ids(model, item_ids, cache_name=cache_name, query_func=query_func)
+    return [item_dict[item_id] for item_id in item_ids if item_id in item_dict], next_cursor
+
+
+async def add_all_item_cache(item, filter_dict=None, value='id', order_func=None, key_str=None, cache_name='default',
+                             limit_num=None):
+    """
+    添加id至列表缓存, 用于更新缓存, item 可以是对象列表
+    """
+    if filter_dict is None:
+        filter_dict = {}
+    items = list(item) if is_collection_type(item) else [item]
+    if not items:
+        return True
+
+    client = ConnectionManager()[cache_name]
+    await clear_negative_caches(items, cache_name=cache_name)
+    cache_key = await gen_all_item_cache_key(items[0], filter_dict, value, key_str, cache_name)
+    script = client.register_script(operations.ADD_ALL_ITEM_SCRIPT)
+    await script(keys=[cache_key], args=gen_add_all_item_args(items, value, order_func, limit_num))
+    return True
+
+
+async def rem_all_item_cache(item, filter_dict=None, value='id', key_str=None, cache_name='default'):
+    """
+    从id列表缓存中删除id, 用于更新缓存, item 可以是对象列表
+    """
+    if filter_dict is None:
+        filter_dict = {}
+    items = list(item) if is_collection_type(item) else [item]
+    if not items:
+        return True
+
+    client = ConnectionManager()[cache_name]
+    cache_key = await gen_all_item_cache_key(items[0], filter_dict, value, key_str, cache_name)
+    script = client.register_script(operations.REM_ALL_ITEM_SCRIPT)
+    await script(keys=[cache_key], args=gen_rem_all_item_args(items, value))
+    return True
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+事务提交后自动维护缓存, 不再需要手动调用 delete_item_cache / add_all_item_cache / rem_all_item_cache
+
+对象保存或删除时(在事务内)根据注册信息计算出需要执行的缓存操作, 事务提交后
+每个缓存配置通过一个 pipeline 批量执行, 回滚时丢弃:
+    对象缓存: 删除(默认), 或 write_through=True 时写入最新对象; 过滤字段被修改时同时删除旧值对应的缓存
+    列表缓存: 对象满足过滤条件且未删除时 ZADD, 否则 ZREM(与 add_all_item_cache 相同的 Lua 脚本,
+              列表缓存不存在时不处理); 过滤条件包含函数时无法判断, 直接删除整个列表缓存
+
+框架接入见 djangox.redisx.enable_cache_hooks 与 sqlalchemyx.redisx.enable_cache_hooks
+"""
+import logging
+
+from lk_utils.redisx import ConnectionManager
+from lk_utils.redisx import local
+from lk_utils.redisx import operations
+from lk_utils.redisx import serializers
+from lk_utils.redisx import stampede
+from lk_utils.tools.base import is_collection_type
+from lk_utils.tools.base import is_func_type
+
+
+logger = logging.getLogger('redisx')
+
+_specs = {}
+
+
+class CacheSpec(object):
+    """
+    模型的缓存信息
+
+    item_keys: 对象缓存的过滤字段, 如 [('id',), ('user_id', 'app_id')]
+    lists: 列表缓存, set_all_item_cache 的参数, 如 [{'filter_dict': {'status': 1}, 'value': 'id'}]
+    """
+
+    def __init__(self, model, lists=None, item_keys=None, cache_name='default', write_through=False):
+        self.model = model
+        self.lists = lists or []
+        self.item_keys = item_keys or [('id',)]
+        self.cache_name = cache_name
+        self.write_through = write_through
+
+    @property
+    def fields(self):
+        """需要记录修改前的值的字段: 对象缓存的过滤字段与列表缓存的成员字段"""
+        fields = {field: None for fields in self.item_keys for field in fields}
+        fields.update((params.get('value', 'id'), None) for params in self.lists)
+        return list(fields)
+
+
+def register(model, lists=None, item_keys=None, cache_name='default', write_through=False):
+    spec = _specs[model] = CacheSpec(model, lists, item_keys, cache_name, write_through)
+    return spec
+
+
+def unregister(model):
+    _specs.pop(model, None)
+
+
+def get_spec(model):
+    return _specs.get(model)
+
+
+def item_filters(instance, item_keys=None):
+    """
+    对象所有对象缓存的过滤字典: id 以及 item_keys 各字段
+
+    Args:
+        instance: 模型对象
+        item_keys: 过滤字段, 如 [('user_id', 'app_id')], 默认使用注册的 item_keys
+
+    Returns: [{'id': 1}, {'user_id': 2, 'app_id': 3}]
+    """
+    if item_keys is None:
+        spec = _specs.get(type(instance))
+        item_keys = spec.item_keys if spec is not None else []
+    item_keys = [('id',)] + [fields for fields in item_keys if tuple(fields) != ('id',)]
+    return [{field: getattr(instance, field) for field in fields} for fields in item_keys]
+
+
+def collect(instance, deleted=False, previous=None):
+    """
+    计算对象变更对应的缓存操作, 需要在事务提交前调用(提交后对象属性可能已过期)
+
+    write_through 的 set 操作携带对象本身, 到 apply 时才序列化, 需要提前序列化时调用 dump
+
+    Args:
+        instance: 模型对象
+        deleted: 是否已删除
+        previous: 修改前的字段值 {field: value}, 用于删除旧值对应的对象缓存与列表成员
+
+    Returns: [(cache_name, op, key, *args)]
+    """
+    spec = _specs.get(type(instance))
+    if spec is None:
+        return []
+
+    model, cache_name = spec.model, spec.cache_name
+    previous = previous or {}
+    deleted = deleted or bool(getattr(instance, 'deleted', 0))
+    ops = []
+    for fields in spec.item_keys:
+        filter_dict = {field: getattr(instance, field) for field in fields}
+        old_filter_dict = {field: previous.get(field, value) for field, value in filter_dict.items()}
+        if old_filter_dict != filter_dict:
+            ops.append((cache_name, 'delete', operations.gen_item_cache_key(model, old_filter_dict, cache_name)))
+
+        cache_key = operations.gen_item_cache_key(model, filter_dict, cache_name)
+        if spec.write_through and not deleted:
+            ops.append((cache_name, 'set', cache_key, instance))
+        else:
+            ops.append((cache_name, 'delete', cache_key))
+
+    for params in spec.lists:
+        filter_dict = params.get('filter_dict') or {}
+        value = params.get('value', 'id')
+        cache_key = operations.gen_all_item_cache_key(model, filter_dict, value, params.get('key_str'), cache_name)
+        matched = _match(instance, filter_dict)
+        if matched is None:
+            ops.append((cache_name, 'delete', cache_key))
+            continue
+
+        member = getattr(instance, value)
+        old_member = previous.get(value, member)
+        if old_member != member:
+            ops.append((cache_name, 'zrem', cache_key, old_member))
+        if deleted or not matched:
+            ops.append((cache_name, 'zrem', cache_key, member))
+        else:
+            order_func = params.get('order_func')
+            score = order_func(instance) if order_func else instance.id
+            ops.append((cache_name, 'zadd', cache_key, member, score, params.get('limit_num')))
+    return ops
+
+
+def dump(ops, load=None):
+    """
+    序列化 write_through 的 set 操作携带的对象, 返回新的操作列表
+
+    Args:
+        ops: collect 的返回值
+        load: 序列化前调用的函数, 参数为对象, 用于加载数据库生成的字段
+
+    Returns:
+
+    """
+    result = []
+    for cache_name, op, cache_key, *args in ops:
+        if op == 'set' and not isinstance(args[0], bytes):
+            if load is not None:
+                load(args[0])
+            args = [serializers.dumps(args[0], cache_name)]
+        result.append((cache_name, op, cache_key, *args))
+    return result
+
+
+def conservative(ops):
+    """
+    嵌套事务(savepoint)内的变更可能被单独回滚, 只做删除: 对象缓存删除, 列表缓存整体删除
+    """
+    return [(cache_name, 'delete', cache_key) for cache_name, _op, cache_key, *_ in ops]
+
+
+def apply(ops):
+    """提交后执行缓存操作, 每个缓存配置一个 pipeline"""
+    grouped = {}
+    for op in ops:
+        grouped.setdefault(op[0], []).append(op[1:])
+
+    for cache_name, cache_ops in grouped.items():
+        try:
+            _apply(cache_name, cache_ops)
+        except Exception:
+            # 缓存维护失败不影响已提交的事务, 依赖缓存过期兜底
+            logger.exception('[cache hooks] apply failed: %s', cache_name)
+
+
+def _apply(cache_name, ops):
+    client = ConnectionManager()[cache_name]
+    add_script = client.register_script(operations.ADD_ALL_ITEM_SCRIPT)
+    rem_script = client.register_script(operations.REM_ALL_ITEM_SCRIPT)
+    pipe = client.pipeline(transaction=False)
+    item_keys = []
+    for op, cache_key, *args in ops:
+        if op == 'delete':
+            pipe.delete(cache_key)
+            pipe.unlink(cache_key + stampede.STALE_SUFFIX)
+            pipe.unlink(cache_key + stampede.DELTA_SUFFIX)
+            item_keys.append(cache_key)
+        elif op == 'set':
+            # 未提前序列化时在提交后序列化, 得到事务内最后的修改
+            data = args[0] if isinstance(args[0], bytes) else serializers.dumps(args[0], cache_name)
+            pipe.set(cache_key, data, operations.cache_time)
+            item_keys.append(cache_key)
+        elif op == 'zadd':
+            # 列表缓存不存在时由下次读取重建, 避免写入不完整的列表
+            member, score, limit_num = args
+            script_args = [operations.all_item_cache_time, limit_num or 0, score, member]
+            add_script(keys=[cache_key], args=script_args, client=pipe)
+        else:
+            rem_script(keys=[cache_key], args=[operations.all_item_cache_time, args[0]], client=pipe)
+    if len(pipe):
+        pipe.execute()
+
+    for cache_key in dict.fromkeys(item_keys):
+        local.invalidate(cache_key, cache_name)
+
+
+def _match(instance, filter_dict):
+    """对象是否满足列表缓存的过滤条件, 无法判断时返回 None"""
+    for key, value in filter_dict.items():
+        if is_func_type(value):
+            return None
+        field_value = getattr(instance, key, None)
+        if is_collection_type(value):
+            if field_value not in value:
+                return False
+        elif field_value != value:
+            return False
+    return True
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+进程内 L1 缓存, 挂在 Redis 前面, 用于热点对象的读取
+
+启用后 operations.get_item 优先读取进程内缓存, 未命中再读 Redis;
+delete_item_cache 会同时删除本进程缓存, 并通过 Redis pub/sub 通知其他进程失效
+
+默认所有进程的写入都广播失效通知, 只写不读的进程(如后台任务)不开启 L1 缓存也能让其他进程的 L1 缓存失效;
+所有进程都不使用 L1 缓存时可以把 PUBLISH_INVALIDATION 设为 False 省去 PUBLISH,
+此时只有开启了 L1 缓存或调用了 enable_invalidation 的缓存配置广播失效通知,
+写入方遗漏 enable_invalidation 时其他进程的 L1 缓存要等到 ttl 过期才会更新
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from lk_utils.redisx import ConnectionManager
+
+
+logger = logging.getLogger('redisx')
+
+INVALIDATE_CHANNEL = 'lk_utils:local_cache:invalidate:%s'
+# 为 True 时所有缓存配置都广播失效通知, 为 False 时只有 _publish_names 中的缓存配置广播
+PUBLISH_INVALIDATION = True
+# 订阅连接断开后的重试间隔（秒）
+RECONNECT_INTERVAL = 1
+# 订阅线程等待消息的超时时间（秒）, 也是检查停止与断线的间隔
+POLL_TIMEOUT = 1
+
+_local_caches = {}
+_listeners = {}
+# 需要广播失效通知的缓存配置
+_publish_names = set()
+_registry_lock = threading.Lock()
+
+
+class LocalCache(object):
+    """
+    有界 LRU 缓存, 每个 key 带过期时间, 线程安全
+
+    注意: 缓存的是对象本身, 多次命中返回同一个实例, 调用方不应修改返回的对象
+    """
+
+    def __init__(self, maxsize=1024, ttl=30):
+        """
+        :param maxsize: 最大缓存数量, 超出后淘汰最久未使用的 key
+        :param ttl: 过期时间（秒）
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expire_at = entry
+            if expire_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expire_at = time.monotonic() + (ttl or self.ttl)
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """命中统计, 用于评估缓存容量"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def enable_local_cache(cache_name='default', maxsize=1024, ttl=30, subscribe=True):
+    """
+    为指定缓存配置开启进程内 L1 缓存
+
+    Args:
+        cache_name: 缓存配置名称
+        maxsize: 最大缓存数量
+        ttl: 过期时间（秒）, 必须小于 operations.cache_time
+        subscribe: 是否订阅跨进程失效通知
+
+    Returns: LocalCache
+
+    """
+    from lk_utils.redisx import operations
+
+    if ttl >= operations.cache_time:
+        raise ValueError(f'local cache ttl must be shorter than cache_time({operations.cache_time}s)')
+
+    with _registry_lock:
+        _publish_names.add(cache_name)
+        cache = _local_caches.get(cache_name)
+        if cache is None:
+            cache = LocalCache(maxsize, ttl)
+            _local_caches[cache_name] = cache
+        else:
+            cache.maxsize, cache.ttl = maxsize, ttl
+
+        if subscribe and cache_name not in _listeners:
+            _listeners[cache_name] = _start_listener(cache_name, cache)
+
+    return cache
+
+
+def enable_invalidation(cache_name='default'):
+    """本进程对该缓存配置的写入都广播失效通知, 不开启 L1 缓存; PUBLISH_INVALIDATION 为 False 时使用"""
+    with _registry_lock:
+        _publish_names.add(cache_name)
+
+
+def should_publish(cache_name='default'):
+    """该缓存配置是否需要广播失效通知"""
+    return PUBLISH_INVALIDATION or cache_name in _publish_names
+
+
+def disable_local_cache(cache_name='default'):
+    """
+    关闭进程内缓存, 并停止失效通知的订阅线程
+
+    其他进程仍可能开启 L1 缓存, 本进程的写入继续广播失效通知
+    """
+    with _registry_lock:
+        _local_caches.pop(cache_name, None)
+        listener = _listeners.pop(cache_name, None)
+
+    if listener is not None:
+        listener.stop()
+
+
+def get_local_cache(cache_name='default'):
+    """获取缓存配置对应的进程内缓存, 未开启时返回 None"""
+    return _local_caches.get(cache_name)
+
+
+def invalidate(cache_key, cache_name='default', publish=None):
+    """
+    失效一个 key: 删除本进程缓存, 并广播给其他进程
+
+    Args:
+        cache_key: 缓存key
+        cache_name: 缓存配置名称
+        publish: 是否广播到其他进程, 默认见 should_publish
+
+    Returns:
+
+    """
+    cache = _local_caches.get(cache_name)
+    if cache is not None:
+        cache.delete(cache_key)
+
+    if publish is None:
+        publish = should_publish(cache_name)
+    if publish:
+        client = ConnectionManager()[cache_name]
+        client.publish(INVALIDATE_CHANNEL % cache_name, cache_key)
+
+
+def invalidate_many(cache_keys, cache_name='default', publish=None):
+    """批量失效, 参数同 invalidate, 广播通过一个 pipeline 发送"""
+    cache = _local_caches.get(cache_name)
+    if cache is not None:
+        for cache_key in cache_keys:
+            cache.delete(cache_key)
+
+    if publish is None:
+        publish = should_publish(cache_name)
+    if publish and cache_keys:
+        pipe = ConnectionManager()[cache_name].pipeline(transaction=False)
+        for cache_key in cache_keys:
+            pipe.publish(INVALIDATE_CHANNEL % cache_name, cache_key)
+        pipe.execute()
+
+
+class _Listener(threading.Thread):
+    """
+    订阅失效通知的线程, 连接断开后自动重连
+
+    订阅生效前与断开期间的通知会丢失, 每次收到 subscribe 确认都清空本进程缓存;
+    redis-py 自动重连时也会重新订阅, 同样会收到 subscribe 确认
+    """
+
+    def __init__(self, cache_name, cache):
+        super().__init__(name=f'redisx-local-cache-{cache_name}', daemon=True)
+        # 配置保存在 contextvars 中, 在调用线程中创建连接
+        self.client = ConnectionManager()[cache_name]
+        self.cache_name = cache_name
+        self.cache = cache
+        self.channel = INVALIDATE_CHANNEL % cache_name
+        self._stopped = threading.Event()
+
+    def run(self):
+        subscribed = False
+        while not self._stopped.is_set():
+            pubsub = self.client.pubsub()
+            try:
+                pubsub.subscribe(self.channel)
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=POLL_TIMEOUT)
+                    if message is None:
+                        continue
+                    if message['type'] == 'subscribe':
+                        if subscribed:
+                            logger.warning('[local cache] resubscribed, clear local cache: %s', self.cache_name)
+                        self.cache.clear()
+                        subscribed = True
+                    elif message['type'] == 'message':
+                        key = message['data']
+                        if isinstance(key, bytes):
+                            key = key.decode()
+                        self.cache.delete(key)
+            except Exception:
+                logger.exception('[local cache] invalidation listener failed: %s', self.cache_name)
+                self._stopped.wait(RECONNECT_INTERVAL)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+    def stop(self):
+        self._stopped.set()
+
+
+def _start_listener(cache_name, cache):
+    thread = _Listener(cache_name, cache)
+    thread.start()
+    logger.info('[local cache] subscribe invalidation channel: %s', cache_name)
+    return thread
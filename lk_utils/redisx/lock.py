@@ -1,11 +1,116 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
 from redis.exceptions import LockError
+from redis.exceptions import LockNotOwnedError
+from redis.exceptions import RedisError
 from redis.lock import Lock as LockBase
 
+from lk_utils.redisx import metrics
+
+
+logger = logging.getLogger('redisx')
+
+# 公平模式: 等待队列按入队时间排序, 只有队首可以获取锁; 等待者超过 alive 截止时间未刷新时移出队列
+# ARGV[2] 为锁的过期时间（毫秒）, 0 表示不过期
+# ARGV[5] 为 1 时是非阻塞获取: 不入队, 队列中还有等待者时直接失败
+FAIR_ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local queued = ARGV[5] ~= '1'
+if queued then
+    redis.call('ZADD', KEYS[2], 'NX', now, ARGV[1])
+    redis.call('HSET', KEYS[3], ARGV[1], now + tonumber(ARGV[3]))
+    redis.call('PEXPIRE', KEYS[2], ARGV[4])
+    redis.call('PEXPIRE', KEYS[3], ARGV[4])
+end
+while true do
+    local head = redis.call('ZRANGE', KEYS[2], 0, 0)[1]
+    if not head then
+        if queued then
+            return 0
+        end
+        break
+    end
+    local deadline = tonumber(redis.call('HGET', KEYS[3], head))
+    if deadline and deadline >= now then
+        if head ~= ARGV[1] then
+            return 0
+        end
+        break
+    end
+    redis.call('ZREM', KEYS[2], head)
+    redis.call('HDEL', KEYS[3], head)
+end
+local acquired
+if tonumber(ARGV[2]) > 0 then
+    acquired = redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2])
+else
+    acquired = redis.call('SET', KEYS[1], ARGV[1], 'NX')
+end
+if acquired then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# 可重入锁使用 hash 保存 {owner: 重入次数}
+REENTRANT_ACQUIRE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 or redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    local count = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+    if tonumber(ARGV[2]) > 0 then
+        redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return count
+end
+return 0
+"""
+
+REENTRANT_RELEASE_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if count > 0 then
+    return count
+end
+redis.call('DEL', KEYS[1])
+return 0
+"""
+
+REENTRANT_RENEW_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_PROCESS_ID = uuid.uuid4().hex
+
+
+def _has_hash_tag(name):
+    """名称中是否有集群 hash tag: 第一个 { 之后存在非空的 }"""
+    if isinstance(name, bytes):
+        name = name.decode()
+    start = name.find("{")
+    return start >= 0 and name.find("}", start + 2) > 0
+
 
 class Lock(LockBase):
     """
     使用redis自带Lock改进的锁, 支持阻塞操作, 向下兼容
     默认redis Lock使用Context为阻塞，修改为非阻塞
+
+    watchdog: 持有期间后台线程每 timeout/3 秒续期一次, 释放或进程退出后停止, 适合耗时不确定的任务
+    fair: 阻塞等待时按先后顺序排队, 通过 pub/sub 通知代替轮询; 非阻塞获取不入队, 队列中有等待者时直接失败;
+          锁与等待队列需要在同一个 slot, 名称中没有 hash tag 时使用 {name} 作为锁的 key,
+          同一名称的锁需要都使用公平模式
     """
 
     def __init__(self, name, *args, **kwargs):
@@ -16,6 +121,10 @@ class Lock(LockBase):
         :param name: 锁名称
         :param timeout: 锁的存在时间（秒）
         :param blocking: 锁阻塞, 默认关闭
+        :param client: redis 连接, 默认使用 default 配置
+        :param watchdog: 持有期间自动续期, 默认关闭
+        :param fair: 公平模式, 阻塞等待按先后顺序获取, 默认关闭
+        :param metrics_label: 等待耗时统计(lock_wait_seconds)中的名称, 默认不区分
         :param args:
         :param kwargs:
         """
@@ -23,8 +132,130 @@ class Lock(LockBase):
         kwargs.setdefault("timeout", 20)
         # 非阻塞
         kwargs.setdefault("blocking", False)
-        from lk_utils.redisx import client
+        client = kwargs.pop("client", None)
+        self.watchdog = kwargs.pop("watchdog", False)
+        self.fair = kwargs.pop("fair", False)
+        self.metrics_label = kwargs.pop("metrics_label", None)
+        if client is None:
+            from lk_utils.redisx import client
+        if self.fair and not _has_hash_tag(name):
+            # 集群模式下锁、等待队列与等待者 key 在同一个 slot, Lua 脚本才能同时访问
+            name = "{%s}" % name
         super().__init__(client, name, *args, **kwargs)
+        if self.watchdog and not self.timeout:
+            raise LockError("watchdog requires a timeout")
+        self._watchdog = None
+        self._fair_script = client.register_script(FAIR_ACQUIRE_SCRIPT) if self.fair else None
+
+    @property
+    def queue_name(self):
+        return f"{self.name}:queue"
+
+    @property
+    def alive_name(self):
+        return f"{self.name}:alive"
+
+    @property
+    def wakeup_channel(self):
+        return f"{self.name}:wakeup"
+
+    def acquire(self, sleep=None, blocking=None, blocking_timeout=None, token=None):
+        started = metrics.start()
+        if blocking is None:
+            blocking = self.blocking
+        if self.fair:
+            acquired = self._acquire_fair(blocking_timeout, token, blocking)
+        else:
+            acquired = super().acquire(sleep, blocking, blocking_timeout, token)
+        metrics.observe(
+            "lock_wait_seconds", started, "", self.metrics_label, "acquired" if acquired else "failed"
+        )
+        if acquired and self.watchdog and self._watchdog is None:
+            self._start_watchdog(self.local.token)
+        return acquired
+
+    def release(self):
+        self._stop_watchdog()
+        super().release()
+        if self.fair:
+            self.redis.publish(self.wakeup_channel, 1)
+
+    def _acquire_fair(self, blocking_timeout, token, blocking=True):
+        if blocking_timeout is None:
+            blocking_timeout = self.blocking_timeout
+        if token is None:
+            token = uuid.uuid1().hex.encode()
+        else:
+            token = self.redis.get_encoder().encode(token)
+
+        deadline = None if blocking_timeout is None else time.monotonic() + blocking_timeout
+        # 等待者超过 3 个检查周期未刷新视为已退出
+        interval = max(self.sleep, 0.1)
+        alive_ms = int(interval * 3000)
+        expire_ms = max(int((self.timeout or 0) * 1000), alive_ms) * 2
+        timeout_ms = int(self.timeout * 1000) if self.timeout else 0
+        keys = [self.name, self.queue_name, self.alive_name]
+
+        if not blocking:
+            acquired = self._fair_script(keys=keys, args=[token, timeout_ms, alive_ms, expire_ms, 1])
+            if acquired:
+                self.local.token = token
+            return bool(acquired)
+
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.wakeup_channel)
+        try:
+            while True:
+                if self._fair_script(keys=keys, args=[token, timeout_ms, alive_ms, expire_ms, 0]):
+                    self.local.token = token
+                    return True
+
+                wait = interval
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._leave_queue(token)
+                        return False
+                    wait = min(wait, remaining)
+                # 锁释放时会收到通知, 超时后也会重试, 防止通知丢失
+                pubsub.get_message(timeout=wait)
+        finally:
+            pubsub.close()
+
+    def _leave_queue(self, token):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrem(self.queue_name, token)
+        pipe.hdel(self.alive_name, token)
+        # 自己可能是队首, 通知后面的等待者
+        pipe.publish(self.wakeup_channel, 1)
+        pipe.execute()
+
+    def _renew(self, token):
+        """续期到 timeout, 锁已不属于 token 时返回 False"""
+        return bool(self.lua_reacquire(keys=[self.name], args=[token, int(self.timeout * 1000)], client=self.redis))
+
+    def _start_watchdog(self, token):
+        stop = threading.Event()
+        interval = self.timeout / 3
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    if not self._renew(token):
+                        logger.warning("[lock] %s: lock lost, watchdog stopped", self.name)
+                        return
+                except RedisError as e:
+                    # 续期失败时继续重试, 锁在 timeout 后自然过期
+                    logger.warning("[lock] %s: watchdog renew failed: %s", self.name, e)
+
+        thread = threading.Thread(target=run, name=f"redisx-lock-watchdog:{self.name}", daemon=True)
+        thread.start()
+        self._watchdog = stop
+
+    def _stop_watchdog(self):
+        stop, self._watchdog = self._watchdog, None
+        if stop is not None:
+            stop.set()
 
     def __enter__(self):
         # force blocking, as otherwise the user would have to check whether
@@ -42,3 +273,68 @@ class Lock(LockBase):
         except LockError:
             # Cannot release an unlocked lock
             return False
+
+
+class ReentrantLock(Lock):
+    """
+    可重入锁, 同一个 owner 可以重复获取, 释放相同次数后才真正释放
+
+    owner 默认为 进程+线程, 可以传入任务id等字符串, 在不同进程间共享同一个持有者;
+    锁数据为 hash 结构, 同一个锁名称不能与 Lock 混用; 不支持公平模式
+    """
+
+    def __init__(self, name, *args, **kwargs):
+        """
+        :param owner: 持有者标识, 默认 进程+线程
+        """
+        self.owner = kwargs.pop("owner", None)
+        if kwargs.get("fair"):
+            raise LockError("reentrant lock does not support fair mode")
+        super().__init__(name, *args, **kwargs)
+        self._acquire_script = self.redis.register_script(REENTRANT_ACQUIRE_SCRIPT)
+        self._release_script = self.redis.register_script(REENTRANT_RELEASE_SCRIPT)
+        self._renew_script = self.redis.register_script(REENTRANT_RENEW_SCRIPT)
+
+    def _owner_token(self):
+        if self.owner is not None:
+            return self.owner
+        return f"{_PROCESS_ID}:{os.getpid()}:{threading.get_ident()}"
+
+    def acquire(self, sleep=None, blocking=None, blocking_timeout=None, token=None):
+        return super().acquire(sleep, blocking, blocking_timeout, token or self._owner_token())
+
+    def do_acquire(self, token):
+        timeout = int(self.timeout * 1000) if self.timeout else 0
+        return bool(self._acquire_script(keys=[self.name], args=[token, timeout]))
+
+    def release(self):
+        token = self.local.token or self.redis.get_encoder().encode(self._owner_token())
+        remaining = self._release_script(keys=[self.name], args=[token])
+        if remaining < 0:
+            self.local.token = None
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+        if remaining == 0:
+            self.local.token = None
+            self._stop_watchdog()
+
+    def owned(self):
+        token = self.local.token or self.redis.get_encoder().encode(self._owner_token())
+        return bool(self.redis.hexists(self.name, token))
+
+    def do_extend(self, additional_time, replace_ttl):
+        token = self.local.token
+        if replace_ttl:
+            return self._renew(token) or self._not_owned()
+        ttl = self.redis.pttl(self.name)
+        if ttl < 0 or not self._renew_script(keys=[self.name], args=[token, ttl + int(additional_time * 1000)]):
+            self._not_owned()
+        return True
+
+    def do_reacquire(self):
+        return self._renew(self.local.token) or self._not_owned()
+
+    def _renew(self, token):
+        return bool(self._renew_script(keys=[self.name], args=[token, int(self.timeout * 1000)]))
+
+    def _not_owned(self):
+        raise LockNotOwnedError("Cannot extend a lock that's no longer owned")
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+函数结果缓存, 同时支持普通函数与协程函数
+
+    @cached(60, jitter=10)
+    def get_config(app_id, lang='zh'):
+        ...
+
+    get_config(1)                      # 读取缓存
+    get_config(1, force_reload=True)   # 强制刷新
+    get_config.invalidate(1)           # 删除缓存
+    get_config.warm(1)                 # 预热(重新计算并写入)
+
+缓存key: <module>.<qualname>?<参数名>=<值>&..., 参数按函数签名绑定并补全默认值,
+f(1) 与 f(a=1) 使用同一个key; force_reload 不参与生成key; 过长时使用 md5
+方法的 self 以 key_func(self) 或 self.id 参与生成key, 两者都没有时调用报错; cls 以类的完整名称参与
+返回 None 时以 NEGATIVE_VALUE 占位缓存, 0、空列表等空结果同样缓存
+"""
+import asyncio
+import hashlib
+import inspect
+import random
+import threading
+import time
+from functools import wraps
+
+from redis.exceptions import LockError
+
+from lk_utils.redisx import ConnectionManager
+from lk_utils.redisx import metrics
+from lk_utils.redisx import serializers
+from lk_utils.redisx import stampede
+from lk_utils.redisx import tracking
+
+
+# 参数部分超过该长度时使用 md5
+max_key_len = 200
+
+
+def cached(ttl=300, cache_name='default', single_flight=False, early_refresh=False, stale_ttl=None, jitter=0,
+           batch=False, key_prefix=None, key_func=None, tm=None):
+    """
+    缓存函数结果
+
+    Args:
+        ttl: 缓存时间（秒）
+        cache_name: 缓存配置名称
+        single_flight: 缓存失效时只允许一个进程重建, 其他进程返回旧值或等待
+        early_refresh: 是否开启 XFetch 提前刷新, 只支持普通函数
+        stale_ttl: 旧值额外保留时间（秒）, 设置后自动开启 single_flight
+        jitter: 缓存时间随机增加 0 ~ jitter 秒, 避免同时失效
+        batch: 本进程内相同参数的并发调用只计算一次, 共享结果
+        key_prefix: 缓存key前缀, 默认 <module>.<qualname>
+        key_func: 用于方法, 参数为 self, 返回实例的标识; 默认使用 self.id
+        tm: ttl 的旧名称, 兼容旧版本
+
+    Returns:
+
+    """
+    if tm is not None:
+        ttl = tm
+    if stale_ttl is not None:
+        single_flight = True
+
+    def middle(func):
+        memo = Memoize(func, ttl, cache_name, single_flight, early_refresh, stale_ttl, jitter, batch, key_prefix,
+                       key_func)
+        if inspect.iscoroutinefunction(func):
+            if early_refresh:
+                raise ValueError('early_refresh is not supported for coroutine functions')
+
+            @wraps(func)
+            async def async_wrap(*args, **kwargs):
+                return await memo.acall(*args, **kwargs)
+
+            async_wrap.invalidate = memo.ainvalidate
+            async_wrap.warm = memo.awarm
+            async_wrap.cache_key = memo.cache_key
+            return async_wrap
+
+        @wraps(func)
+        def wrap(*args, **kwargs):
+            return memo.call(*args, **kwargs)
+
+        wrap.invalidate = memo.invalidate
+        wrap.warm = memo.warm
+        wrap.cache_key = memo.cache_key
+        return wrap
+
+    return middle
+
+
+class _Call(object):
+    """batch 模式下正在进行的调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Memoize(object):
+
+    def __init__(self, func, ttl, cache_name='default', single_flight=False, early_refresh=False, stale_ttl=None,
+                 jitter=0, batch=False, key_prefix=None, key_func=None):
+        self.func = func
+        self.ttl = ttl
+        self.cache_name = cache_name
+        self.single_flight = single_flight
+        self.early_refresh = early_refresh
+        self.stale_ttl = stale_ttl
+        self.jitter = jitter
+        self.batch = batch
+        self.key_prefix = key_prefix or f'{func.__module__}.{func.__qualname__}'
+        self.key_func = key_func
+        self.signature = inspect.signature(func)
+
+        parameters = list(self.signature.parameters.values())
+        self.accepts_force_reload = 'force_reload' in self.signature.parameters
+        self.ignored = {'force_reload'}
+        self.instance_param = None
+        if parameters and parameters[0].name in ('self', 'cls'):
+            self.instance_param = parameters[0].name
+
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def cache_key(self, *args, **kwargs):
+        """参数对应的缓存key"""
+        kwargs.pop('force_reload', None)
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+
+        parts = []
+        for name, value in bound.arguments.items():
+            if name in self.ignored:
+                continue
+            if name == self.instance_param:
+                value = self._identity(value)
+            kind = self.signature.parameters[name].kind
+            if kind == inspect.Parameter.VAR_KEYWORD:
+                parts.extend('%s=%s' % (k, _key_str(value[k])) for k in sorted(value))
+            else:
+                parts.append('%s=%s' % (name, _key_str(value)))
+
+        query = '&'.join(parts)
+        if len(query) > max_key_len:
+            query = '#' + hashlib.md5(query.encode()).hexdigest()
+        return f'{self.key_prefix}?{query}'
+
+    def _identity(self, instance):
+        """self/cls 在缓存key中的标识, 不同实例的结果不能共用缓存"""
+        if self.key_func is not None:
+            return self.key_func(instance)
+        if isinstance(instance, type):
+            return f'{instance.__module__}.{instance.__qualname__}'
+
+        identity = getattr(instance, 'id', None)
+        if identity is None:
+            raise TypeError(
+                f'{self.key_prefix}: cached method requires an "id" attribute or key_func '
+                f'to identify {type(instance).__name__} instances'
+            )
+        return identity
+
+    def _pop_force_reload(self, kwargs):
+        if self.accepts_force_reload:
+            return kwargs.get('force_reload', False)
+        return kwargs.pop('force_reload', False)
+
+    def _ttl(self):
+        if self.jitter:
+            return self.ttl + random.randint(0, self.jitter)
+        return self.ttl
+
+    def _dumps(self, value):
+        if value is None:
+            return serializers.NEGATIVE_VALUE
+        data = serializers.get_serializer(self.cache_name).dumps(value)
+        metrics.incr('bytes_serialized', self.cache_name, self.func, len(data))
+        return data
+
+    @staticmethod
+    def _loads(data):
+        if data == serializers.NEGATIVE_VALUE:
+            return None
+        return serializers.loads(data)
+
+    def _timed(self, compute):
+        metrics.incr('db_fallbacks', self.cache_name, self.func)
+        with metrics.timer('query_seconds', self.cache_name, self.func, 'call'):
+            return compute()
+
+    # 普通函数
+
+    def call(self, *args, **kwargs):
+        force_reload = self._pop_force_reload(kwargs)
+        cache_key = self.cache_key(*args, **kwargs)
+        if not self.batch:
+            return self._get(cache_key, args, kwargs, force_reload)
+
+        with self._inflight_lock:
+            call = self._inflight.get(cache_key)
+            leader = call is None
+            if leader:
+                call = self._inflight[cache_key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self._get(cache_key, args, kwargs, force_reload)
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(cache_key, None)
+            call.event.set()
+
+    def _get(self, cache_key, args, kwargs, force_reload):
+        client = ConnectionManager()[self.cache_name]
+        ttl = self._ttl()
+
+        def compute():
+            return self._timed(lambda: self.func(*args, **kwargs))
+
+        if self.single_flight or self.early_refresh:
+            return stampede.fetch(
+                client, cache_key, compute, ttl,
+                single_flight=self.single_flight, early_refresh=self.early_refresh, force_reload=force_reload,
+                serializer=serializers.get_serializer(self.cache_name), stale_ttl=self.stale_ttl, cache_empty=True
+            )
+
+        # 开启了客户端缓存(tracking.enable_tracking)时不访问 Redis
+        with metrics.timer('redis_seconds', self.cache_name, self.func, 'get'):
+            data = None if force_reload else tracking.get(cache_key, self.cache_name)
+        if data:
+            metrics.incr('hits', self.cache_name, self.func)
+            return self._loads(data)
+
+        metrics.incr('misses', self.cache_name, self.func)
+        value = compute()
+        client.set(cache_key, self._dumps(value), ttl)
+        return value
+
+    def invalidate(self, *args, **kwargs):
+        """删除参数对应的缓存"""
+        cache_key = self.cache_key(*args, **kwargs)
+        client = ConnectionManager()[self.cache_name]
+        pipe = client.pipeline(transaction=False)
+        pipe.delete(cache_key)
+        pipe.unlink(cache_key + stampede.STALE_SUFFIX)
+        pipe.unlink(cache_key + stampede.DELTA_SUFFIX)
+        return bool(pipe.execute()[0])
+
+    def warm(self, *args, **kwargs):
+        """重新计算并写入缓存, 返回计算结果"""
+        kwargs['force_reload'] = True
+        return self.call(*args, **kwargs)
+
+    # 协程函数
+
+    async def acall(self, *args, **kwargs):
+        force_reload = self._pop_force_reload(kwargs)
+        cache_key = self.cache_key(*args, **kwargs)
+        if not self.batch:
+            return await self._aget(cache_key, args, kwargs, force_reload)
+
+        loop = asyncio.get_running_loop()
+        with self._inflight_lock:
+            future = self._inflight.get(cache_key)
+            leader = future is None or future.get_loop() is not loop
+            if leader:
+                future = self._inflight[cache_key] = loop.create_future()
+
+        if not leader:
+            return await asyncio.shield(future)
+
+        try:
+            value = await self._aget(cache_key, args, kwargs, force_reload)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他调用方等待时避免 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            with self._inflight_lock:
+                if self._inflight.get(cache_key) is future:
+                    self._inflight.pop(cache_key)
+
+    async def _aget(self, cache_key, args, kwargs, force_reload):
+        from lk_utils.redisx.aio import ConnectionManager as AsyncConnectionManager
+        from lk_utils.redisx.aio.lock import Lock
+
+        client = AsyncConnectionManager()[self.cache_name]
+        if not force_reload:
+            with metrics.timer('redis_seconds', self.cache_name, self.func, 'get'):
+                data = await client.get(cache_key)
+            if data:
+                metrics.incr('hits', self.cache_name, self.func)
+                return self._loads(data)
+            metrics.incr('misses', self.cache_name, self.func)
+
+        if not self.single_flight or force_reload:
+            return await self._abuild(client, cache_key, args, kwargs)
+
+        lock = Lock(cache_key + stampede.LOCK_SUFFIX, timeout=stampede.lock_timeout, client=client)
+        if await lock.acquire():
+            try:
+                return await self._abuild(client, cache_key, args, kwargs)
+            finally:
+                try:
+                    await lock.release()
+                except LockError:
+                    pass
+
+        # 其他进程正在重建, 优先返回旧值
+        stale = await client.get(cache_key + stampede.STALE_SUFFIX)
+        if stale:
+            return self._loads(stale)
+
+        deadline = time.monotonic() + stampede.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(stampede.wait_interval)
+            data = await client.get(cache_key)
+            if data:
+                return self._loads(data)
+            if not await client.exists(cache_key + stampede.LOCK_SUFFIX):
+                break
+
+        return await self._abuild(client, cache_key, args, kwargs)
+
+    async def _abuild(self, client, cache_key, args, kwargs):
+        metrics.incr('db_fallbacks', self.cache_name, self.func)
+        with metrics.timer('query_seconds', self.cache_name, self.func, 'call'):
+            value = await self.func(*args, **kwargs)
+
+        ttl = self._ttl()
+        data = self._dumps(value)
+        pipe = client.pipeline(transaction=False)
+        pipe.set(cache_key, data, ttl)
+        if self.single_flight:
+            stale_ttl = stampede.stale_ttl if self.stale_ttl is None else self.stale_ttl
+            pipe.set(cache_key + stampede.STALE_SUFFIX, data, ttl + stale_ttl)
+        await pipe.execute()
+        return value
+
+    async def ainvalidate(self, *args, **kwargs):
+        from lk_utils.redisx.aio import ConnectionManager as AsyncConnectionManager
+
+        cache_key = self.cache_key(*args, **kwargs)
+        client = AsyncConnectionManager()[self.cache_name]
+        pipe = client.pipeline(transaction=False)
+        pipe.delete(cache_key)
+        pipe.unlink(cache_key + stampede.STALE_SUFFIX)
+        pipe.unlink(cache_key + stampede.DELTA_SUFFIX)
+        return bool((await pipe.execute())[0])
+
+    async def awarm(self, *args, **kwargs):
+        kwargs['force_reload'] = True
+        return await self.acall(*args, **kwargs)
+
+
+def _key_str(value):
+    """参数值转为稳定的字符串, dict/set 排序后拼接"""
+    if isinstance(value, dict):
+        items = sorted((str(k), _key_str(v)) for k, v in value.items())
+        return '{%s}' % ','.join('%s:%s' % item for item in items)
+    if isinstance(value, (set, frozenset)):
+        return '{%s}' % ','.join(sorted(_key_str(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ','.join(_key_str(v) for v in value)
+    return str(value)
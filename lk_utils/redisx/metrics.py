@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+redisx 操作的统计指标
+
+默认关闭, 关闭时每个埋点只有一次函数调用和一次布尔判断; 通过 enable 开启:
+
+    from lk_utils.redisx import metrics
+    metrics.enable(metrics.StatsdExporter('127.0.0.1', 8125))
+
+计数器(按 cache、model 区分):
+    hits: 命中缓存(包括进程内缓存)的对象数量
+    misses: 未命中缓存的对象数量
+    db_fallbacks: 调用 query_func 等回源查询的次数
+    bytes_serialized: 写入缓存的序列化数据字节数
+    errors: 计时的 Redis 请求或回源查询抛出异常的次数
+
+直方图(按 cache、model、op 区分, 单位秒):
+    redis_seconds: Redis 请求耗时
+    query_seconds: 回源查询耗时
+    lock_wait_seconds: redisx.lock 获取锁的等待耗时, op 为 acquired/failed, model 为锁的 metrics_label
+    ratelimit_wait_seconds: redisx.ratelimit 限流/信号量的等待耗时, op 为 acquired/rejected, model 为名称
+
+导出方式:
+    PrometheusExporter: render() 返回 Prometheus 文本格式, 挂到 /metrics 接口即可
+    StatsdExporter: 每次埋点通过 UDP 发送到 statsd
+    LogExporter: flush() 时通过 lk_utils.log 输出当前累计值
+"""
+import socket
+import threading
+import time
+
+from lk_utils.log.base import info
+
+
+enabled = False
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_counters = {}
+_histograms = {}
+_exporters = []
+_lock = threading.Lock()
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        """Prometheus 格式的累计桶"""
+        total, result = 0, []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Exporter(object):
+    """导出方式的基类, 按需覆盖"""
+
+    def incr(self, name, labels, amount):
+        pass
+
+    def timing(self, name, labels, seconds):
+        pass
+
+    def flush(self):
+        pass
+
+
+class PrometheusExporter(Exporter):
+
+    def __init__(self, namespace='redisx'):
+        self.namespace = namespace
+
+    def render(self):
+        """返回 Prometheus 文本格式(text/plain; version=0.0.4)"""
+        counters, histograms = snapshot()
+        lines = []
+        for name in sorted({key[0] for key in counters}):
+            metric = f'{self.namespace}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for (key_name, labels), value in sorted(counters.items()):
+                if key_name == name:
+                    lines.append(f'{metric}{_format_labels(labels)} {value}')
+
+        for name in sorted({key[0] for key in histograms}):
+            metric = f'{self.namespace}_{name}'
+            lines.append(f'# TYPE {metric} histogram')
+            for (key_name, labels), histogram in sorted(histograms.items(), key=lambda x: x[0]):
+                if key_name != name:
+                    continue
+                for bound, count in histogram.cumulative():
+                    bucket_labels = labels + (('le', repr(float(bound))),)
+                    lines.append(f'{metric}_bucket{_format_labels(bucket_labels)} {count}')
+                lines.append(f'{metric}_bucket{_format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+                lines.append(f'{metric}_sum{_format_labels(labels)} {histogram.sum}')
+                lines.append(f'{metric}_count{_format_labels(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdExporter(Exporter):
+    """
+    statsd 协议, 标签使用 DogStatsD 的 |#key:value 格式
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='redisx', tags=True):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.tags = tags
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def incr(self, name, labels, amount):
+        self._send(f'{self.prefix}.{name}:{amount}|c', labels)
+
+    def timing(self, name, labels, seconds):
+        self._send(f'{self.prefix}.{name}:{seconds * 1000:.3f}|ms', labels)
+
+    def _send(self, data, labels):
+        if self.tags and labels:
+            data += '|#' + ','.join(f'{key}:{value}' for key, value in labels if value)
+        try:
+            self._socket.sendto(data.encode(), self.address)
+        except OSError:
+            # UDP 发送失败不影响业务
+            pass
+
+
+class LogExporter(Exporter):
+
+    def __init__(self, logger_name='redisx'):
+        self.logger_name = logger_name
+
+    def flush(self):
+        counters, histograms = snapshot()
+        for (name, labels), value in sorted(counters.items()):
+            info(self.logger_name, '[metrics] %s%s %s', name, _format_labels(labels), value)
+        for (name, labels), histogram in sorted(histograms.items(), key=lambda x: x[0]):
+            avg = histogram.sum / histogram.count if histogram.count else 0
+            info(self.logger_name, '[metrics] %s%s count=%s avg=%.6f',
+                 name, _format_labels(labels), histogram.count, avg)
+
+
+def enable(*exporters):
+    """开启统计, 可同时指定多个导出方式"""
+    global enabled
+    with _lock:
+        _exporters[:] = exporters
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+    with _lock:
+        _exporters.clear()
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def model_label(model):
+    if model is None:
+        return ''
+    if isinstance(model, str):
+        return model
+    return getattr(model, '__name__', None) or type(model).__name__
+
+
+def start():
+    """计时开始, 未开启时返回 None"""
+    if not enabled:
+        return None
+    return time.perf_counter()
+
+
+def incr(name, cache_name, model=None, amount=1):
+    if not enabled or not amount:
+        return
+
+    labels = (('cache', cache_name), ('model', model_label(model)))
+    with _lock:
+        key = (name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+        exporters = tuple(_exporters)
+    for exporter in exporters:
+        exporter.incr(name, labels, amount)
+
+
+def observe(name, started, cache_name, model=None, op=''):
+    """
+    记录耗时
+
+    Args:
+        name: redis_seconds, query_seconds
+        started: start() 的返回值
+        cache_name: 缓存配置名称
+        model: 模型类或函数名
+        op: 操作名称, 如 get, mget, zrange
+
+    Returns:
+
+    """
+    if started is None or not enabled:
+        return
+
+    seconds = time.perf_counter() - started
+    labels = (('cache', cache_name), ('model', model_label(model)), ('op', op))
+    with _lock:
+        key = (name, labels)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+        exporters = tuple(_exporters)
+    for exporter in exporters:
+        exporter.timing(name, labels, seconds)
+
+
+class _Timer(object):
+    __slots__ = ('name', 'cache_name', 'model', 'op', 'started')
+
+    def __init__(self, name, cache_name, model, op):
+        self.name = name
+        self.cache_name = cache_name
+        self.model = model
+        self.op = op
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            incr('errors', self.cache_name, self.model)
+        observe(self.name, self.started, self.cache_name, self.model, self.op)
+        return False
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+def timer(name, cache_name, model=None, op=''):
+    """
+    with 语句计时, 参数同 observe; 代码块抛出异常时 errors 加 1, 未开启时返回空操作对象
+
+        with metrics.timer('redis_seconds', cache_name, model, 'get'):
+            data = client.get(cache_key)
+    """
+    if not enabled:
+        return _null_timer
+    return _Timer(name, cache_name, model, op)
+
+
+def snapshot():
+    """当前累计值: ({(name, labels): value}, {(name, labels): Histogram})"""
+    with _lock:
+        histograms = {}
+        for key, histogram in _histograms.items():
+            copied = Histogram(histogram.buckets)
+            copied.counts = list(histogram.counts)
+            copied.sum, copied.count = histogram.sum, histogram.count
+            histograms[key] = copied
+        return dict(_counters), histograms
+
+
+def flush():
+    """调用各导出方式的 flush, 如 LogExporter 输出累计值"""
+    with _lock:
+        exporters = tuple(_exporters)
+    for exporter in exporters:
+        exporter.flush()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+    return '{%s}' % pairs
@@ -1,37 +1,110 @@
 # -*- coding: utf-8 -*-
-import pickle as pickle
+import base64
+import hashlib
+import time
 import urllib
+import uuid
+from functools import lru_cache
 
 from lk_utils.redisx import ConnectionManager
+from lk_utils.redisx import local
+from lk_utils.redisx import metrics
+from lk_utils.redisx import serializers
+from lk_utils.redisx import stampede
+from lk_utils.redisx.memoize import cached  # noqa: F401
 from lk_utils.tools.base import is_collection_type
 from lk_utils.tools.base import is_func_type
 from lk_utils.tools.base import is_value_type
 
 
 cache_time = 300
+# 空值缓存时间（秒）, 0 表示不缓存查询不到的数据
+negative_cache_time = 0
 FORCE_RELOAD = False
-
-
-def cached(tm, cache_name='default'):
-    def middle(func):
-        def wrap(*args, **kwargs):
-            module = func.__module__.split('.')[1]
-            cache_key = f"{module}.{func.__name__}?{','.join([str(r) for r in args])}"
-            cache_key += ','.join([str(r[1]) for r in list(kwargs.items())])
-            client = ConnectionManager()[cache_name]
-            data = client.get(cache_key)
-            force_reload = kwargs.pop('force_reload', None)
-            if data and not force_reload:
-                return pickle.loads(data)
-
-            data = func(*args, **kwargs)
-            if data:
-                client.set(cache_key, pickle.dumps(data), tm)
-            return data
-
-        return wrap
-
-    return middle
+# 集合类过滤值转为字符串后超过该长度时, 使用摘要代替, 保证 key 长度有界
+max_collection_key_len = 64
+# 命名空间版本号在进程内的缓存时间（秒）
+version_cache_time = 1
+NAMESPACE_VERSION_KEY = '%s.ns_version'
+_namespace_versions = {}
+# 过滤字典的 (字段, 值类型) 组合 -> (key 模板, 需要填值的字段)
+_filter_key_templates = {}
+# (模型类, 过滤字典的 (字段, 值类型) 组合) -> (不含命名空间的 key 模板, 需要填值的字段)
+_item_key_templates = {}
+# 列表缓存重建时每批读取/写入的数量
+rebuild_chunk_size = 1000
+# 列表缓存时间（秒）, add_all_item_cache / rem_all_item_cache 更新时同时续期
+all_item_cache_time = 60 * 30
+
+CLEAR_NEGATIVE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 列表缓存存在时才写入, 避免 EXISTS 与 ZADD 之间 key 过期留下只有新元素的列表
+# ARGV: 缓存时间, 最大数量(0 不限制), score1, member1, score2, member2 ...
+# 返回写入的数量, 列表缓存不存在时返回 -1
+ADD_ALL_ITEM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+local added = 0
+for i = 3, #ARGV, 2 do
+    added = added + redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+local limit = tonumber(ARGV[2])
+if limit > 0 then
+    -- 与重建时 limit_num 一致, 保留分数最大的部分
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -limit - 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return added
+"""
+
+# 游标分页读取一页, ARGV: 是否倒序, 每页数量, 分数, 上一页最后一个成员, 跳过数量
+# 上一页最后一个成员仍在列表中且分数未变时按它的排名定位(同分数的成员按字典序排列), 否则按分数与跳过数量定位
+# 返回 [member1, score1, member2, score2 ...], 列表缓存不存在时返回 nil
+CURSOR_RANGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local reverse = ARGV[1] == '1'
+local num = tonumber(ARGV[2])
+local start = 0
+if ARGV[3] ~= '' then
+    local current = redis.call('ZSCORE', KEYS[1], ARGV[4])
+    if not current or tonumber(current) ~= tonumber(ARGV[3]) then
+        if reverse then
+            return redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[3], '-inf', 'WITHSCORES', 'LIMIT', ARGV[5], num)
+        end
+        return redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[3], '+inf', 'WITHSCORES', 'LIMIT', ARGV[5], num)
+    end
+    if reverse then
+        start = redis.call('ZREVRANK', KEYS[1], ARGV[4]) + 1
+    else
+        start = redis.call('ZRANK', KEYS[1], ARGV[4]) + 1
+    end
+end
+if reverse then
+    return redis.call('ZREVRANGE', KEYS[1], start, start + num - 1, 'WITHSCORES')
+end
+return redis.call('ZRANGE', KEYS[1], start, start + num - 1, 'WITHSCORES')
+"""
+
+# ARGV: 缓存时间, member1, member2 ...
+REM_ALL_ITEM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+local removed = 0
+for i = 2, #ARGV do
+    removed = removed + redis.call('ZREM', KEYS[1], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return removed
+"""
 
 
 def gen_kv_cache_key(key, val):
@@ -51,33 +124,170 @@ def gen_kv_cache_key(key, val):
 
     # list, set
     elif is_collection_type(val):
-        return "{}={}".format(key, sort_list_to_str(val))
+        return "{}={}".format(key, _collection_key_value(val))
 
     else:
         print("Warning: [gen_kv_cache_key]未匹配的值类型! %r, %r" % (key, val))
         return "{}={}".format(str(key), str(val))
 
 
-def gen_item_cache_key(model, filter_dict):
+@lru_cache(maxsize=None)
+def _model_key_parts(model):
+    """模型的 (db_name, module_name, table_name), 按模型类缓存"""
+    module_name = model.__module__.split('.')
+    module_name = module_name[1] if len(module_name) > 1 else module_name[0]
+    return model.db_name, module_name, model.table_name
+
+
+def _collection_key_value(val):
+    """集合去重排序后的字符串, 过长时使用摘要"""
+    val_str = sort_list_to_str(val)
+    if len(val_str) > max_collection_key_len:
+        return '#' + hashlib.md5(val_str.encode()).hexdigest()
+    return val_str
+
+
+def _escape_template(value):
+    return value.replace('{', '{{').replace('}', '}}')
+
+
+def _filter_key_part(key, val):
+    """
+    单个过滤字段在 key 模板中的片段, 结果与 gen_kv_cache_key 一致
+    :return: (片段, 取值函数), 取值函数为 None 时直接填入值, 片段不含占位符时返回 False
+    """
+    if is_value_type(val):
+        return _escape_template(str(key)) + '={}', None
+    if is_func_type(val):
+        return _escape_template('func({})'.format(key)), False
+    if is_collection_type(val):
+        return _escape_template(str(key)) + '={}', _collection_key_value
+    return '{}', lambda value: gen_kv_cache_key(key, value)
+
+
+def _get_filter_key_template(filter_dict):
+    """
+    过滤字典的 key 模板, 按 (字段, 值类型) 组合缓存, 字段排序与类型判断只在第一次执行
+    :return: (模板, ((字段, 取值函数), ...))
+    """
+    shape = tuple([(key, type(val)) for key, val in filter_dict.items()])
+    template = _filter_key_templates.get(shape)
+    if template is None:
+        parts, fields = [], []
+        for key in sorted(filter_dict):
+            part, getter = _filter_key_part(key, filter_dict[key])
+            parts.append(part)
+            if getter is not False:
+                fields.append((key, getter))
+        template = _filter_key_templates[shape] = ('&'.join(parts), tuple(fields))
+    return template
+
+
+def _fill_key_template(template, fields, filter_dict):
+    return template.format(*[
+        filter_dict[key] if getter is None else getter(filter_dict[key]) for key, getter in fields
+    ])
+
+
+def gen_filter_cache_str(filter_dict):
+    """
+    过滤字典转为 key 字符串, 字段按名称排序
+    example: {'b': 2, 'a': [3, 1]}
+    return:  "a=1,3&b=2"
+    """
+    template, fields = _get_filter_key_template(filter_dict)
+    return _fill_key_template(template, fields, filter_dict)
+
+
+def get_model_key_parts(model):
+    if not isinstance(model, type):
+        model = type(model)
+    return _model_key_parts(model)
+
+
+def gen_namespace_prefix(model, cache_name='default'):
+    """
+    命名空间版本前缀, 只对设置了 cache_versioned = True 的模型生效
+    :return: "v3:" 或 ""
+    """
+    if not getattr(model, 'cache_versioned', False):
+        return ''
+
+    return 'v%d:' % get_namespace_version(model, cache_name)
+
+
+def gen_namespace_version_key(model):
+    return NAMESPACE_VERSION_KEY % '.'.join(get_model_key_parts(model))
+
+
+def get_namespace_version(model, cache_name='default'):
+    """
+    获取模型的命名空间版本号, 进程内缓存 version_cache_time 秒
+    """
+    version_key = gen_namespace_version_key(model)
+    entry = _namespace_versions.get((cache_name, version_key))
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+
+    client = ConnectionManager()[cache_name]
+    version = int(client.get(version_key) or 0)
+    _namespace_versions[(cache_name, version_key)] = (version, time.monotonic() + version_cache_time)
+    return version
+
+
+def bump_namespace_version(model, cache_name='default'):
+    """
+    升级模型的命名空间版本号, O(1) 失效该模型的所有对象缓存和列表缓存;
+    旧 key 不再被读取, 由过期时间自动清理. 其他进程最多延迟 version_cache_time 秒生效
+
+    Args:
+        model: 模型类, 需设置 cache_versioned = True
+        cache_name: 缓存配置名称
+
+    Returns: 新版本号
+
+    """
+    version_key = gen_namespace_version_key(model)
+    client = ConnectionManager()[cache_name]
+    version = client.incr(version_key)
+    _namespace_versions[(cache_name, version_key)] = (version, time.monotonic() + version_cache_time)
+    return version
+
+
+def gen_item_cache_key(model, filter_dict, cache_name='default'):
     """
     生成单个对象缓存key
     :param model: 数据库对象
     :param filter_dict: 筛选字典, {'hash_id': 'abc'}
+    :param cache_name: 缓存配置名称, 用于读取命名空间版本
     :return: mk-photo.album.album?id=1
     """
-    db_name = model.db_name
-    table_name = model.table_name
-    module_name = model.__module__.split('.')[1]
-    cache_key = '%s.%s.%s' % (db_name, module_name, table_name)
-    if filter_dict:
-        key_list = sorted(filter_dict.keys())
-        cache_str = '&'.join([gen_kv_cache_key(key, filter_dict[key]) for key in key_list])
-        cache_key = '%s?%s' % (cache_key, cache_str)
+    return build_item_cache_key(model, filter_dict, gen_namespace_prefix(model, cache_name))
 
-    return cache_key
 
+def build_item_cache_key(model, filter_dict, namespace=''):
+    """
+    按给定的命名空间前缀生成单个对象缓存key, 不访问 redis
+
+    key 模板按 (模型, 过滤字段与值类型) 缓存, 之后只需要填入过滤值
+    """
+    if not isinstance(model, type):
+        model = type(model)
+    if not filter_dict:
+        return '%s%s.%s.%s' % ((namespace,) + get_model_key_parts(model))
+
+    shape = (model,) + tuple([(key, type(val)) for key, val in filter_dict.items()])
+    template = _item_key_templates.get(shape)
+    if template is None:
+        filter_template, fields = _get_filter_key_template(filter_dict)
+        prefix = _escape_template('%s.%s.%s' % get_model_key_parts(model))
+        template = _item_key_templates[shape] = ('%s?%s' % (prefix, filter_template), fields)
+
+    return namespace + _fill_key_template(template[0], template[1], filter_dict)
 
-def get_item(model, filter_dict=None, force_reload=False, cache_name='default', query_func=None):
+
+def get_item(model, filter_dict=None, force_reload=False, cache_name='default', query_func=None,
+             single_flight=False, early_refresh=False, negative_ttl=None):
     """
     获取数据库对象
 
@@ -87,6 +297,9 @@ def get_item(model, filter_dict=None, force_reload=False, cache_name='default',
         force_reload: 是否强制刷新缓存
         cache_name: 数据库名称
         query_func: 未查询到缓存时，调用的DB查询函数
+        single_flight: 缓存失效时只允许一个进程查询DB, 其他进程返回旧值或等待
+        early_refresh: 是否开启 XFetch 提前刷新
+        negative_ttl: 查询不到数据时缓存空值的时间（秒）, 默认使用 negative_cache_time
 
     Returns:
 
@@ -95,26 +308,71 @@ def get_item(model, filter_dict=None, force_reload=False, cache_name='default',
         filter_dict = {}
     if not force_reload:
         force_reload = FORCE_RELOAD
+    if negative_ttl is None:
+        negative_ttl = negative_cache_time
+
+    cache_key = gen_item_cache_key(model, filter_dict, cache_name)
+    # 进程内缓存, 通过 local.enable_local_cache 开启
+    local_cache = local.get_local_cache(cache_name)
+    if local_cache is not None and not force_reload:
+        item = local_cache.get(cache_key)
+        if item is not None:
+            metrics.incr('hits', cache_name, model)
+            return item
 
     client = ConnectionManager()[cache_name]
-    cache_key = gen_item_cache_key(model, filter_dict)
-    item = client.get(cache_key)
+    serializer = serializers.get_serializer(cache_name)
+    if query_func and (single_flight or early_refresh):
+        item = stampede.fetch(
+            client, cache_key, _query(model, cache_name, query_func, model, filter_dict), cache_time,
+            single_flight=single_flight, early_refresh=early_refresh, force_reload=force_reload,
+            serializer=serializer, model=model, negative_ttl=negative_ttl,
+            loads=lambda data: _load_item(model, data, filter_dict, cache_name)
+        )
+        if force_reload:
+            local.invalidate(cache_key, cache_name)
+        if not item:
+            return None
+        if local_cache is not None:
+            local_cache.set(cache_key, item)
+        return item
+
+    with metrics.timer('redis_seconds', cache_name, model, 'get'):
+        item = None if force_reload else ConnectionManager().read(cache_name).get(cache_key)
+    if item == serializers.NEGATIVE_VALUE and not force_reload:
+        metrics.incr('hits', cache_name, model)
+        return None
     if item and not force_reload:
-        return pickle.loads(item)
-
+        item = _load_item(model, item, filter_dict, cache_name)
+        if item is not stampede.MISS:
+            metrics.incr('hits', cache_name, model)
+            if local_cache is not None:
+                local_cache.set(cache_key, item)
+            return item
+
+    metrics.incr('misses', cache_name, model)
     if not query_func:
         return None
 
     client.delete(cache_key)
-    item = query_func(model, filter_dict)
+    item = _query(model, cache_name, query_func, model, filter_dict)()
+    if item:
+        client.set(cache_key, _dumps(serializer, item, cache_name, model), cache_time)
+    elif negative_ttl:
+        client.set(cache_key, serializers.NEGATIVE_VALUE, negative_ttl)
+    if force_reload:
+        # 强制刷新改写了 Redis, 各进程的进程内缓存一并失效
+        local.invalidate(cache_key, cache_name)
     if not item:
         return None
 
-    client.set(cache_key, pickle.dumps(item), cache_time)
+    if local_cache is not None:
+        local_cache.set(cache_key, item)
     return item
 
 
-def get_items_by_ids(model, ids, force_reload=False, cache_name='default', query_func=None):
+def get_items_by_ids(model, ids, force_reload=False, cache_name='default', query_func=None, chunk_size=None,
+                     negative_ttl=None):
     """
     批量获取数据
 
@@ -124,48 +382,211 @@ def get_items_by_ids(model, ids, force_reload=False, cache_name='default', query
         force_reload: 是否强制刷新缓存
         cache_name: 使用的缓存配置名称
         query_func: 未查询到缓存时，调用的DB查询函数
+        chunk_size: 单条 MGET/UNLINK/pipeline 命令的最大 key 数量, 默认不拆分
+        negative_ttl: 查询不到的id缓存空值的时间（秒）, 默认使用 negative_cache_time
 
     Returns: {id1: obj, id2: obj}
 
     """
     if not force_reload:
         force_reload = FORCE_RELOAD
+    if negative_ttl is None:
+        negative_ttl = negative_cache_time
 
     if isinstance(ids, int):
         ids = [ids]
 
-    cache_keys = []
-    for pk in ids:
-        cache_key = gen_item_cache_key(model, {'id': pk})
-        cache_keys.append(cache_key)
+    # 与 gen_item_cache_key(model, {'id': pk}) 一致, 前缀只生成一次
+    key_prefix = gen_item_cache_key(model, None, cache_name)
+    cache_keys = ['%s?id=%s' % (key_prefix, pk) for pk in ids]
 
     item_dict, miss_ids = {}, []
     client = ConnectionManager()[cache_name]
+    serializer = serializers.get_serializer(cache_name)
     if cache_keys:
         # 强制刷新时先删掉旧缓存
         if force_reload:
             item_list = None
-            for cache_key in cache_keys:
-                client.delete(cache_key)
+            for keys in split_chunks(cache_keys, chunk_size):
+                client.unlink(*keys)
         else:
-            item_list = client.mget(cache_keys)
+            item_list = []
+            reader = ConnectionManager().read(cache_name)
+            with metrics.timer('redis_seconds', cache_name, model, 'mget'):
+                for keys in split_chunks(cache_keys, chunk_size):
+                    item_list.extend(_mget(reader, keys))
 
         for i, pk in enumerate(ids):
+            if item_list and item_list[i] == serializers.NEGATIVE_VALUE:
+                continue
             if item_list and item_list[i]:
-                item_dict[pk] = pickle.loads(item_list[i])
+                item_dict[pk] = serializers.loads(item_list[i], model)
             else:
                 miss_ids.append(pk)
 
+        metrics.incr('misses', cache_name, model, len(miss_ids))
+        metrics.incr('hits', cache_name, model, len(ids) - len(miss_ids))
+
     if all([miss_ids, query_func]):
-        queryset = query_func(model, miss_ids)
+        queryset = _query(model, cache_name, query_func, model, miss_ids)()
+        # 未命中的数据通过 pipeline 一次写回
+        pipe = client.pipeline(transaction=False)
+        found_ids = set()
         for item in queryset:
             item_dict[item.id] = item
-            cache_key = gen_item_cache_key(model, {'id': item.id})
-            client.set(cache_key, pickle.dumps(item), cache_time)
+            found_ids.add(str(item.id))
+            cache_key = '%s?id=%s' % (key_prefix, item.id)
+            pipe.set(cache_key, _dumps(serializer, item, cache_name, model), cache_time)
+            if chunk_size and len(pipe) >= chunk_size:
+                pipe.execute()
+
+        if negative_ttl:
+            for pk in miss_ids:
+                if str(pk) in found_ids:
+                    continue
+                cache_key = '%s?id=%s' % (key_prefix, pk)
+                pipe.set(cache_key, serializers.NEGATIVE_VALUE, negative_ttl)
+                if chunk_size and len(pipe) >= chunk_size:
+                    pipe.execute()
+
+        if len(pipe):
+            pipe.execute()
+
+    if force_reload:
+        # 强制刷新改写了 Redis, 各进程的进程内缓存一并失效
+        local.invalidate_many(cache_keys, cache_name)
+    return item_dict
+
+
+def get_items_by_field(model, field, values, force_reload=False, cache_name='default', query_func=None,
+                       chunk_size=None, negative_ttl=None):
+    """
+    按唯一字段(如 hash_id、openid)批量获取数据
+
+    二级key(gen_item_cache_key(model, {field: value}))只保存指向 id 的指针, 对象数据只在 id 缓存中保存一份:
+    MGET 二级key -> get_items_by_ids 读取对象 -> 未命中的值通过一次 field__in 查询 -> pipeline 写回
+
+    Args:
+        model: 模型类
+        field: 字段名
+        values: 字段值列表
+        force_reload: 是否强制刷新缓存
+        cache_name: 使用的缓存配置名称
+        query_func: 未查询到缓存时调用的DB查询函数 query_func(model, field, values)
+        chunk_size: 单条 MGET/pipeline 命令的最大 key 数量, 默认不拆分
+        negative_ttl: 查询不到的值缓存空值的时间（秒）, 默认使用 negative_cache_time
+
+    Returns: {value1: obj, value2: obj}
+
+    """
+    if not force_reload:
+        force_reload = FORCE_RELOAD
+    if negative_ttl is None:
+        negative_ttl = negative_cache_time
+
+    if field == 'id':
+        # 指针不能写在 id 缓存上
+        return get_items_by_ids(model, values, force_reload, cache_name,
+                                query_func and (lambda m, ids: query_func(m, field, ids)), chunk_size, negative_ttl)
+
+    values = list(dict.fromkeys(values))
+    key_prefix = gen_item_cache_key(model, None, cache_name)
+    cache_keys = ['%s?%s' % (key_prefix, gen_filter_cache_str({field: value})) for value in values]
+
+    item_dict, miss_values, pointers = {}, [], {}
+    if cache_keys and not force_reload:
+        reader = ConnectionManager().read(cache_name)
+        data_list = []
+        with metrics.timer('redis_seconds', cache_name, model, 'mget'):
+            for keys in split_chunks(cache_keys, chunk_size):
+                data_list.extend(_mget(reader, keys))
+
+        for value, data in zip(values, data_list):
+            pk = serializers.load_pointer(data)
+            if data == serializers.NEGATIVE_VALUE:
+                continue
+            if pk is not None:
+                pointers[value] = pk
+            elif data:
+                # 由 get_item 写入的完整对象
+                item_dict[value] = serializers.loads(data, model)
+            else:
+                miss_values.append(value)
+
+        if pointers:
+            id_items = get_items_by_ids(model, list(set(pointers.values())), cache_name=cache_name,
+                                        chunk_size=chunk_size)
+            for value, pk in pointers.items():
+                item = id_items.get(pk)
+                # 字段值已修改时指针失效
+                if item is not None and _field_matches(item, {field: value}):
+                    item_dict[value] = item
+                else:
+                    miss_values.append(value)
+    else:
+        miss_values = values
+
+    metrics.incr('hits', cache_name, model, len(item_dict))
+    metrics.incr('misses', cache_name, model, len(miss_values))
+    if not (miss_values and query_func):
+        return item_dict
+
+    queryset = _query(model, cache_name, query_func, model, field, miss_values)()
+    client = ConnectionManager()[cache_name]
+    serializer = serializers.get_serializer(cache_name)
+    pipe = client.pipeline(transaction=False)
+    # 返回结果使用调用方传入的值作为 key, 避免类型不一致(如 '1' 与 1)
+    requested = {str(value): value for value in miss_values}
+    found = set()
+    for item in queryset:
+        value = getattr(item, field)
+        item_dict[requested.get(str(value), value)] = item
+        found.add(str(value))
+        pipe.set('%s?id=%s' % (key_prefix, item.id), _dumps(serializer, item, cache_name, model), cache_time)
+        pipe.set('%s?%s' % (key_prefix, gen_filter_cache_str({field: value})),
+                 serializers.dump_pointer(item.id), cache_time)
+        if chunk_size and len(pipe) >= chunk_size:
+            pipe.execute()
+
+    if negative_ttl:
+        for value in miss_values:
+            if str(value) in found:
+                continue
+            cache_key = '%s?%s' % (key_prefix, gen_filter_cache_str({field: value}))
+            pipe.set(cache_key, serializers.NEGATIVE_VALUE, negative_ttl)
+            if chunk_size and len(pipe) >= chunk_size:
+                pipe.execute()
+
+    if len(pipe):
+        pipe.execute()
 
     return item_dict
 
 
+def _load_item(model, data, filter_dict, cache_name='default'):
+    """
+    反序列化对象缓存; get_items_by_field 写入的指针读取 id 对应的对象缓存,
+    对象不存在或字段值已修改时返回 stampede.MISS
+    """
+    pk = serializers.load_pointer(data)
+    if pk is None:
+        return serializers.loads(data, model)
+    item = get_items_by_ids(model, [pk], cache_name=cache_name).get(pk)
+    if item is None or not _field_matches(item, filter_dict):
+        return stampede.MISS
+    return item
+
+
+def _field_matches(item, filter_dict):
+    """对象的字段值是否与过滤条件一致, 用于校验指针是否过期"""
+    for key, value in (filter_dict or {}).items():
+        if is_collection_type(value) or is_func_type(value):
+            continue
+        if str(getattr(item, key, None)) != str(value):
+            return False
+    return True
+
+
 def delete_item_cache(model, filter_dict=None, cache_name='default'):
     """
     删除单个对象缓存
@@ -179,23 +600,88 @@ def delete_item_cache(model, filter_dict=None, cache_name='default'):
 
     """
     client = ConnectionManager()[cache_name]
-    cache_key = gen_item_cache_key(model, filter_dict)
-    result = client.delete(cache_key)
+    cache_key = gen_item_cache_key(model, filter_dict, cache_name)
+    pipe = client.pipeline(transaction=False)
+    pipe.delete(cache_key)
+    # 击穿保护的旧值副本一并删除
+    # 集群模式下几个 key 不在同一个 slot, 分开删除
+    pipe.unlink(cache_key + stampede.STALE_SUFFIX)
+    pipe.unlink(cache_key + stampede.DELTA_SUFFIX)
+    result = pipe.execute()[0]
+    local.invalidate(cache_key, cache_name)
     return result
 
 
+def clear_negative_cache(model, filter_dict=None, cache_name='default', item_keys=None):
+    """
+    删除空值缓存, 不影响正常缓存
+
+    Args:
+        model: 模型类或对象, 传入对象且不传 filter_dict 时按对象删除, 见 clear_negative_caches
+        filter_dict: 过滤字典
+        cache_name: 缓存配置名称
+        item_keys: 对象缓存的过滤字段, 见 clear_negative_caches
+
+    Returns: 是否删除
+
+    """
+    if filter_dict is None:
+        return clear_negative_caches([model], cache_name=cache_name, item_keys=item_keys)
+
+    client = ConnectionManager()[cache_name]
+    cache_key = gen_item_cache_key(model, filter_dict, cache_name)
+    script = client.register_script(CLEAR_NEGATIVE_SCRIPT)
+    return bool(script(keys=[cache_key], args=[serializers.NEGATIVE_VALUE]))
+
+
+def clear_negative_caches(items, cache_name='default', item_keys=None):
+    """
+    按对象批量删除空值缓存, 一次 pipeline 完成
+
+    除 id 外, 同时删除 item_keys 各字段(?field=value)的空值缓存, 默认使用 hooks.register 注册的 item_keys;
+    未注册时只删除 id 对应的空值缓存
+
+    Args:
+        items: 对象, 或同一模型的对象列表
+        cache_name: 缓存配置名称
+        item_keys: 对象缓存的过滤字段, 如 [('user_id', 'app_id')]
+
+    Returns: 是否删除
+
+    """
+    from lk_utils.redisx import hooks
+
+    items = list(items) if is_collection_type(items) else [items]
+    cache_keys = [
+        gen_item_cache_key(item, filter_dict, cache_name)
+        for item in items for filter_dict in hooks.item_filters(item, item_keys)
+    ]
+    if not cache_keys:
+        return False
+
+    client = ConnectionManager()[cache_name]
+    script = client.register_script(CLEAR_NEGATIVE_SCRIPT)
+    if len(cache_keys) == 1:
+        return bool(script(keys=cache_keys, args=[serializers.NEGATIVE_VALUE]))
+
+    pipe = client.pipeline(transaction=False)
+    for cache_key in cache_keys:
+        script(keys=[cache_key], args=[serializers.NEGATIVE_VALUE], client=pipe)
+    return any(pipe.execute())
+
+
 def get_item_ids(model, p=1, page_size=10, filter_dict=None, value='id', order_func=None,
                  key_str=None, reverse=True, limit_num=None, cache_name='default'):
 
     if filter_dict is None:
         filter_dict = {}
 
-    client = ConnectionManager()[cache_name]
-    cache_key = set_all_item_cache(model, filter_dict, value, order_func, key_str, limit_num=limit_num)
+    cache_key = set_all_item_cache(model, filter_dict, value, order_func, key_str, limit_num=limit_num,
+                                   cache_name=cache_name)
     if reverse:
-        item_ids = client.zrevrange(cache_key, (p - 1) * page_size, p * page_size - 1)
+        item_ids = _read(cache_name, 'zrevrange', cache_key, (p - 1) * page_size, p * page_size - 1, model=model)
     else:
-        item_ids = client.zrange(cache_key, (p - 1) * page_size, p * page_size - 1)
+        item_ids = _read(cache_name, 'zrange', cache_key, (p - 1) * page_size, p * page_size - 1, model=model)
 
     item_ids = [int(item_id) for item_id in item_ids]
     return item_ids
@@ -205,11 +691,11 @@ def get_item_ids_by_score(model, min_score=None, max_score=None, filter_dict=Non
                           value='id', order_func=None, key_str=None, cache_name='default'):
 
     if (min_score is None) and (max_score is None):
-        return get_item_ids(model, 1, 0, filter_dict=filter_dict, value=value, order_func=order_func, key_str=key_str)
+        return get_item_ids(model, 1, 0, filter_dict=filter_dict, value=value, order_func=order_func, key_str=key_str,
+                            cache_name=cache_name)
 
-    client = ConnectionManager()[cache_name]
-    cache_key = set_all_item_cache(model, filter_dict, value, order_func, key_str)
-    item_ids = client.zrangebyscore(cache_key, min_score, max_score)
+    cache_key = set_all_item_cache(model, filter_dict, value, order_func, key_str, cache_name=cache_name)
+    item_ids = _read(cache_name, 'zrangebyscore', cache_key, min_score, max_score, model=model)
     return item_ids
 
 
@@ -219,29 +705,139 @@ def get_item_ids_with_score(model, p=1, page_size=10, filter_dict=None, value='i
     if filter_dict is None:
         filter_dict = {}
 
-    client = ConnectionManager()[cache_name]
-    cache_key = set_all_item_cache(model, filter_dict, value, order_func, key_str, limit_num=limit_num)
-    if reverse:
-        items = client.zrevrange(cache_key, (p - 1) * page_size, p * page_size - 1, withscores=True)
-    else:
-        items = client.zrange(cache_key, (p - 1) * page_size, p * page_size - 1, withscores=True)
+    cache_key = set_all_item_cache(model, filter_dict, value, order_func, key_str, limit_num=limit_num,
+                                   cache_name=cache_name)
+    command = 'zrevrange' if reverse else 'zrange'
+    items = _read(cache_name, command, cache_key, (p - 1) * page_size, p * page_size - 1, withscores=True,
+                  model=model)
 
     item_ids = [(int(item_id), int(score)) for item_id, score in items]
     return item_ids
 
 
+def get_items_by_cursor(model, cursor=None, page_size=10, filter_dict=None, value='id', order_func=None,
+                        key_str=None, reverse=True, limit_num=None, cache_name='default', query_func=None):
+    """
+    游标(keyset)分页, 按分数定位, 不受翻页深度影响, 翻页期间插入新数据不会导致重复或遗漏
+
+    列表缓存已存在时只需两次请求: 读取一页的 Lua 脚本以及 get_items_by_ids 的 MGET;
+    同分数的数据按上一页最后一条定位, 翻页期间同分数插入或删除数据也不会重复或遗漏
+
+    Args:
+        model: 模型类
+        cursor: 上一页返回的游标, 第一页传 None
+        page_size: 每页数量
+        filter_dict: 过滤字典
+        value: 返回属性
+        order_func: 排序函数
+        key_str: 标识 Key 的字段名称
+        reverse: 是否按分数倒序
+        limit_num: 限制最大数量
+        cache_name: 缓存配置名称
+        query_func: 未查询到对象缓存时，调用的DB查询函数
+
+    Returns: ([obj1, obj2], next_cursor), 没有下一页时 next_cursor 为 None;
+             value 不为 id 时返回 ([value1, value2], next_cursor)
+
+    """
+    if filter_dict is None:
+        filter_dict = {}
+
+    score, last_id, skip = decode_cursor(cursor)
+    cache_key = gen_all_item_cache_key(model, filter_dict, value, key_str, cache_name)
+    args = gen_cursor_args(page_size, score, last_id, skip, reverse)
+
+    conn = ConnectionManager().read(cache_name)
+    items = conn.register_script(CURSOR_RANGE_SCRIPT)(keys=[cache_key], args=args)
+    if items is None:
+        # 从库可能尚未同步刚构建的列表, 构建后从主库读取
+        set_all_item_cache(model, filter_dict, value, order_func, key_str, limit_num=limit_num,
+                           cache_name=cache_name)
+        conn = ConnectionManager()[cache_name]
+        items = conn.register_script(CURSOR_RANGE_SCRIPT)(keys=[cache_key], args=args) or []
+
+    items = parse_cursor_items(items)
+    next_cursor = gen_next_cursor(items, page_size, score, skip)
+
+    if value != 'id':
+        return [item_value for item_value, _ in items], next_cursor
+
+    item_ids = [int(item_id) for item_id, _ in items]
+    item_dict = get_items_by_ids(model, item_ids, cache_name=cache_name, query_func=query_func)
+    return [item_dict[item_id] for item_id in item_ids if item_id in item_dict], next_cursor
+
+
+def gen_cursor_args(page_size, score, last_id, skip, reverse=True):
+    """CURSOR_RANGE_SCRIPT 的参数"""
+    return [1 if reverse else 0, page_size, '' if score is None else score, last_id or '', skip]
+
+
+def parse_cursor_items(items):
+    """CURSOR_RANGE_SCRIPT 的返回值转为 [(member, score)]"""
+    return [(member, float(score)) for member, score in zip(items[::2], items[1::2])]
+
+
+def gen_next_cursor(items, page_size, score, skip):
+    """下一页的游标, 没有下一页时返回 None"""
+    if not items or len(items) < page_size:
+        return None
+
+    next_score = items[-1][1]
+    # 与最后一条分数相同的数据数量, 最后一条被删除后下一页从该分数开始时跳过
+    ties = 0
+    for _, item_score in reversed(items):
+        if item_score != next_score:
+            break
+        ties += 1
+    if ties == len(items) and score is not None and float(score) == next_score:
+        ties += skip
+    return encode_cursor(next_score, items[-1][0], ties)
+
+
+def encode_cursor(score, item_id, skip=1):
+    """
+    生成游标
+    :param score: 最后一条数据的分数
+    :param item_id: 最后一条数据的成员值, 下一页从它之后开始
+    :param skip: 最后一条已不在列表中时, 从该分数开始需要跳过的数量
+    :return: url 安全的字符串
+    """
+    if isinstance(item_id, bytes):
+        item_id = item_id.decode()
+    raw = '%r:%d:%s' % (float(score), skip, item_id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    解析游标
+    :return: (score, item_id, skip), cursor 为空时返回 (None, None, 0)
+    """
+    if not cursor:
+        return None, None, 0
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        score, skip, item_id = raw.split(':', 2)
+        return repr(float(score)), item_id, int(skip)
+    except ValueError as e:
+        raise ValueError(f'invalid cursor: {cursor}') from e
+
+
 def get_item_amount(model, filter_dict=None, value='id', order_func=None, cache_name='default'):
-    client = ConnectionManager()[cache_name]
-    cache_key = set_all_item_cache(model, filter_dict, value, order_func)
-    amount = client.zcard(cache_key)
+    cache_key = set_all_item_cache(model, filter_dict, value, order_func, cache_name=cache_name)
+    amount = _read(cache_name, 'zcard', cache_key, model=model)
     return amount
 
 
 def set_all_item_cache(model, filter_dict=None, value='id', order_func=None, key_str=None,
-                       force_reload=False, limit_num=None, cache_name='default'):
+                       force_reload=False, limit_num=None, cache_name='default', chunk_size=None):
     """
     设置id列表缓存, 用于获取列表数据
 
+    数据按批次流式读取, 分批 ZADD 到临时 key, 完成后 RENAME 覆盖正式 key,
+    读取方不会看到构建到一半或被删除的列表
+
     Args:
         model: 模型类
         filter_dict: 过滤字典
@@ -251,6 +847,7 @@ def set_all_item_cache(model, filter_dict=None, value='id', order_func=None, key
         force_reload: 是否强制刷新
         limit_num: 限制最大数量
         cache_name: 数据库名称
+        chunk_size: 每批读取/写入的数量, 默认 rebuild_chunk_size
 
     Returns: 缓存key
 
@@ -260,15 +857,19 @@ def set_all_item_cache(model, filter_dict=None, value='id', order_func=None, key
         filter_dict = {}
     if not force_reload:
         force_reload = FORCE_RELOAD
+    if not chunk_size:
+        chunk_size = rebuild_chunk_size
 
-    tm = 60 * 30
+    tm = all_item_cache_time
     client = ConnectionManager()[cache_name]
-    cache_key = gen_all_item_cache_key(model, filter_dict, value, key_str)
+    cache_key = gen_all_item_cache_key(model, filter_dict, value, key_str, cache_name)
     if not client.exists(cache_key) or force_reload:
+        metrics.incr('db_fallbacks', cache_name, model)
+        started = metrics.start()
         if order_func:
             items = model.query
         else:
-            items = db.session.query(model.id, getattr(model, value))
+            items = model.query.with_entities(model.id, getattr(model, value))
 
         items = items.filter(model.deleted == 0)
         for k, v in filter_dict.items():
@@ -283,23 +884,86 @@ def set_all_item_cache(model, filter_dict=None, value='id', order_func=None, key
         if limit_num:
             items = items.order_by(model.id.desc()).limit(limit_num)
 
-        item_tuple = {}
-        for item in items:
-            if order_func:
-                order_value = order_func(item)
-            else:
-                order_value = item.id  # 默认id排序
-            item_tuple.update({getattr(item, value): order_value})
-
-        client.delete(cache_key)
-        if item_tuple:
-            client.zadd(cache_key, mapping=item_tuple)
-            client.expire(cache_key, tm)
+        # 服务端游标分批读取, 避免一次性加载全部数据
+        items = items.yield_per(chunk_size)
+
+        # hash tag 保证集群模式下临时 key 与正式 key 在同一个 slot, 才能 RENAME
+        tmp_key = '{%s}:tmp:%s' % (cache_key, uuid.uuid4().hex)
+        pipe = client.pipeline(transaction=False)
+        item_tuple, total = {}, 0
+        try:
+            for item in items:
+                if order_func:
+                    order_value = order_func(item)
+                else:
+                    order_value = item.id  # 默认id排序
+                item_tuple[getattr(item, value)] = order_value
+                if len(item_tuple) >= chunk_size:
+                    total += _zadd_chunk(pipe, tmp_key, item_tuple, tm)
+
+            if item_tuple:
+                total += _zadd_chunk(pipe, tmp_key, item_tuple, tm)
+        except Exception:
+            client.delete(tmp_key)
+            raise
+        metrics.observe('query_seconds', started, cache_name, model, 'rebuild')
+
+        # 临时 key 已带过期时间, RENAME 后保留, 单条命令即可原子替换
+        if total:
+            client.rename(tmp_key, cache_key)
+        else:
+            client.delete(cache_key)
 
     return cache_key
 
 
-def gen_all_item_cache_key(model, filter_dict=None, value='id', key_str=None):
+def _read(cache_name, command, cache_key, *args, model=None, **kwargs):
+    """
+    列表缓存的读取走从库; 结果为空时可能是从库尚未同步, 再从主库读取一次
+    """
+    manager = ConnectionManager()
+    with metrics.timer('redis_seconds', cache_name, model, command):
+        result = getattr(manager.read(cache_name), command)(cache_key, *args, **kwargs)
+        if not result and manager.has_replicas(cache_name):
+            result = getattr(manager[cache_name], command)(cache_key, *args, **kwargs)
+    return result
+
+
+def _query(model, cache_name, query_func, *args):
+    """回源查询, 记录次数与耗时"""
+    def query():
+        metrics.incr('db_fallbacks', cache_name, model)
+        with metrics.timer('query_seconds', cache_name, model, 'query'):
+            return query_func(*args)
+
+    return query
+
+
+def _dumps(serializer, value, cache_name, model=None):
+    data = serializer.dumps(value)
+    metrics.incr('bytes_serialized', cache_name, model, len(data))
+    return data
+
+
+def _mget(client, keys):
+    """集群模式下 key 分布在不同 slot, 使用 mget_nonatomic 按 slot 拆分"""
+    mget_nonatomic = getattr(client, 'mget_nonatomic', None)
+    if mget_nonatomic is not None:
+        return mget_nonatomic(keys)
+    return client.mget(keys)
+
+
+def _zadd_chunk(pipe, cache_key, item_tuple, tm):
+    """写入一批列表数据并清空 item_tuple, 临时 key 同样带过期时间, 构建中断时自动清理"""
+    count = len(item_tuple)
+    pipe.zadd(cache_key, mapping=item_tuple)
+    pipe.expire(cache_key, tm)
+    pipe.execute()
+    item_tuple.clear()
+    return count
+
+
+def gen_all_item_cache_key(model, filter_dict=None, value='id', key_str=None, cache_name='default'):
     """
     生成id列表缓存key
 
@@ -308,67 +972,67 @@ def gen_all_item_cache_key(model, filter_dict=None, value='id', key_str=None):
         filter_dict: 过滤字典
         value: 返回属性
         key_str:
+        cache_name: 缓存配置名称, 用于读取命名空间版本
 
     Returns:
 
     """
-    if filter_dict is None:
-        filter_dict = {}
+    return build_all_item_cache_key(model, filter_dict, value, key_str, gen_namespace_prefix(model, cache_name))
+
 
-    db_name = model.db_name
-    table_name = model.table_name
-    module = model.__module__.split('.')[1]
-    cache_key = '%s.%s.all_%s_%s' % (db_name, module, table_name, value)
+def build_all_item_cache_key(model, filter_dict=None, value='id', key_str=None, namespace=''):
+    """按给定的命名空间前缀生成id列表缓存key, 不访问 redis"""
+    db_name, module, table_name = get_model_key_parts(model)
+    cache_key = '%s%s.%s.all_%s_%s' % (namespace, db_name, module, table_name, value)
     if key_str:
         cache_key = '%s_%s' % (cache_key, key_str)
 
     if filter_dict:
-        key_list = sorted(filter_dict.keys())
-        cache_str = '&'.join([gen_kv_cache_key(key, filter_dict[key]) for key in key_list])
-        cache_key = '%s?%s' % (cache_key, cache_str)
+        cache_key = '%s?%s' % (cache_key, gen_filter_cache_str(filter_dict))
 
     return cache_key
 
 
-def add_all_item_cache(item, filter_dict=None, value='id', order_func=None, key_str=None, cache_name='default'):
+def add_all_item_cache(item, filter_dict=None, value='id', order_func=None, key_str=None, cache_name='default',
+                       limit_num=None):
     """
-    添加单个id至列表缓存, 用于更新缓存
+    添加id至列表缓存, 用于更新缓存
+
+    列表缓存存在时才写入, 写入、按 limit_num 裁剪与续期在一个 Lua 脚本中原子完成
 
     Args:
-        item:
+        item: 对象, 或同一模型的对象列表
         filter_dict:
         value: 返回属性
         order_func: 排序函数
         key_str: 设置一个标识key的值
         cache_name:
+        limit_num: 限制最大数量, 与 set_all_item_cache 一致
 
     Returns:
 
     """
     if filter_dict is None:
         filter_dict = {}
-
-    client = ConnectionManager()[cache_name]
-    cache_key = gen_all_item_cache_key(item, filter_dict, value, key_str)
-    if not client.exists(cache_key):
+    items = list(item) if is_collection_type(item) else [item]
+    if not items:
         return True
 
-    if order_func:
-        order_value = order_func(item)
-    else:
-        order_value = item.id  # 默认id排序
-
-    item_tuple = {getattr(item, value): order_value}
-    client.zadd(cache_key, mapping=item_tuple)
+    client = ConnectionManager()[cache_name]
+    # 新增的对象可能之前被缓存为空值
+    clear_negative_caches(items, cache_name=cache_name)
+    cache_key = gen_all_item_cache_key(items[0], filter_dict, value, key_str, cache_name)
+    script = client.register_script(ADD_ALL_ITEM_SCRIPT)
+    script(keys=[cache_key], args=gen_add_all_item_args(items, value, order_func, limit_num))
     return True
 
 
 def rem_all_item_cache(item, filter_dict=None, value='id', key_str=None, cache_name='default'):
     """
-    从id列表缓存中删除单个id, 用于更新缓存
+    从id列表缓存中删除id, 用于更新缓存
 
     Args:
-        item:
+        item: 对象, 或同一模型的对象列表
         filter_dict:
         value:
         key_str:
@@ -379,16 +1043,31 @@ def rem_all_item_cache(item, filter_dict=None, value='id', key_str=None, cache_n
     """
     if filter_dict is None:
         filter_dict = {}
-
-    client = ConnectionManager()[cache_name]
-    cache_key = gen_all_item_cache_key(item, filter_dict, value, key_str)
-    if not client.exists(cache_key):
+    items = list(item) if is_collection_type(item) else [item]
+    if not items:
         return True
 
-    client.zrem(cache_key, getattr(item, value))
+    client = ConnectionManager()[cache_name]
+    cache_key = gen_all_item_cache_key(items[0], filter_dict, value, key_str, cache_name)
+    script = client.register_script(REM_ALL_ITEM_SCRIPT)
+    script(keys=[cache_key], args=gen_rem_all_item_args(items, value))
     return True
 
 
+def gen_add_all_item_args(items, value='id', order_func=None, limit_num=None):
+    """ADD_ALL_ITEM_SCRIPT 的参数"""
+    args = [all_item_cache_time, limit_num or 0]
+    for item in items:
+        # 默认id排序
+        args.extend((order_func(item) if order_func else item.id, getattr(item, value)))
+    return args
+
+
+def gen_rem_all_item_args(items, value='id'):
+    """REM_ALL_ITEM_SCRIPT 的参数"""
+    return [all_item_cache_time] + [getattr(item, value) for item in items]
+
+
 def format_number(num):
     """格式化(播放、点赞)数据"""
     if not isinstance(num, int):
@@ -436,6 +1115,18 @@ def urlencodestr(astr):
     return urllib.parse.quote(astr)
 
 
+def split_chunks(li, chunk_size=None):
+    """
+    按 chunk_size 拆分列表
+    example: li = [1, 2, 3, 4, 5], chunk_size = 2
+    return:  [[1, 2], [3, 4], [5]]
+    """
+    if not chunk_size or chunk_size >= len(li):
+        return [li] if li else []
+
+    return [li[i: i + chunk_size] for i in range(0, len(li), chunk_size)]
+
+
 def sort_list_to_str(li):
     """
     对列表进行去重、排序后转为字符串
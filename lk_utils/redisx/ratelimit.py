@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+分布式限流与并发控制, 每次获取只需一次 Lua 脚本调用
+
+    SlidingWindowLimiter: 滑动窗口, window 秒内最多 limit 次
+    TokenBucketLimiter: 令牌桶, 每秒补充 rate 个, 最多积攒 capacity 个, 允许突发
+    Semaphore: 计数信号量, 最多 limit 个同时持有, 持有超过 timeout 秒自动释放
+
+同步与异步接口:
+    limiter.acquire() / await limiter.aacquire()
+
+装饰器, 普通函数与协程函数均可, 不需要修改被装饰的函数:
+    sms_limiter = TokenBucketLimiter('sms', rate=10, capacity=20, blocking=True)
+    send_sms_msg = sms_limiter(send_sms_msg)
+
+    printer = Semaphore('printing_server', limit=5, blocking=True, blocking_timeout=30)
+    PrintingServer.submit = staticmethod(printer(PrintingServer.submit))
+
+获取失败时 acquire 返回 False, 装饰器抛出 RateLimitExceeded
+"""
+import asyncio
+import inspect
+import time
+import uuid
+from contextlib import asynccontextmanager
+from contextlib import contextmanager
+from functools import wraps
+
+from lk_utils.exceptions.redisx import RateLimitExceeded
+from lk_utils.redisx import ConnectionManager
+from lk_utils.redisx import metrics
+
+
+KEY_PREFIX = 'lk_utils:ratelimit:'
+# 连接对象上缓存已注册脚本的属性名, {脚本源码: Script}
+SCRIPTS_ATTR = '_lk_utils_ratelimit_scripts'
+
+# 返回 {是否允许, 需要等待的毫秒数}
+SLIDING_WINDOW_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000000 + tonumber(now[2])
+local window = tonumber(ARGV[1]) * 1000
+local limit = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count + amount <= limit then
+    for i = 1, amount do
+        redis.call('ZADD', KEYS[1], now, ARGV[4] .. ':' .. i)
+    end
+    redis.call('PEXPIRE', KEYS[1], math.ceil(window / 1000))
+    return {1, 0}
+end
+if amount > limit then
+    return {0, -1}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], count + amount - limit - 1, count + amount - limit - 1, 'WITHSCORES')
+return {0, math.ceil((tonumber(oldest[2]) + window - now) / 1000)}
+"""
+
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + tonumber(now[2]) / 1000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed = 0
+local wait = 0
+if amount > capacity then
+    wait = -1
+elseif tokens >= amount then
+    tokens = tokens - amount
+    allowed = 1
+else
+    wait = math.ceil((amount - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return {allowed, wait}
+"""
+
+# 成员分数为过期时间, 先清理过期的持有者
+SEMAPHORE_ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local limit = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < limit then
+    redis.call('ZADD', KEYS[1], now + timeout, ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], timeout)
+    return {1, 0}
+end
+local first = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, tonumber(first[2]) - now}
+"""
+
+
+class _Limiter(object):
+    """
+    限流基类
+
+    :param name: 名称, 同名的限流器共享额度
+    :param blocking: 装饰器与 acquire 默认是否等待
+    :param blocking_timeout: 最长等待时间（秒）, None 表示一直等待
+    :param cache_name: 缓存配置名称
+    """
+
+    script_source = None
+    # 阻塞等待时的最长轮询间隔, None 表示按脚本返回的等待时间
+    sleep = None
+
+    def __init__(self, name, blocking=False, blocking_timeout=None, cache_name='default'):
+        self.name = name
+        self.blocking = blocking
+        self.blocking_timeout = blocking_timeout
+        self.cache_name = cache_name
+        self.key = KEY_PREFIX + name
+
+    def _script(self, client):
+        # 每个连接(同步/各事件循环的异步连接)分别注册, 缓存在连接上, 随连接一起释放
+        scripts = getattr(client, SCRIPTS_ATTR, None)
+        if scripts is None:
+            scripts = {}
+            setattr(client, SCRIPTS_ATTR, scripts)
+        script = scripts.get(self.script_source)
+        if script is None:
+            script = scripts[self.script_source] = client.register_script(self.script_source)
+        return script
+
+    def _args(self, amount, token):
+        raise NotImplementedError
+
+    def try_acquire(self, amount=1, token=None):
+        """
+        尝试获取一次, 不等待
+
+        Returns: (是否成功, 建议等待秒数); 请求数量超过上限时等待秒数为 None
+        """
+        client = ConnectionManager()[self.cache_name]
+        allowed, wait = self._script(client)(keys=[self.key], args=self._args(amount, token or uuid.uuid4().hex))
+        return bool(allowed), (None if wait < 0 else wait / 1000)
+
+    async def atry_acquire(self, amount=1, token=None):
+        from lk_utils.redisx.aio import ConnectionManager as AsyncConnectionManager
+
+        client = AsyncConnectionManager()[self.cache_name]
+        args = self._args(amount, token or uuid.uuid4().hex)
+        allowed, wait = await self._script(client)(keys=[self.key], args=args)
+        return bool(allowed), (None if wait < 0 else wait / 1000)
+
+    def acquire(self, amount=1, blocking=None, blocking_timeout=None, token=None):
+        """
+        获取额度, blocking 时等待到成功或超时
+
+        Returns: 是否成功
+        """
+        started = metrics.start()
+        blocking, deadline = self._blocking(blocking, blocking_timeout)
+        while True:
+            allowed, wait = self.try_acquire(amount, token)
+            sleep = self._next_sleep(allowed, wait, blocking, deadline)
+            if sleep is None:
+                self._observe(started, allowed)
+                return allowed
+            time.sleep(sleep)
+
+    async def aacquire(self, amount=1, blocking=None, blocking_timeout=None, token=None):
+        started = metrics.start()
+        blocking, deadline = self._blocking(blocking, blocking_timeout)
+        while True:
+            allowed, wait = await self.atry_acquire(amount, token)
+            sleep = self._next_sleep(allowed, wait, blocking, deadline)
+            if sleep is None:
+                self._observe(started, allowed)
+                return allowed
+            await asyncio.sleep(sleep)
+
+    def _blocking(self, blocking, blocking_timeout):
+        if blocking is None:
+            blocking = self.blocking
+        if blocking_timeout is None:
+            blocking_timeout = self.blocking_timeout
+        deadline = None if blocking_timeout is None else time.monotonic() + blocking_timeout
+        return blocking, deadline
+
+    def _next_sleep(self, allowed, wait, blocking, deadline):
+        """需要继续等待时返回等待秒数, 否则返回 None"""
+        if allowed or not blocking or wait is None:
+            return None
+        # 脚本返回的是最早可以成功的时间, 并发竞争时可能仍然失败, 加少量间隔
+        sleep = max(wait, 0.001)
+        if self.sleep is not None:
+            sleep = min(sleep, self.sleep)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            sleep = min(sleep, remaining)
+        return sleep
+
+    def _observe(self, started, allowed):
+        metrics.observe('ratelimit_wait_seconds', started, self.cache_name, self.name,
+                        'acquired' if allowed else 'rejected')
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrap(*args, **kwargs):
+                if not await self.aacquire():
+                    raise RateLimitExceeded(self.name)
+                return await func(*args, **kwargs)
+
+            return async_wrap
+
+        @wraps(func)
+        def wrap(*args, **kwargs):
+            if not self.acquire():
+                raise RateLimitExceeded(self.name)
+            return func(*args, **kwargs)
+
+        return wrap
+
+
+class SlidingWindowLimiter(_Limiter):
+    """滑动窗口限流: 任意 window 秒内最多 limit 次"""
+
+    script_source = SLIDING_WINDOW_SCRIPT
+
+    def __init__(self, name, limit, window, **kwargs):
+        """
+        :param limit: 窗口内最多次数
+        :param window: 窗口长度（秒）
+        """
+        super().__init__(name, **kwargs)
+        self.limit = limit
+        self.window = window
+
+    def _args(self, amount, token):
+        return [int(self.window * 1000), self.limit, amount, token]
+
+
+class TokenBucketLimiter(_Limiter):
+    """令牌桶限流: 平均每秒 rate 次, 最多突发 capacity 次"""
+
+    script_source = TOKEN_BUCKET_SCRIPT
+
+    def __init__(self, name, rate, capacity=None, **kwargs):
+        """
+        :param rate: 每秒补充的令牌数
+        :param capacity: 桶容量, 默认等于 rate
+        """
+        super().__init__(name, **kwargs)
+        self.rate = rate
+        self.capacity = capacity or rate
+
+    def _args(self, amount, token):
+        return [self.rate, self.capacity, amount]
+
+
+class Semaphore(_Limiter):
+    """
+    分布式计数信号量, 最多 limit 个同时持有
+
+    acquire 成功返回持有凭证(token), 用于 release; 持有者异常退出时 timeout 秒后自动释放
+
+        with semaphore.hold() as token:
+            if not token:
+                return
+    """
+
+    script_source = SEMAPHORE_ACQUIRE_SCRIPT
+
+    def __init__(self, name, limit, timeout=60, sleep=0.1, **kwargs):
+        """
+        :param limit: 最多同时持有数量
+        :param timeout: 持有超时时间（秒）
+        :param sleep: 阻塞等待时的轮询间隔（秒）, 其他持有者随时可能释放
+        """
+        super().__init__(name, **kwargs)
+        self.sleep = sleep
+        self.key = 'lk_utils:semaphore:' + name
+        self.limit = limit
+        self.timeout = timeout
+
+    def _args(self, amount, token):
+        return [self.limit, int(self.timeout * 1000), token]
+
+    def acquire(self, amount=1, blocking=None, blocking_timeout=None, token=None):
+        """
+        Returns: 成功时返回持有凭证, 失败返回 None
+        """
+        # 等待期间重试使用同一个凭证
+        token = token or uuid.uuid4().hex
+        if super().acquire(1, blocking, blocking_timeout, token):
+            return token
+        return None
+
+    async def aacquire(self, amount=1, blocking=None, blocking_timeout=None, token=None):
+        token = token or uuid.uuid4().hex
+        if await super().aacquire(1, blocking, blocking_timeout, token):
+            return token
+        return None
+
+    def release(self, token):
+        return bool(ConnectionManager()[self.cache_name].zrem(self.key, token))
+
+    async def arelease(self, token):
+        from lk_utils.redisx.aio import ConnectionManager as AsyncConnectionManager
+
+        return bool(await AsyncConnectionManager()[self.cache_name].zrem(self.key, token))
+
+    @contextmanager
+    def hold(self, blocking=None, blocking_timeout=None):
+        token = self.acquire(blocking=blocking, blocking_timeout=blocking_timeout)
+        try:
+            yield token
+        finally:
+            if token:
+                self.release(token)
+
+    @asynccontextmanager
+    async def ahold(self, blocking=None, blocking_timeout=None):
+        token = await self.aacquire(blocking=blocking, blocking_timeout=blocking_timeout)
+        try:
+            yield token
+        finally:
+            if token:
+                await self.arelease(token)
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrap(*args, **kwargs):
+                async with self.ahold() as token:
+                    if not token:
+                        raise RateLimitExceeded(self.name)
+                    return await func(*args, **kwargs)
+
+            return async_wrap
+
+        @wraps(func)
+        def wrap(*args, **kwargs):
+            with self.hold() as token:
+                if not token:
+                    raise RateLimitExceeded(self.name)
+                return func(*args, **kwargs)
+
+        return wrap
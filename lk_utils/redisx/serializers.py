@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+缓存数据的序列化
+
+每个缓存配置可以单独指定序列化方式, 通过 set_serializer 设置:
+    legacy:  默认, 与旧版本一致的 pickle, 无头部
+    pickle:  pickle protocol 5
+    msgpack: ORM 对象只保存字段值, 读取时按模型重新构造; 需要安装 msgpack
+             tuple 以扩展类型保存, 读取后仍为 tuple; dict 的 key 可以是 int 等非字符串类型
+    orjson:  JSON, 只适用于可 JSON 化的数据; 需要安装 orjson
+             ORM 对象的日期、Decimal、UUID 字段保存为字符串, 读取时按模型字段类型还原
+
+除 legacy 外写入的数据都带 1 字节头部, 记录序列化方式、压缩方式以及是否为 ORM 对象,
+loads 根据头部自动识别, 无头部的数据按旧版 pickle 读取, 因此新旧格式可以同时存在:
+先升级所有读取方, 再切换写入方的序列化方式即可平滑迁移
+
+压缩支持 zstd(zstandard) 与 lz4, 只在数据长度超过阈值时压缩
+"""
+import datetime
+import pickle
+import uuid
+from decimal import Decimal
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+# pickle 协议 2 及以上的数据都以 PROTO(0x80) 开头, 头部只使用 0x00-0x7f
+LEGACY_HEADER = 0x80
+
+CODEC_PICKLE = 1
+CODEC_MSGPACK = 2
+CODEC_ORJSON = 3
+CODEC_MASK = 0x07
+
+COMPRESS_ZSTD = 1
+COMPRESS_LZ4 = 2
+COMPRESS_SHIFT = 3
+COMPRESS_MASK = 0x03
+
+ROW_FLAG = 0x20
+
+# 空值缓存的占位数据, 头部 0x00 不会被任何序列化方式使用
+NEGATIVE_VALUE = b'\x00'
+# 二级key指向对象id的指针, 头部 0x40 不会被任何序列化方式使用, 后接 id 字符串
+POINTER_HEADER = 0x40
+
+CODECS = {
+    'pickle': CODEC_PICKLE,
+    'msgpack': CODEC_MSGPACK,
+    'orjson': CODEC_ORJSON,
+}
+COMPRESSIONS = {
+    'zstd': COMPRESS_ZSTD,
+    'lz4': COMPRESS_LZ4,
+}
+
+# msgpack 扩展类型
+EXT_DATETIME = 1
+EXT_DATE = 2
+EXT_TIME = 3
+EXT_DECIMAL = 4
+EXT_UUID = 5
+EXT_TUPLE = 6
+
+_serializers = {}
+# 模型类 -> {字段名: 字符串转换函数}, orjson 读取 ORM 对象时使用
+_column_converters = {}
+
+_STR_CONVERTERS = {
+    datetime.datetime: datetime.datetime.fromisoformat,
+    datetime.date: datetime.date.fromisoformat,
+    datetime.time: datetime.time.fromisoformat,
+    Decimal: Decimal,
+    uuid.UUID: uuid.UUID,
+}
+_DJANGO_STR_FIELDS = {'DateTimeField', 'DateField', 'TimeField', 'DecimalField', 'UUIDField'}
+
+
+class SerializerError(Exception):
+    """序列化配置错误"""
+
+
+class Serializer(object):
+
+    def __init__(self, codec='legacy', compress=None, threshold=1024, level=3):
+        """
+        :param codec: legacy, pickle, msgpack, orjson
+        :param compress: None, zstd, lz4
+        :param threshold: 超过该长度（字节）才压缩
+        :param level: 压缩等级
+        """
+        if codec != 'legacy' and codec not in CODECS:
+            raise SerializerError(f'unknown codec: {codec}')
+        if compress and compress not in COMPRESSIONS:
+            raise SerializerError(f'unknown compression: {compress}')
+        if codec == 'legacy' and compress:
+            raise SerializerError('legacy codec does not support compression')
+        if codec == 'msgpack' and msgpack is None:
+            raise SerializerError('msgpack codec requires the msgpack package')
+        if codec == 'orjson' and orjson is None:
+            raise SerializerError('orjson codec requires the orjson package')
+        if compress == 'zstd' and zstandard is None:
+            raise SerializerError('zstd compression requires the zstandard package')
+        if compress == 'lz4' and lz4_frame is None:
+            raise SerializerError('lz4 compression requires the lz4 package')
+
+        self.codec = codec
+        self.compress = compress
+        self.threshold = threshold
+        self.level = level
+
+    def dumps(self, value):
+        if self.codec == 'legacy':
+            return pickle.dumps(value)
+
+        header = CODECS[self.codec]
+        if self.codec == 'pickle':
+            data = pickle.dumps(value, protocol=5)
+        else:
+            if is_model_instance(value):
+                header |= ROW_FLAG
+                value = extract_columns(value)
+            if self.codec == 'msgpack':
+                data = _msgpack_packb(value)
+            else:
+                data = orjson.dumps(value, default=_orjson_default)
+
+        if self.compress and len(data) > self.threshold:
+            compress = COMPRESSIONS[self.compress]
+            header |= compress << COMPRESS_SHIFT
+            data = _compress(compress, data, self.level)
+
+        return bytes((header,)) + data
+
+    @staticmethod
+    def loads(data, model=None):
+        return loads(data, model)
+
+
+_default_serializer = Serializer()
+
+
+def set_serializer(cache_name='default', codec='legacy', compress=None, threshold=1024, level=3):
+    """
+    设置缓存配置使用的序列化方式
+
+    Args:
+        cache_name: 缓存配置名称
+        codec: legacy, pickle, msgpack, orjson
+        compress: None, zstd, lz4
+        threshold: 超过该长度（字节）才压缩
+        level: 压缩等级
+
+    Returns: Serializer
+
+    """
+    serializer = Serializer(codec, compress, threshold, level)
+    _serializers[cache_name] = serializer
+    return serializer
+
+
+def get_serializer(cache_name='default'):
+    return _serializers.get(cache_name) or _default_serializer
+
+
+def dumps(value, cache_name='default'):
+    return get_serializer(cache_name).dumps(value)
+
+
+def loads(data, model=None):
+    """
+    反序列化, 根据头部识别格式
+
+    Args:
+        data: 缓存数据
+        model: 模型类, msgpack/orjson 格式的 ORM 对象需要用它重新构造; 不传时返回字段字典
+
+    Returns:
+
+    """
+    header = data[0]
+    if header == LEGACY_HEADER:
+        return pickle.loads(data)
+
+    codec = header & CODEC_MASK
+    compress = (header >> COMPRESS_SHIFT) & COMPRESS_MASK
+    data = memoryview(data)[1:]
+    if compress:
+        data = _decompress(compress, data)
+
+    if codec == CODEC_PICKLE:
+        return pickle.loads(data)
+    elif codec == CODEC_MSGPACK:
+        value = _msgpack_unpackb(data)
+    elif codec == CODEC_ORJSON:
+        value = orjson.loads(data)
+    else:
+        raise SerializerError(f'unknown cache header: {header:#x}')
+
+    if header & ROW_FLAG and model is not None:
+        if codec == CODEC_ORJSON:
+            value = coerce_columns(model, value)
+        return build_instance(model, value)
+    return value
+
+
+def dump_pointer(pk):
+    return bytes((POINTER_HEADER,)) + str(pk).encode()
+
+
+def load_pointer(data):
+    """指针中的 id, 不是指针时返回 None"""
+    if not data or data[0] != POINTER_HEADER:
+        return None
+    pk = bytes(data[1:]).decode()
+    return int(pk) if pk.isdigit() else pk
+
+
+def is_model_instance(value):
+    """是否为 SQLAlchemy 或 Django 模型对象"""
+    if isinstance(value, type):
+        return False
+    return hasattr(value, '__table__') or hasattr(getattr(value, '_meta', None), 'concrete_fields')
+
+
+def extract_columns(instance):
+    """
+    提取模型对象的字段值, 与 sqlalchemyx.dumps.to_dict 不同, 保留原始类型
+    """
+    if hasattr(instance, '__table__'):
+        from sqlalchemy import inspect
+        mapper = inspect(type(instance))
+        return {attr.key: getattr(instance, attr.key) for attr in mapper.column_attrs}
+
+    return {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+
+
+def coerce_columns(model, columns):
+    """
+    JSON 中以字符串保存的字段(datetime、date、time、Decimal、UUID)按模型字段类型还原
+    """
+    converters = _column_converters.get(model)
+    if converters is None:
+        converters = _column_converters[model] = _get_converters(model)
+
+    for name, convert in converters.items():
+        value = columns.get(name)
+        if isinstance(value, str):
+            columns[name] = convert(value)
+    return columns
+
+
+def _get_converters(model):
+    if hasattr(model, '_meta'):
+        # Django: to_python 负责把字符串转为字段类型
+        return {
+            field.attname: field.to_python for field in model._meta.concrete_fields
+            if field.get_internal_type() in _DJANGO_STR_FIELDS
+        }
+
+    from sqlalchemy import inspect
+    converters = {}
+    for attr in inspect(model).column_attrs:
+        try:
+            python_type = attr.columns[0].type.python_type
+        except NotImplementedError:
+            continue
+        for column_type, convert in _STR_CONVERTERS.items():
+            # datetime 是 date 的子类, 按 _STR_CONVERTERS 的顺序先匹配 datetime
+            if issubclass(python_type, column_type):
+                converters[attr.key] = convert
+                break
+    return converters
+
+
+def build_instance(model, columns):
+    """用字段值重新构造模型对象"""
+    if hasattr(model, '_meta'):
+        # Django: 与从数据库读取的对象状态一致
+        field_names = [field.attname for field in model._meta.concrete_fields]
+        values = [columns.get(name) for name in field_names]
+        return model.from_db(model.objects.db, field_names, values)
+
+    from sqlalchemy.orm import make_transient_to_detached
+    instance = model(**columns)
+    make_transient_to_detached(instance)
+    return instance
+
+
+def _compress(compress, data, level):
+    if compress == COMPRESS_ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return lz4_frame.compress(data, compression_level=level)
+
+
+def _decompress(compress, data):
+    if compress == COMPRESS_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+    return lz4_frame.decompress(data)
+
+
+def _msgpack_packb(value):
+    # strict_types: tuple 等子类型交给 _msgpack_default 处理, 否则 tuple 会按 list 保存
+    return msgpack.packb(value, default=_msgpack_default, use_bin_type=True, strict_types=True)
+
+
+def _msgpack_unpackb(data):
+    return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+
+
+def _msgpack_default(value):
+    if isinstance(value, tuple):
+        return msgpack.ExtType(EXT_TUPLE, _msgpack_packb(list(value)))
+    if isinstance(value, datetime.datetime):
+        return msgpack.ExtType(EXT_DATETIME, value.isoformat().encode())
+    if isinstance(value, datetime.date):
+        return msgpack.ExtType(EXT_DATE, value.isoformat().encode())
+    if isinstance(value, datetime.time):
+        return msgpack.ExtType(EXT_TIME, value.isoformat().encode())
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(EXT_DECIMAL, str(value).encode())
+    if isinstance(value, uuid.UUID):
+        return msgpack.ExtType(EXT_UUID, value.bytes)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if is_model_instance(value):
+        return extract_columns(value)
+    # strict_types 下 bool 以外的内置类型子类(如 IntEnum、SafeString)按基类保存
+    for base in (int, float, str, bytes, dict, list):
+        if isinstance(value, base):
+            return base(value)
+    raise TypeError(f'can not serialize {type(value).__name__!r} object')
+
+
+def _msgpack_ext_hook(code, data):
+    if code == EXT_DATETIME:
+        return datetime.datetime.fromisoformat(data.decode())
+    if code == EXT_DATE:
+        return datetime.date.fromisoformat(data.decode())
+    if code == EXT_TIME:
+        return datetime.time.fromisoformat(data.decode())
+    if code == EXT_DECIMAL:
+        return Decimal(data.decode())
+    if code == EXT_UUID:
+        return uuid.UUID(bytes=data)
+    if code == EXT_TUPLE:
+        return tuple(_msgpack_unpackb(data))
+    return msgpack.ExtType(code, data)
+
+
+def _orjson_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if is_model_instance(value):
+        return extract_columns(value)
+    raise TypeError(f'can not serialize {type(value).__name__!r} object')
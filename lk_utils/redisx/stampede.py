@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+缓存击穿保护
+
+single_flight: 缓存失效时只有拿到重建锁的进程查询数据库, 其他进程返回旧值或短暂等待
+early_refresh: XFetch 概率提前刷新, 在缓存过期前由单个进程提前重建
+"""
+import math
+import random
+import threading
+import time
+
+from redis.exceptions import LockError
+
+from lk_utils.redisx import serializers
+from lk_utils.redisx.lock import Lock
+
+
+STALE_SUFFIX = ':stale'
+DELTA_SUFFIX = ':delta'
+LOCK_SUFFIX = ':rebuild'
+
+# 旧值额外保留时间（秒）
+stale_ttl = 60
+# 重建锁超时时间（秒）
+lock_timeout = 10
+# 未拿到锁且没有旧值时的最长等待时间（秒）
+wait_timeout = 3
+wait_interval = 0.05
+
+# fetch 的 loads 返回该值时, 缓存数据视为未命中(如指针指向的对象已变更)
+MISS = object()
+
+_stats = {
+    'rebuilds': 0,
+    'prevented': 0,
+    'stale_served': 0,
+    'waited': 0,
+    'wait_timeouts': 0,
+    'early_refreshes': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _incr(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def stats():
+    """
+    击穿保护统计
+
+    rebuilds: 查询数据库重建缓存的次数
+    prevented: 缓存失效时被拦下、没有查询数据库的请求数（stale_served + waited）
+    stale_served: 返回旧值的次数
+    waited: 等待其他进程重建完成的次数
+    wait_timeouts: 等待超时后自行重建的次数
+    early_refreshes: 提前刷新的次数
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+
+def fetch(client, cache_key, rebuild, tm, single_flight=False, early_refresh=False, beta=1.0,
+          force_reload=False, serializer=None, model=None, negative_ttl=None, stale_ttl=None, cache_empty=False,
+          loads=None):
+    """
+    带击穿保护的缓存读取
+
+    Args:
+        client: redis 连接
+        cache_key: 缓存key
+        rebuild: 无参数的重建函数, 返回空值时不写缓存
+        tm: 缓存时间（秒）
+        single_flight: 缓存失效时只允许一个进程重建
+        early_refresh: 是否开启 XFetch 提前刷新
+        beta: 提前刷新系数, 越大越早刷新
+        force_reload: 是否强制刷新缓存
+        serializer: 序列化方式, 默认使用 default 配置
+        model: 模型类, 用于反序列化 ORM 对象
+        negative_ttl: 重建结果为空时缓存空值的时间（秒）, 默认不缓存
+        stale_ttl: 旧值额外保留时间（秒）, 默认使用模块配置 stale_ttl
+        cache_empty: 是否按 tm 缓存 0、空列表等空结果, None 以 NEGATIVE_VALUE 保存
+        loads: 反序列化函数, 默认 serializers.loads; 返回 MISS 时按未命中处理
+
+    Returns: 缓存对象
+
+    """
+    if serializer is None:
+        serializer = serializers.get_serializer()
+
+    def _loads(value):
+        if value == serializers.NEGATIVE_VALUE:
+            return None
+        if loads is not None:
+            return loads(value)
+        return serializers.loads(value, model)
+
+    def _build():
+        return _rebuild(client, cache_key, rebuild, tm, single_flight, early_refresh, serializer, negative_ttl,
+                        stale_ttl, cache_empty)
+
+    if force_reload:
+        return _build()
+
+    pipe = client.pipeline(transaction=False)
+    pipe.get(cache_key)
+    if early_refresh:
+        pipe.pttl(cache_key)
+        pipe.get(cache_key + DELTA_SUFFIX)
+    result = pipe.execute()
+
+    data = result[0]
+    if data:
+        if early_refresh and _should_refresh(result[1], result[2], beta):
+            lock = Lock(cache_key + LOCK_SUFFIX, timeout=lock_timeout, client=client)
+            if lock.acquire(blocking=False):
+                try:
+                    _incr('early_refreshes')
+                    return _build()
+                finally:
+                    _release(lock)
+
+        item = _loads(data)
+        if item is not MISS:
+            return item
+
+    if not single_flight:
+        return _build()
+
+    lock = Lock(cache_key + LOCK_SUFFIX, timeout=lock_timeout, client=client)
+    if lock.acquire(blocking=False):
+        try:
+            return _build()
+        finally:
+            _release(lock)
+
+    # 其他进程正在重建, 优先返回旧值
+    stale = client.get(cache_key + STALE_SUFFIX)
+    item = _loads(stale) if stale else MISS
+    if item is not MISS:
+        _incr('prevented')
+        _incr('stale_served')
+        return item
+
+    deadline = time.monotonic() + wait_timeout
+    while time.monotonic() < deadline:
+        time.sleep(wait_interval)
+        data = client.get(cache_key)
+        item = _loads(data) if data else MISS
+        if item is not MISS:
+            _incr('prevented')
+            _incr('waited')
+            return item
+        if not client.exists(cache_key + LOCK_SUFFIX):
+            # 重建方未写入缓存（如查询结果为空）, 不再等待
+            break
+
+    _incr('wait_timeouts')
+    return _build()
+
+
+def _should_refresh(pttl, delta, beta):
+    """XFetch: -delta * beta * ln(rand) >= 剩余过期时间 时提前刷新"""
+    if not delta or pttl is None or pttl < 0:
+        return False
+
+    delta = float(delta)
+    remaining = pttl / 1000
+    return -delta * beta * math.log(1.0 - random.random()) >= remaining
+
+
+def _rebuild(client, cache_key, rebuild, tm, single_flight, early_refresh, serializer, negative_ttl=None,
+             extra_ttl=None, cache_empty=False):
+    start = time.monotonic()
+    item = rebuild()
+    delta = time.monotonic() - start
+    _incr('rebuilds')
+    if not item and not cache_empty:
+        # 数据已不存在, 清掉旧缓存与旧值, 避免其他进程继续读到已删除的对象
+        pipe = client.pipeline(transaction=False)
+        if negative_ttl:
+            pipe.set(cache_key, serializers.NEGATIVE_VALUE, negative_ttl)
+        else:
+            pipe.delete(cache_key)
+        pipe.delete(cache_key + STALE_SUFFIX)
+        pipe.execute()
+        return item
+
+    if extra_ttl is None:
+        extra_ttl = stale_ttl
+    data = serializers.NEGATIVE_VALUE if item is None else serializer.dumps(item)
+    pipe = client.pipeline(transaction=False)
+    pipe.set(cache_key, data, tm)
+    if single_flight:
+        pipe.set(cache_key + STALE_SUFFIX, data, tm + extra_ttl)
+    if early_refresh:
+        pipe.set(cache_key + DELTA_SUFFIX, '%.6f' % delta, tm + extra_ttl)
+    pipe.execute()
+    return item
+
+
+def _release(lock):
+    try:
+        lock.release()
+    except LockError:
+        # 重建超过锁超时时间, 锁已被释放
+        pass
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+客户端缓存(Redis 6+ client tracking), 用于几乎每个请求都会读取的配置类 key
+
+开启后读取结果保存在进程内, 不设过期时间, 只有服务端通知 key 被修改、删除或过期时才丢弃,
+命中时不再访问 Redis, 同时保证与 Redis 中的数据一致:
+    1. 读取使用一个专用连接, 开启 CLIENT TRACKING 并 REDIRECT 到监听连接,
+       服务端会记住该连接读取过的 key
+    2. 监听连接订阅 __redis__:invalidate, 收到通知后删除对应的本地缓存
+    3. 监听连接断开时清空本地缓存并重新建立 tracking, 断线期间丢失的通知不会导致脏数据
+
+使用 REDIRECT 方式接收通知, 两个专用连接固定使用 RESP2, 与连接池的协议配置无关; 不支持集群模式
+
+    from lk_utils.redisx import tracking
+    tracking.enable_tracking('wechat')
+    tracking.get(cache_key, 'wechat')
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from redis import exceptions
+
+from lk_utils.redisx import ConnectionManager
+
+
+logger = logging.getLogger('redisx')
+
+INVALIDATE_CHANNEL = '__redis__:invalidate'
+
+_trackers = {}
+_registry_lock = threading.Lock()
+
+
+class TrackingCache(object):
+    """
+    一个缓存配置对应一个实例, 线程安全; 缓存的是 Redis 返回的原始数据
+    """
+
+    def __init__(self, cache_name='default', maxsize=4096, reconnect_interval=1):
+        """
+        :param cache_name: 缓存配置名称
+        :param maxsize: 最大缓存数量, 超出后淘汰最久未使用的 key
+        :param reconnect_interval: 监听连接断开后的重连间隔（秒）
+        """
+        self.cache_name = cache_name
+        self.maxsize = maxsize
+        self.reconnect_interval = reconnect_interval
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        # 每收到一次失效通知加 1, 读取期间发生变化时不写入本地缓存
+        self._generation = 0
+        self._reader = None
+        self._listener = None
+        self._pool = None
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, timeout=5):
+        """启动监听线程, 等待 tracking 建立完成"""
+        if self._thread is not None:
+            return self
+
+        # 配置保存在 contextvars 中, 监听线程读取不到, 在调用线程中获取连接池
+        self._pool = self._get_pool()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._listen, name=f'redisx-tracking-{self.cache_name}', daemon=True
+        )
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            logger.warning('[tracking] %s: tracking is not ready after %ss', self.cache_name, timeout)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        self._reset()
+
+    def get(self, key):
+        """
+        读取 key, 未命中或 tracking 未就绪时读取 Redis
+
+        Returns: Redis 返回的原始数据, key 不存在时返回 None
+        """
+        with self._lock:
+            entry = self._data.get(key, self)
+            if entry is not self:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generation
+
+        if not self._ready.is_set():
+            return ConnectionManager()[self.cache_name].get(key)
+
+        try:
+            value = self._read(key)
+        except (exceptions.ConnectionError, exceptions.TimeoutError):
+            # 读取连接异常, 交给监听线程重建, 本次直接读取
+            self._ready.clear()
+            return ConnectionManager()[self.cache_name].get(key)
+
+        with self._lock:
+            if self._generation == generation and self._ready.is_set():
+                self._data[key] = value
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return value
+
+    def invalidate(self, keys=None):
+        """删除本地缓存, keys 为 None 时全部删除"""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if keys is None:
+                self._data.clear()
+                return
+            for key in keys:
+                if isinstance(key, bytes):
+                    key = key.decode()
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / total if total else 0.0,
+                'ready': self._ready.is_set(),
+            }
+
+    def _read(self, key):
+        with self._read_lock:
+            reader = self._reader
+            if reader is None:
+                raise exceptions.ConnectionError('tracking connection is not ready')
+            reader.send_command('GET', key)
+            return reader.read_response()
+
+    def _get_pool(self):
+        client = ConnectionManager()[self.cache_name]
+        pool = getattr(client, 'connection_pool', None)
+        if pool is None:
+            raise ValueError(f'tracking does not support cluster connection: {self.cache_name}')
+        return pool
+
+    def _new_connection(self):
+        pool = self._pool
+        # 专用连接, 不放回连接池, 避免 tracking 状态影响其他命令;
+        # RESP3 下订阅消息是 push 类型, read_response 会交给 push handler 而不返回, 固定使用 RESP2
+        connection = pool.connection_class(**{**pool.connection_kwargs, 'protocol': 2})
+        connection.connect()
+        return connection
+
+    def _connect(self):
+        listener = self._new_connection()
+        listener.send_command('CLIENT', 'ID')
+        client_id = listener.read_response()
+        listener.send_command('SUBSCRIBE', INVALIDATE_CHANNEL)
+        listener.read_response()
+
+        reader = self._new_connection()
+        reader.send_command('CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id)
+        reader.read_response()
+
+        with self._read_lock:
+            self._listener, self._reader = listener, reader
+        # 旧连接的 tracking 已失效, 之前缓存的数据不再可信
+        self.invalidate()
+        self._ready.set()
+        logger.info('[tracking] %s: tracking redirect to client %s', self.cache_name, client_id)
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            try:
+                if self._listener is None or not self._ready.is_set():
+                    self._reset()
+                    self._connect()
+
+                if not self._listener.can_read(timeout=1):
+                    continue
+                message = self._listener.read_response()
+                self._handle(message)
+            except (exceptions.ConnectionError, exceptions.TimeoutError, OSError) as e:
+                logger.warning('[tracking] %s: connection lost: %s', self.cache_name, e)
+                self._reset()
+                self._stopped.wait(self.reconnect_interval)
+
+    def _handle(self, message):
+        if not isinstance(message, list) or len(message) < 3:
+            return
+        kind = message[0].decode() if isinstance(message[0], bytes) else message[0]
+        if kind != 'message':
+            return
+        # keys 为 None 表示 FLUSHALL/FLUSHDB, 全部失效
+        self.invalidate(message[2])
+
+    def _reset(self):
+        self._ready.clear()
+        with self._read_lock:
+            connections = (self._listener, self._reader)
+            self._listener = self._reader = None
+        for connection in connections:
+            if connection is not None:
+                connection.disconnect()
+        self.invalidate()
+
+
+def enable_tracking(cache_name='default', maxsize=4096):
+    """
+    为指定缓存配置开启客户端缓存
+
+    Args:
+        cache_name: 缓存配置名称
+        maxsize: 最大缓存数量
+
+    Returns: TrackingCache
+
+    """
+    with _registry_lock:
+        tracker = _trackers.get(cache_name)
+        if tracker is None:
+            tracker = _trackers[cache_name] = TrackingCache(cache_name, maxsize)
+        else:
+            tracker.maxsize = maxsize
+
+    return tracker.start()
+
+
+def disable_tracking(cache_name='default'):
+    with _registry_lock:
+        tracker = _trackers.pop(cache_name, None)
+
+    if tracker is not None:
+        tracker.stop()
+
+
+def get_tracking_cache(cache_name='default'):
+    """获取缓存配置对应的客户端缓存, 未开启时返回 None"""
+    return _trackers.get(cache_name)
+
+
+def get(cache_key, cache_name='default'):
+    """读取 key, 开启了客户端缓存时优先读取进程内数据"""
+    tracker = _trackers.get(cache_name)
+    if tracker is not None:
+        return tracker.get(cache_key)
+    return ConnectionManager()[cache_name].get(cache_key)
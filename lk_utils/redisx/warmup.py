@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+缓存预热, 用于发布或 Redis 切换后, 避免冷缓存的流量全部打到数据库
+
+    from lk_utils.redisx import warmup
+    warmup.warm([
+        warmup.WarmupTask(User, top=5000),
+        warmup.WarmupTask(Order, recent=('updated_at', 3600), lists=[{'filter_dict': {'status': 1}}]),
+        warmup.WarmupTask(Shop, ids=lambda: [1, 2, 3]),
+    ], concurrency=4, rate=2000)
+
+命令行:
+    python -m lk_utils.redisx.warmup app.models:User:top=5000 app.models:Order:recent=updated_at,3600 \\
+        --setup app:create_app --concurrency 4 --rate 2000
+
+对象缓存通过 djangox.redisx / sqlalchemyx.redisx 的 get_items_by_ids(query_items) 写入,
+列表缓存(set_all_item_cache)只支持 SQLAlchemy 模型
+"""
+import argparse
+import contextvars
+import datetime
+import importlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger('redisx')
+
+
+class WarmupTask(object):
+    """
+    一个模型的预热任务, id 来源可以组合使用:
+        ids: id 列表, 或返回 id 列表的函数
+        top: 最新(id 最大)的 N 条
+        recent: (字段名, 秒数), 该时间字段在最近 N 秒内的数据
+        query: query(model) 返回 id 或对象的可迭代对象
+    lists: set_all_item_cache 的参数列表, 如 [{'filter_dict': {'status': 1}, 'value': 'id'}]
+    """
+
+    def __init__(self, model, ids=None, top=None, recent=None, query=None, lists=None, cache_name='default'):
+        self.model = model
+        self.ids = ids
+        self.top = top
+        self.recent = recent
+        self.query = query
+        self.lists = lists or []
+        self.cache_name = cache_name
+
+    @property
+    def is_django(self):
+        return hasattr(self.model, '_meta')
+
+    def collect_ids(self):
+        """汇总各来源的 id, 去重并保持顺序"""
+        result = {}
+        if self.ids is not None:
+            ids = self.ids() if callable(self.ids) else self.ids
+            result.update(dict.fromkeys(ids))
+        if self.top:
+            result.update(dict.fromkeys(self._top_ids(self.top)))
+        if self.recent:
+            field, seconds = self.recent
+            result.update(dict.fromkeys(self._recent_ids(field, seconds)))
+        if self.query is not None:
+            for item in self.query(self.model):
+                result[getattr(item, 'id', item)] = None
+        return list(result)
+
+    def _top_ids(self, num):
+        if self.is_django:
+            queryset = self.model.objects.filter(deleted=0).order_by('-id').values_list('id', flat=True)
+            return list(queryset[:num])
+        model = self.model
+        rows = model.query.with_entities(model.id).filter(model.deleted == 0).order_by(model.id.desc()).limit(num)
+        return [row.id for row in rows]
+
+    def _recent_ids(self, field, seconds):
+        since = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+        if self.is_django:
+            queryset = self.model.objects.filter(deleted=0, **{f'{field}__gte': since})
+            return list(queryset.values_list('id', flat=True))
+        model = self.model
+        rows = model.query.with_entities(model.id).filter(model.deleted == 0, getattr(model, field) >= since)
+        return [row.id for row in rows]
+
+    def backend(self):
+        if self.is_django:
+            from lk_utils.djangox import redisx
+        else:
+            from lk_utils.sqlalchemyx import redisx
+        return redisx
+
+    def __repr__(self):
+        return f'<WarmupTask {self.model.__name__}>'
+
+
+class RateLimiter(object):
+    """令牌桶, 限制每秒预热的数量, 多线程共用"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._allowance = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+                self._last = now
+                # 单次数量超过 rate 时按 rate 计, 避免永远等待
+                amount = min(amount, self.rate)
+                if self._allowance >= amount:
+                    self._allowance -= amount
+                    return
+                wait = (amount - self._allowance) / self.rate
+            time.sleep(wait)
+
+
+class Progress(object):
+
+    def __init__(self, callback=None, interval=5):
+        self.callback = callback
+        self.interval = interval
+        self.stats = {'tasks': 0, 'ids': 0, 'items': 0, 'lists': 0, 'errors': 0}
+        self._started = time.monotonic()
+        self._reported = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+            now = time.monotonic()
+            if now - self._reported < self.interval:
+                return
+            self._reported = now
+            stats = self.snapshot()
+        self.report(stats)
+
+    def snapshot(self):
+        return {**self.stats, 'elapsed': round(time.monotonic() - self._started, 3)}
+
+    def report(self, stats=None):
+        stats = stats or self.snapshot()
+        if self.callback is not None:
+            self.callback(stats)
+        else:
+            logger.info('[warmup] %s', stats)
+
+
+def warm(tasks, concurrency=4, rate=None, chunk_size=500, force_reload=False, progress=None, interval=5):
+    """
+    预热对象缓存与列表缓存
+
+    Args:
+        tasks: WarmupTask 列表
+        concurrency: 并发线程数
+        rate: 每秒最多预热的对象数量, 默认不限制
+        chunk_size: 每次 get_items_by_ids 的 id 数量
+        force_reload: 是否覆盖已存在的缓存
+        progress: 进度回调, 参数为统计字典; 默认写日志
+        interval: 进度回调的最小间隔（秒）
+
+    Returns: 统计字典 {'tasks', 'ids', 'items', 'lists', 'errors', 'elapsed'}
+
+    """
+    # 命令行在 --setup 完成配置后才调用 warm, 模块导入时不能依赖 redis 配置
+    from lk_utils.redisx.operations import set_all_item_cache
+    from lk_utils.redisx.operations import split_chunks
+
+    limiter = RateLimiter(rate)
+    tracker = Progress(progress, interval)
+
+    def warm_items(task, ids):
+        limiter.acquire(len(ids))
+        try:
+            items = task.backend().get_items_by_ids(
+                model=task.model, ids=ids, force_reload=force_reload, cache_name=task.cache_name,
+                chunk_size=chunk_size
+            )
+        except Exception:
+            logger.exception('[warmup] %r failed, ids: %s...', task, ids[:10])
+            tracker.add(errors=1)
+            return
+        tracker.add(items=len(items))
+
+    def warm_list(task, params):
+        limiter.acquire()
+        try:
+            set_all_item_cache(task.model, force_reload=force_reload, cache_name=task.cache_name, **params)
+        except Exception:
+            logger.exception('[warmup] %r list failed: %s', task, params)
+            tracker.add(errors=1)
+            return
+        tracker.add(lists=1)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='redisx-warmup') as executor:
+        futures = []
+
+        def submit(fn, *args):
+            # 配置保存在 contextvars 中, 工作线程需要复制当前上下文
+            futures.append(executor.submit(contextvars.copy_context().run, fn, *args))
+
+        for task in tasks:
+            if task.lists and task.is_django:
+                raise ValueError(f'{task!r}: set_all_item_cache only supports SQLAlchemy models')
+
+            ids = task.collect_ids()
+            tracker.add(tasks=1, ids=len(ids))
+            for chunk in split_chunks(ids, chunk_size):
+                submit(warm_items, task, chunk)
+            for params in task.lists:
+                submit(warm_list, task, params)
+
+        for future in futures:
+            future.result()
+
+    stats = tracker.snapshot()
+    tracker.report(stats)
+    return stats
+
+
+def parse_task(spec):
+    """
+    解析命令行的任务描述: module:Model[:source=value[:source=value]]
+        ids=1,2,3  top=1000  recent=updated_at,3600  list=field=value,field=value
+    """
+    module_name, _, rest = spec.partition(':')
+    model_name, *sources = rest.split(':')
+    model = getattr(importlib.import_module(module_name), model_name)
+
+    kwargs = {'lists': []}
+    for source in sources:
+        name, _, value = source.partition('=')
+        if name == 'ids':
+            kwargs['ids'] = [int(pk) for pk in value.split(',') if pk]
+        elif name == 'top':
+            kwargs['top'] = int(value)
+        elif name == 'recent':
+            field, seconds = value.split(',')
+            kwargs['recent'] = (field, int(seconds))
+        elif name == 'list':
+            filter_dict = dict(pair.split('=', 1) for pair in value.split(',') if pair) if value else {}
+            kwargs['lists'].append({'filter_dict': filter_dict})
+        else:
+            raise ValueError(f'unknown warmup source: {source}')
+    return WarmupTask(model, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='redisx 缓存预热')
+    parser.add_argument('tasks', nargs='+', help='module:Model[:top=N][:recent=field,seconds][:ids=1,2][:list=]')
+    parser.add_argument('--setup', help='预热前调用的初始化函数 module:callable, 如 app:create_app')
+    parser.add_argument('--cache-name', default='default')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=int, default=None, help='每秒最多预热的对象数量')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--force-reload', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.setup:
+        module_name, _, func_name = args.setup.partition(':')
+        result = getattr(importlib.import_module(module_name), func_name)()
+        # Flask 应用需要在 app context 中查询
+        app_context = getattr(result, 'app_context', None)
+        if app_context is not None:
+            app_context().push()
+
+    tasks = [parse_task(spec) for spec in args.tasks]
+    for task in tasks:
+        task.cache_name = args.cache_name
+    stats = warm(tasks, args.concurrency, args.rate, args.chunk_size, args.force_reload)
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -57,13 +57,20 @@ class BaseRegister:
 class DjangoRegister(BaseRegister):
 
     def _redis(self):
+        caches = getattr(self.settings, 'CACHES')
         raw_config = {
-            key: conf['LOCATION'] for key, conf in
-            getattr(self.settings, 'CACHES').items()
+            key: conf['LOCATION'] for key, conf in caches.items()
         }
         setattr(self.settings, self.redis_key, raw_config)
         super()._redis()
 
+        # 兼容 django-redis 的连接池配置 OPTIONS.CONNECTION_POOL_KWARGS
+        redis_config = self.configure[ConfigKeys.Redis]
+        for key, conf in caches.items():
+            pool_kwargs = conf.get('OPTIONS', {}).get('CONNECTION_POOL_KWARGS')
+            if pool_kwargs:
+                redis_config[key] = {**redis_config[key], **pool_kwargs}
+
 
 class FlaskRegister(BaseRegister):
 
@@ -1,4 +1,5 @@
 from collections.abc import Iterable
+from lk_utils.redisx import hooks
 from lk_utils.redisx import operations
 
 
@@ -26,8 +27,8 @@ def query_item(model, filter_dict):
 
 
 @setattr_params
-def get_item(model, filter_dict=None, force_reload=False, cache_name='default'):
-    return operations.get_item(model, filter_dict, force_reload, cache_name, query_item)
+def get_item(model, filter_dict=None, force_reload=False, cache_name='default', **kwargs):
+    return operations.get_item(model, filter_dict, force_reload, cache_name, query_item, **kwargs)
 
 
 def query_items(model, miss_ids):
@@ -35,8 +36,19 @@ def query_items(model, miss_ids):
 
 
 @setattr_params
-def get_items_by_ids(model, ids, force_reload=False, cache_name='default'):
-    return operations.get_items_by_ids(model, ids, force_reload, cache_name, query_items)
+def get_items_by_ids(model, ids, force_reload=False, cache_name='default', chunk_size=None, **kwargs):
+    return operations.get_items_by_ids(model, ids, force_reload, cache_name, query_items, chunk_size, **kwargs)
+
+
+def query_items_by_field(model, field, values):
+    return model.query.filter(model.deleted == 0, getattr(model, field).in_(values))
+
+
+@setattr_params
+def get_items_by_field(model, field, values, force_reload=False, cache_name='default', chunk_size=None, **kwargs):
+    return operations.get_items_by_field(
+        model, field, values, force_reload, cache_name, query_items_by_field, chunk_size, **kwargs
+    )
 
 
 @setattr_params
@@ -44,3 +56,109 @@ def delete_item_cache(model, filter_dict=None, cache_name='default'):
     return operations.delete_item_cache(model, filter_dict, cache_name)
 
 
+@setattr_params
+def get_items_by_cursor(model, cursor=None, page_size=10, filter_dict=None, cache_name='default', **kwargs):
+    return operations.get_items_by_cursor(
+        model, cursor, page_size, filter_dict, cache_name=cache_name, query_func=query_items, **kwargs
+    )
+
+
+def enable_cache_hooks(model, lists=None, item_keys=None, cache_name='default', write_through=False, session=None):
+    """
+    开启事务提交后的自动缓存维护, 见 redisx.hooks
+
+    after_flush 时记录新增、修改、删除的对象(修改前的字段值取自属性历史), after_commit 时通过一个 pipeline 执行,
+    回滚时丢弃; write_through 在 after_flush_postexec 中重新加载数据库生成的字段(server_default、onupdate)后序列化;
+    Query.update / Query.delete 等批量操作不会触发
+
+    Args:
+        model: 模型类
+        lists: 列表缓存, set_all_item_cache 的参数列表
+        item_keys: 对象缓存的过滤字段, 默认 [('id',)]
+        cache_name: 缓存配置名称
+        write_through: 保存时写入最新对象, 默认删除对象缓存
+        session: 监听的 Session 类、sessionmaker 或 scoped_session, 默认所有 Session
+
+    Returns:
+
+    """
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    model.table_name = model.__tablename__
+    model.db_name = getattr(model, '__bind_key__', 'default')
+    hooks.register(model, lists, item_keys, cache_name, write_through)
+
+    target = Session if session is None else session
+    if not event.contains(target, 'after_flush', _after_flush):
+        event.listen(target, 'after_flush', _after_flush)
+        event.listen(target, 'after_flush_postexec', _after_flush_postexec)
+        event.listen(target, 'after_commit', _after_commit)
+        event.listen(target, 'after_rollback', _after_rollback)
+
+
+def disable_cache_hooks(model):
+    hooks.unregister(model)
+
+
+PENDING_KEY = 'redisx_pending'
+
+
+def _after_flush(session, flush_context):
+    ops = []
+    for instance in session.new:
+        ops.extend(hooks.collect(instance))
+    for instance in session.dirty:
+        ops.extend(hooks.collect(instance, previous=_previous(instance)))
+    for instance in session.deleted:
+        ops.extend(hooks.collect(instance, deleted=True, previous=_previous(instance)))
+    if not ops:
+        return
+
+    # savepoint 内的变更可能被单独回滚, 只做删除
+    if session.in_nested_transaction():
+        ops = hooks.conservative(ops)
+    session.info.setdefault(PENDING_KEY, []).extend(ops)
+
+
+def _previous(instance):
+    """本次 flush 修改前的字段值, after_flush 时属性历史还未重置"""
+    from sqlalchemy import inspect
+
+    spec = hooks.get_spec(type(instance))
+    if spec is None:
+        return None
+
+    attrs = inspect(instance).attrs
+    previous = {}
+    for field in spec.fields:
+        deleted = attrs[field].history.deleted
+        if deleted:
+            previous[field] = deleted[0]
+    return previous
+
+
+def _after_flush_postexec(session, flush_context):
+    ops = session.info.get(PENDING_KEY)
+    if ops:
+        # 提交后对象过期且不能再查询, 在事务内序列化
+        session.info[PENDING_KEY] = hooks.dump(ops, lambda instance: _load_expired(session, instance))
+
+
+def _load_expired(session, instance):
+    from sqlalchemy import inspect
+
+    # server_default、onupdate 等数据库生成的字段在 flush 后过期
+    expired = inspect(instance).expired_attributes
+    if expired:
+        session.refresh(instance, list(expired))
+
+
+def _after_commit(session):
+    ops = session.info.pop(PENDING_KEY, None)
+    if ops:
+        hooks.apply(ops)
+
+
+def _after_rollback(session):
+    session.info.pop(PENDING_KEY, None)
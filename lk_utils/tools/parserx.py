@@ -1,7 +1,62 @@
+from urllib.parse import parse_qs
+from urllib.parse import unquote
+from urllib.parse import urlparse
+
+
+def _to_bool(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+# URL 查询参数中支持的连接池配置及其类型
+REDIS_URL_OPTIONS = {
+    'max_connections': int,
+    'health_check_interval': int,
+    'socket_timeout': float,
+    'socket_connect_timeout': float,
+    'socket_keepalive': _to_bool,
+    'retry_on_timeout': _to_bool,
+    # 连接池耗尽时等待空闲连接的最长时间（秒）, 设置后使用阻塞连接池
+    'pool_timeout': float,
+    'ssl_cert_reqs': str,
+    'ssl_ca_certs': str,
+    'client_name': str,
+    # 集群模式下读请求发送到从节点
+    'read_from_replicas': _to_bool,
+    'sentinel_password': str,
+}
+# 只适用于 TLS 连接(rediss) 的参数, 普通连接不接受
+SSL_OPTIONS = ('ssl_cert_reqs', 'ssl_ca_certs')
+
+
+def _parse_hosts(hosts, default_port):
+    """host1:port1,host2:port2 -> [(host1, port1), (host2, port2)]"""
+    nodes = []
+    for node in hosts.split(','):
+        if not node:
+            continue
+        host, _, port = node.rpartition(':') if ':' in node else (node, '', '')
+        nodes.append((host, int(port or default_port)))
+    return nodes
+
+
 def parser_redis_url(conn_kwargs):
     """
     解析 Redis URL 的连接格式, 转为字典格式
 
+    支持格式:
+        redis://[[username]:password@]host[:port][/db][?option=value]
+        rediss://[[username]:password@]host[:port][/db][?option=value]
+        unix://[[username]:password@]/path/to/socket.sock[?db=0&option=value]
+        redis+cluster://[[username]:password@]host1:port1,host2:port2[?read_from_replicas=true]
+        redis+sentinel://[[username]:password@]host1:port1,host2:port2/service_name[/db][?option=value]
+
+    密码中可以直接包含 /、#、? 等字符, 按最后一个 @ 拆分认证信息
+
+    单机模式可通过 replicas=host1:port1,host2:port2 配置只读从库, 读缓存时使用
+
+    连接池参数通过查询参数设置, 见 REDIS_URL_OPTIONS, 例如:
+        redis://:pwd@127.0.0.1:6379/0?max_connections=100&health_check_interval=30&socket_keepalive=true
+
     Args:
         conn_kwargs: {conn_name: conn_url}
 
@@ -11,15 +66,54 @@ def parser_redis_url(conn_kwargs):
 
     config = {}
     for name, url in conn_kwargs.items():
-        url, db = url.rsplit('/', 1)
-        url, port = url.rsplit(':', 1)
-        url, host = url.rsplit('@', 1)
-        _, password = url.rsplit(':', 1)
-        config[name] = {
-            'db': int(db),
-            'port': int(port),
-            'host': str(host),
-            'password': str(password)
+        # 先拆出认证信息, 密码中的 /、#、? 不能交给 urlparse 解析
+        scheme, _, rest = url.partition('://')
+        userinfo, _, rest = rest.rpartition('@')
+        username, _, password = userinfo.partition(':')
+        url = urlparse(f'{scheme}://{rest}')
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        # 多节点地址 urlparse 无法解析 hostname, 手动拆分
+        hosts = url.netloc
+        params = {
+            'password': unquote(password) if password else None,
         }
+        if username:
+            params['username'] = unquote(username)
+
+        if url.scheme in ('redis+cluster', 'rediss+cluster'):
+            params['cluster'] = True
+            params['startup_nodes'] = _parse_hosts(hosts, 6379)
+            if url.scheme == 'rediss+cluster':
+                params['ssl'] = True
+        elif url.scheme in ('redis+sentinel', 'rediss+sentinel'):
+            service_name, _, db = url.path.strip('/').partition('/')
+            params['sentinels'] = _parse_hosts(hosts, 26379)
+            params['service_name'] = service_name
+            params['db'] = int(db or query.pop('db', 0))
+            if url.scheme == 'rediss+sentinel':
+                params['ssl'] = True
+        elif url.scheme == 'unix':
+            params['unix_socket_path'] = unquote(url.path)
+            params['db'] = int(query.pop('db', 0))
+        elif url.scheme in ('redis', 'rediss'):
+            db = url.path.lstrip('/') or query.pop('db', 0)
+            params['db'] = int(db)
+            params['host'] = str(url.hostname)
+            params['port'] = int(url.port or 6379)
+            if url.scheme == 'rediss':
+                params['ssl'] = True
+        else:
+            raise ValueError(f'Unsupported Redis URL scheme: {url.scheme}; {name}')
+
+        if 'replicas' in query:
+            params['replicas'] = _parse_hosts(query.pop('replicas'), 6379)
+
+        for key, value in query.items():
+            if key in SSL_OPTIONS and not params.get('ssl'):
+                continue
+            if key in REDIS_URL_OPTIONS:
+                params[key] = REDIS_URL_OPTIONS[key](value)
+
+        config[name] = params
 
     return config
@@ -21,16 +21,38 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
+import argparse
+import atexit
+import datetime
 import logging
+import os
+import random
 import socket
+import threading
 import time
-
-from lk_utils.redisx import client
+import uuid
+import weakref
 
 
 id_worker = None
 logger = logging.getLogger("idworker")
 
+# fork 后子进程需要重新创建锁, 父进程中其他线程持有的锁不会被释放
+_workers = weakref.WeakSet()
+_init_lock = threading.Lock()
+
+# id 结构: 时间戳(毫秒, 相对 TWEPOCH) | data_center_id | worker_id | sequence
+# 2018/7/12 10:6:1 GMT + 8
+TWEPOCH = 1531361161000
+WORKER_ID_BITS = 5
+DATA_CENTER_ID_BITS = 5
+SEQUENCE_BITS = 12
+TIMESTAMP_LEFT_SHIFT = SEQUENCE_BITS + WORKER_ID_BITS + DATA_CENTER_ID_BITS
+
+# 按 ASCII 顺序排列的字母表, 定长编码后字符串顺序与 id 大小一致
+BASE62_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
 
 class InputError(Exception):
     pass
@@ -40,25 +62,53 @@ class InvalidSystemClock(Exception):
     pass
 
 
+class LeaseLost(Exception):
+    """worker id 租约已失效, 继续生成可能与其他进程重复"""
+
+
 class IdWorker(object):
-    def __init__(self, worker_id=0, data_center_id=0):
+    """
+    线程安全的 snowflake id 生成器
+
+    时间戳使用 系统时间锚点 + 单调时钟经过的时间, 每 clock_resync_interval 秒与系统时间重新对齐:
+        系统时间前进: 直接对齐
+        系统时间回拨不超过 clock_tolerance_ms: 对齐后等待时钟追上已使用的时间
+        回拨更多: clock_regression='logical' 时每次对齐最多回退 clock_tolerance_ms, 逐步追上系统时间,
+                  期间时间戳领先于系统时间(逻辑时钟); 'raise' 时抛出 InvalidSystemClock
+    当前毫秒的序列号用完时预借下一毫秒继续分配, 不再空转等待, 最多预借 max_borrow_ms 毫秒,
+    超过时 sleep 等待时钟追上
+
+    get_stats() 返回回拨、等待与序列号用完的次数
+    """
+
+    # 最多预借的毫秒数
+    max_borrow_ms = 1000
+    # 可以等待的时钟回拨（毫秒）
+    clock_tolerance_ms = 10
+    # 与系统时间重新对齐的间隔（秒）
+    clock_resync_interval = 1
+    # 回拨超过 clock_tolerance_ms 时的处理方式: logical / raise
+    clock_regression = "logical"
+
+    def __init__(self, worker_id=0, data_center_id=0, lease=None):
         self.worker_id = worker_id
         self.data_center_id = data_center_id
+        # WorkerLease, 租约失效后拒绝生成 id
+        self.lease = lease
 
         self.logger = logger
 
         # stats
         self.ids_generated = 6
 
-        # 2018/7/12 10:6:1 GMT + 8
-        self.twepoch = 1531361161000
+        self.twepoch = TWEPOCH
 
         self.sequence = 0
-        self.worker_id_bits = 5
-        self.data_center_id_bits = 5
+        self.worker_id_bits = WORKER_ID_BITS
+        self.data_center_id_bits = DATA_CENTER_ID_BITS
         self.max_worker_id = -1 ^ (-1 << self.worker_id_bits)
         self.max_data_center_id = -1 ^ (-1 << self.data_center_id_bits)
-        self.sequence_bits = 12
+        self.sequence_bits = SEQUENCE_BITS
 
         self.worker_id_shift = self.sequence_bits
         self.data_center_id_shift = self.sequence_bits + self.worker_id_bits
@@ -66,6 +116,17 @@ class IdWorker(object):
         self.sequence_mask = -1 ^ (-1 << self.sequence_bits)
 
         self.last_timestamp = -1
+        self.stats = {
+            # 检测到系统时间回拨的次数
+            "regressions": 0,
+            # 因回拨或预借过多而等待的次数与总毫秒数
+            "waits": 0,
+            "wait_ms": 0,
+            # 回拨超过容忍范围, 以逻辑时钟继续的次数
+            "logical": 0,
+            # 当前毫秒序列号用完的次数
+            "exhausted": 0,
+        }
 
         # Sanity check for worker_id
         if self.worker_id > self.max_worker_id or self.worker_id < 0:
@@ -76,6 +137,11 @@ class IdWorker(object):
             raise InputError("data_center_id", "data center id can't be greater"
                              " than %i or less than 0" % self.max_data_center_id)
 
+        self._lock = threading.Lock()
+        self._logical_clock = False
+        self._reset_clock()
+        _workers.add(self)
+
         self.logger.info("worker starting. timestamp left shift %d,"
                          " data center id bits %d, worker id bits %d,"
                          " sequence bits %d, worker id %d" % (self.timestamp_left_shift,
@@ -84,40 +150,105 @@ class IdWorker(object):
                                                               self.sequence_bits,
                                                               self.worker_id))
 
-    def _time_gen(self):
-        return int(time.time() * 1000)
-
-    def _till_next_millis(self, last_timestamp):
-        timestamp = self._time_gen()
-        while last_timestamp <= timestamp:
-            timestamp = self._time_gen()
-
-        return timestamp
+    def _reset_clock(self):
+        self._wall_start = time.time_ns() // 1000000
+        self._monotonic_start = time.monotonic_ns() // 1000000
+
+    def _resync_clock(self):
+        """与系统时间重新对齐, 在锁内调用"""
+        wall = time.time_ns() // 1000000
+        monotonic = time.monotonic_ns() // 1000000
+        backward = self._wall_start + monotonic - self._monotonic_start - wall
+        if backward <= 0:
+            if self._logical_clock:
+                self._logical_clock = False
+                self.logger.info("clock caught up with system time")
+            self._wall_start, self._monotonic_start = wall, monotonic
+            return
+
+        if backward > self.clock_tolerance_ms:
+            if self.clock_regression == "raise":
+                self.stats["regressions"] += 1
+                self.logger.warning("clock is moving backwards. Rejecting request until %i"
+                                    % self.last_timestamp)
+                raise InvalidSystemClock("Clock moved backwards. "
+                                         "Refusing to generate id for %i milliseocnds"
+                                         % backward)
+            if not self._logical_clock:
+                # 逐步追赶期间不重复计数
+                self._logical_clock = True
+                self.stats["regressions"] += 1
+                self.stats["logical"] += 1
+                self.logger.warning("clock moved backwards %d ms, using logical clock", backward)
+        elif not self._logical_clock:
+            self.stats["regressions"] += 1
+
+        step = min(backward, self.clock_tolerance_ms)
+        self._wall_start = wall + backward - step
+        self._monotonic_start = monotonic
+        self._wait(self.last_timestamp - self._time_gen())
+
+    def _wait(self, ms):
+        if ms <= 0:
+            return
+        self.stats["waits"] += 1
+        self.stats["wait_ms"] += ms
+        time.sleep(ms / 1000)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, ids_generated=self.ids_generated)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
 
-    def _next_id(self):
-        timestamp = self._time_gen()
-
-        if self.last_timestamp > timestamp:
-            self.logger.warning("clock is moving backwards. Rejecting request until %i"
-                                % self.last_timestamp)
-            raise InvalidSystemClock("Clock moved backwards. "
-                                     "Refusing to generate id for %i milliseocnds"
-                                     % self.last_timestamp)
+    def _time_gen(self):
+        return self._wall_start + time.monotonic_ns() // 1000000 - self._monotonic_start
 
-        if self.last_timestamp == timestamp:
-            self.sequence = (self.sequence + 1) & self.sequence_mask
-            if self.sequence == 0:
-                timestamp = self._till_next_millis(self.last_timestamp)
-        else:
-            self.sequence = 0
+    def _reserve(self, n):
+        """
+        预留 n 个序列号
 
-        self.last_timestamp = timestamp
+        Returns: [(timestamp, 起始序列号, 数量)]
+        """
+        if self.lease is not None and not self.lease.valid:
+            raise LeaseLost("worker id lease lost, data center id %d, worker id %d"
+                            % (self.data_center_id, self.worker_id))
 
-        new_id = ((timestamp - self.twepoch) << self.timestamp_left_shift)\
+        ranges = []
+        with self._lock:
+            timestamp = self._time_gen()
+            if timestamp - self._wall_start >= self.clock_resync_interval * 1000:
+                self._resync_clock()
+                timestamp = self._time_gen()
+            if timestamp > self.last_timestamp:
+                self.last_timestamp = timestamp
+                self.sequence = -1
+
+            while n > 0:
+                free = self.sequence_mask - self.sequence
+                if not free:
+                    # 当前毫秒已用完, 预借下一毫秒
+                    self.stats["exhausted"] += 1
+                    self.last_timestamp += 1
+                    self.sequence = -1
+                    self._wait(self.last_timestamp - self._time_gen() - self.max_borrow_ms)
+                    continue
+                count = min(free, n)
+                ranges.append((self.last_timestamp, self.sequence + 1, count))
+                self.sequence += count
+                n -= count
+            self.ids_generated += sum(count for _, _, count in ranges)
+        return ranges
+
+    def _base_id(self, timestamp):
+        return ((timestamp - self.twepoch) << self.timestamp_left_shift)\
             | (self.data_center_id << self.data_center_id_shift)\
-            | (self.worker_id << self.worker_id_shift) | self.sequence
-        self.ids_generated += 1
-        return new_id
+            | (self.worker_id << self.worker_id_shift)
+
+    def _next_id(self):
+        (timestamp, sequence, _), = self._reserve(1)
+        return self._base_id(timestamp) | sequence
 
     def get_worker_id(self):
         return self.worker_id
@@ -131,10 +262,31 @@ class IdWorker(object):
                           % (new_id, self.worker_id, self.data_center_id))
         return new_id
 
+    def get_ids(self, n):
+        """
+        批量生成 n 个递增的 id, 一次加锁预留整段序列号
+
+        Returns: id 列表
+        """
+        ids = []
+        for timestamp, sequence, count in self._reserve(n):
+            base_id = self._base_id(timestamp) | sequence
+            ids.extend(range(base_id, base_id + count))
+        return ids
+
     def get_datacenter_id(self):
         return self.data_center_id
 
 
+def _after_fork_in_child():
+    for worker in list(_workers):
+        worker._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
 def get_host_ip():
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -145,31 +297,210 @@ def get_host_ip():
     return ip
 
 
-def get_center_id():
-    """分布式机器id"""
-    cache_key = 'snowflake_id'
-    num_cache_key = 'snowflake_id_num'
-    ipaddr = get_host_ip()
-    cache_id = int(client.hget(cache_key, ipaddr) or 0)
-    if cache_id:
-        return cache_id
-
-    # 分配新id
-    new_center_id = client.incr(num_cache_key)
-    if new_center_id > 31:
-        # 超出最大id值,归零
-        client.set(num_cache_key, 1)
-        new_center_id = 1
-
-    client.hset(cache_key, ipaddr, new_center_id)
-    return new_center_id
-
-
-def init_snowflake(worker_id=0):
+class WorkerLease(object):
+    """
+    通过 redis 租约分配 (data_center_id, worker_id), 共 1024 个, 进程之间不会重复
+
+    租约保存在 zset(slot -> 过期时间) 与 hash(slot -> 持有者) 中, 申请、续期与释放都是 Lua 脚本;
+    后台线程每 ttl/3 秒续期一次, 超过 ttl 未能续期或租约被他人占用时视为失效, IdWorker 拒绝生成 id;
+    进程退出时释放
+    """
+
+    LEASES_KEY = "{lk_utils:snowflake}:leases"
+    OWNERS_KEY = "{lk_utils:snowflake}:owners"
+
+    # 先清理过期租约, 从 ARGV[3] 开始查找空闲 slot
+    ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now)
+for _, slot in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], slot)
+    redis.call('HDEL', KEYS[2], slot)
+end
+local total = tonumber(ARGV[4])
+if redis.call('ZCARD', KEYS[1]) >= total then
+    return -1
+end
+for i = 0, total - 1 do
+    local slot = tostring((tonumber(ARGV[3]) + i) % total)
+    if not redis.call('ZSCORE', KEYS[1], slot) then
+        redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), slot)
+        redis.call('HSET', KEYS[2], slot, ARGV[1])
+        return tonumber(slot)
+    end
+end
+return -1
+"""
+
+    RENEW_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[2]) ~= ARGV[1] then
+    return 0
+end
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+return 1
+"""
+
+    RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[2]) ~= ARGV[1] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('HDEL', KEYS[2], ARGV[2])
+return 1
+"""
+
+    def __init__(self, ttl=30, cache_name="default", worker_id_bits=5, data_center_id_bits=5):
+        """
+        :param ttl: 租约时间（秒）
+        :param cache_name: redis 配置名称
+        """
+        self.ttl = ttl
+        self.cache_name = cache_name
+        self.worker_id_bits = worker_id_bits
+        self.total = 1 << (worker_id_bits + data_center_id_bits)
+        self.owner = "%s:%d:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+        self.slot = None
+        self.pid = None
+        # 租约有效截止时间(单调时钟), 留出一个续期周期的余量
+        self._deadline = 0
+        self._stop = None
+
+    @property
+    def client(self):
+        from lk_utils.redisx import ConnectionManager
+
+        return ConnectionManager()[self.cache_name]
+
+    @property
+    def worker_id(self):
+        return self.slot & ((1 << self.worker_id_bits) - 1)
+
+    @property
+    def data_center_id(self):
+        return self.slot >> self.worker_id_bits
+
+    @property
+    def valid(self):
+        return self.slot is not None and self.pid == os.getpid() and time.monotonic() < self._deadline
+
+    def acquire(self):
+        keys = [self.LEASES_KEY, self.OWNERS_KEY]
+        ttl_ms = int(self.ttl * 1000)
+        # 随机起点, 减少多个进程同时申请时的冲突
+        start = random.randrange(self.total)
+        started = time.monotonic()
+        slot = self.client.register_script(self.ACQUIRE_SCRIPT)(
+            keys=keys, args=[self.owner, ttl_ms, start, self.total]
+        )
+        if slot < 0:
+            raise InputError("lease", "no free snowflake worker id, all %d are leased" % self.total)
+
+        self.slot = slot
+        self.pid = os.getpid()
+        self._deadline = started + self.ttl * 2 / 3
+        atexit.register(self.release)
+        self._start_heartbeat()
+        logger.info("[snowflake lease] acquired data_center_id: %d, worker_id: %d",
+                    self.data_center_id, self.worker_id)
+        return self
+
+    def renew(self):
+        """续期, 租约已不属于自己时返回 False"""
+        started = time.monotonic()
+        renewed = self.client.register_script(self.RENEW_SCRIPT)(
+            keys=[self.LEASES_KEY, self.OWNERS_KEY], args=[self.owner, self.slot, int(self.ttl * 1000)]
+        )
+        if not renewed:
+            self._deadline = 0
+            return False
+        self._deadline = started + self.ttl * 2 / 3
+        return True
+
+    def release(self):
+        self._stop_heartbeat()
+        if self.slot is None or self.pid != os.getpid():
+            return False
+        slot, self.slot, self._deadline = self.slot, None, 0
+        atexit.unregister(self.release)
+        try:
+            return bool(self.client.register_script(self.RELEASE_SCRIPT)(
+                keys=[self.LEASES_KEY, self.OWNERS_KEY], args=[self.owner, slot]
+            ))
+        except Exception:
+            # 释放失败时等待租约自然过期
+            logger.warning("[snowflake lease] release failed, slot: %s", slot, exc_info=True)
+            return False
+
+    def _start_heartbeat(self):
+        stop = threading.Event()
+        interval = self.ttl / 3
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    if not self.renew():
+                        logger.error("[snowflake lease] lease lost, slot: %s", self.slot)
+                        return
+                except Exception as e:
+                    # 续期失败时继续重试, 超过截止时间后 IdWorker 拒绝生成 id
+                    logger.warning("[snowflake lease] renew failed: %s", e)
+
+        thread = threading.Thread(target=run, name="snowflake-lease", daemon=True)
+        thread.start()
+        self._stop = stop
+
+    def _stop_heartbeat(self):
+        stop, self._stop = self._stop, None
+        if stop is not None:
+            stop.set()
+
+
+def init_snowflake(worker_id=None, data_center_id=None, ttl=30, cache_name="default"):
+    """
+    初始化 id 生成器
+
+    同时传入 worker_id 与 data_center_id 时直接使用, 否则通过 redis 租约分配, 每个进程一个, 最多 1024 个进程;
+    fork 出的子进程在第一次生成 id 时重新申请
+
+    旧版本的 init_snowflake(0) 同样通过租约分配, 只传其中一个 id 时忽略并记录警告
+    """
     global id_worker
-    data_center_id = get_center_id()
-    logger.info('[init snowflake] start, data_center_id: %d', data_center_id)
-    id_worker = IdWorker(worker_id=0, data_center_id=data_center_id)
+    if worker_id is not None and data_center_id is not None:
+        id_worker = IdWorker(worker_id=worker_id, data_center_id=data_center_id)
+        return id_worker
+    if worker_id or data_center_id:
+        # 只指定一个 id 时另一个无法保证不重复, 各主机都会得到相同的组合
+        logger.warning('[init snowflake] worker_id and data_center_id must be given together, '
+                       'ignore worker_id: %s, data_center_id: %s', worker_id, data_center_id)
+
+    if id_worker is not None and id_worker.lease is not None:
+        id_worker.lease.release()
+    lease = WorkerLease(ttl, cache_name).acquire()
+    logger.info('[init snowflake] start, data_center_id: %d, worker_id: %d', lease.data_center_id, lease.worker_id)
+    id_worker = IdWorker(worker_id=lease.worker_id, data_center_id=lease.data_center_id, lease=lease)
+    return id_worker
+
+
+def get_center_id():
+    """已废弃, 返回当前进程租约分配的 data_center_id"""
+    import warnings
+    warnings.warn("get_center_id is deprecated, use init_snowflake() instead", DeprecationWarning, stacklevel=2)
+    with _init_lock:
+        if id_worker is None:
+            init_snowflake()
+    return _get_worker().data_center_id
+
+
+def _get_worker():
+    lease = id_worker.lease
+    if lease is not None and lease.pid != os.getpid():
+        with _init_lock:
+            if id_worker.lease is lease:
+                init_snowflake(ttl=lease.ttl, cache_name=lease.cache_name)
+    return id_worker
 
 
 def generate_id():
@@ -177,4 +508,197 @@ def generate_id():
     ID生成接口
     https://segmentfault.com/a/1190000011282426
     """
-    return id_worker.get_id()
+    return _get_worker().get_id()
+
+
+def generate_ids(n):
+    """批量生成 n 个 id"""
+    return _get_worker().get_ids(n)
+
+
+def get_stats():
+    """id 生成统计: 时钟回拨、等待与序列号用完的次数; 未调用 init_snowflake 时返回空字典"""
+    if id_worker is None:
+        return {}
+    return id_worker.get_stats()
+
+
+_UTC_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _to_milliseconds(value, end=False):
+    """
+    datetime、date 或秒级时间戳转为毫秒时间戳
+
+    不带时区的 datetime 与 date 按 UTC 处理, 与 decode_id 返回的时间一致;
+    end 为 True 时 date 表示当天的最后一毫秒
+    """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return (value - _UTC_EPOCH) // datetime.timedelta(milliseconds=1)
+    if isinstance(value, datetime.date):
+        if end:
+            value += datetime.timedelta(days=1)
+        milliseconds = (value - _UTC_EPOCH.date()) // datetime.timedelta(milliseconds=1)
+        return milliseconds - 1 if end else milliseconds
+    return int(value * 1000)
+
+
+def decode_id(new_id):
+    """
+    解析单个 id
+
+    Returns: {'timestamp': 毫秒时间戳, 'datetime', 'data_center_id', 'worker_id', 'sequence'};
+        datetime 为 UTC 时区的 datetime, 与 decode_ids 一致
+    """
+    timestamp = (new_id >> TIMESTAMP_LEFT_SHIFT) + TWEPOCH
+    return {
+        "timestamp": timestamp,
+        "datetime": _UTC_EPOCH + datetime.timedelta(milliseconds=timestamp),
+        "data_center_id": (new_id >> (SEQUENCE_BITS + WORKER_ID_BITS)) & ((1 << DATA_CENTER_ID_BITS) - 1),
+        "worker_id": (new_id >> SEQUENCE_BITS) & ((1 << WORKER_ID_BITS) - 1),
+        "sequence": new_id & ((1 << SEQUENCE_BITS) - 1),
+    }
+
+
+def decode_ids(ids):
+    """
+    批量解析 id, 向量化计算
+
+    Args:
+        ids: id 列表或 NumPy 数组
+
+    Returns: {'timestamp', 'datetime', 'data_center_id', 'worker_id', 'sequence'}, 值为 NumPy 数组;
+        timestamp 为毫秒时间戳, datetime 为 datetime64[ms], 表示 UTC 时间(datetime64 不带时区)
+    """
+    import numpy as np
+
+    ids = np.asarray(ids, dtype=np.int64)
+    timestamp = (ids >> TIMESTAMP_LEFT_SHIFT) + TWEPOCH
+    return {
+        "timestamp": timestamp,
+        "datetime": timestamp.astype("datetime64[ms]"),
+        "data_center_id": (ids >> (SEQUENCE_BITS + WORKER_ID_BITS)) & ((1 << DATA_CENTER_ID_BITS) - 1),
+        "worker_id": (ids >> SEQUENCE_BITS) & ((1 << WORKER_ID_BITS) - 1),
+        "sequence": ids & ((1 << SEQUENCE_BITS) - 1),
+    }
+
+
+def ids_for_time_range(start, end):
+    """
+    时间范围对应的 id 范围, 用于按主键范围查询, 如 id BETWEEN min_id AND max_id
+
+    Args:
+        start: 开始时间, datetime、date 或秒级时间戳; 不带时区时按 UTC 处理
+        end: 结束时间(包含), datetime、date 或秒级时间戳; date 包含当天全部时间
+
+    Returns: (min_id, max_id)
+    """
+    min_id = max(_to_milliseconds(start) - TWEPOCH, 0) << TIMESTAMP_LEFT_SHIFT
+    max_id = ((_to_milliseconds(end, end=True) - TWEPOCH + 1) << TIMESTAMP_LEFT_SHIFT) - 1
+    return min_id, max_id
+
+
+def _encode(new_id, alphabet, width):
+    base = len(alphabet)
+    chars = []
+    while new_id:
+        new_id, idx = divmod(new_id, base)
+        chars.append(alphabet[idx])
+    return "".join(reversed(chars)).rjust(width, alphabet[0])
+
+
+def _decode(value, alphabet):
+    base = len(alphabet)
+    result = 0
+    for char in value:
+        result = result * base + alphabet.index(char)
+    return result
+
+
+def encode_id(new_id, encoding="base62"):
+    """
+    id 转为短字符串, 用于公开的 url
+
+        base62: 11 位定长, 字符串顺序与 id 顺序一致
+        base58: 11 位定长, 去掉易混淆字符(0OIl), 字符串顺序与 id 顺序一致
+        cipherx: 使用 cipherx.base58 的字母表, 与已有编码兼容, 不保证顺序
+    """
+    if encoding == "base62":
+        return _encode(new_id, BASE62_ALPHABET, 11)
+    if encoding == "base58":
+        return _encode(new_id, BASE58_ALPHABET, 11)
+    if encoding == "cipherx":
+        from lk_utils.cipherx import base58
+
+        return base58.b58encode_int(new_id).decode()
+    raise ValueError("unknown encoding: %s" % encoding)
+
+
+def decode_encoded_id(value, encoding="base62"):
+    """encode_id 的逆操作"""
+    if encoding == "base62":
+        return _decode(value, BASE62_ALPHABET)
+    if encoding == "base58":
+        return _decode(value, BASE58_ALPHABET)
+    if encoding == "cipherx":
+        from lk_utils.cipherx import base58
+
+        return base58.b58decode_int(value)
+    raise ValueError("unknown encoding: %s" % encoding)
+
+
+def _benchmark_run(worker, size, per_thread):
+    if size == 1:
+        get_id = worker._next_id
+        return [get_id() for _ in range(per_thread)]
+    ids = []
+    for _ in range(per_thread):
+        ids.extend(worker.get_ids(size))
+    return ids
+
+
+def benchmark(total=1000000, threads=(1, 32), batch=1):
+    """
+    生成速度测试, 不需要 redis
+
+        python -m lk_utils.tools.snowflake --total 1000000 --threads 1 32 --batch 1 100
+
+    Returns: [(线程数, 批量大小, 每秒生成数量)]
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    batches = batch if isinstance(batch, (list, tuple)) else [batch]
+    results = []
+    for thread_num in threads:
+        for size in batches:
+            worker = IdWorker()
+            per_thread = total // thread_num // size
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=thread_num) as executor:
+                futures = [
+                    executor.submit(_benchmark_run, worker, size, per_thread) for _ in range(thread_num)
+                ]
+                ids = [new_id for future in futures for new_id in future.result()]
+            elapsed = time.perf_counter() - started
+            if len(set(ids)) != len(ids):
+                raise AssertionError("duplicate ids generated")
+            results.append((thread_num, size, int(len(ids) / elapsed)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="snowflake id 生成速度测试")
+    parser.add_argument("--total", type=int, default=1000000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 100])
+    args = parser.parse_args(argv)
+
+    for thread_num, size, rate in benchmark(args.total, args.threads, args.batch):
+        print("threads: %3d  batch: %5d  ids/s: %d" % (thread_num, size, rate))
+
+
+if __name__ == "__main__":
+    main()
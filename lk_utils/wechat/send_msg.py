@@ -9,6 +9,7 @@ from requests.exceptions import RequestException
 
 from lk_utils.register import config
 from lk_utils.log.base import error, warning
+from lk_utils.redisx import tracking
 from lk_utils.wechat import wechat_client
 
 
@@ -56,7 +57,8 @@ def get_access_token(lk_app_id, app_id, force_reload=False, token_type="access_t
     elif token_type == "raw_access_token":
         cache_key = f"wechat.get_access_token?ym_app_id={lk_app_id}"
 
-    access_token = wechat_client.get(cache_key)
+    # 开启客户端缓存(tracking.enable_tracking("wechat"))后, 命中时不访问 Redis
+    access_token = tracking.get(cache_key, "wechat")
     if access_token and force_reload is False:
         if isinstance(access_token, bytes):
             access_token = json.loads(access_token.decode("utf8"))
@@ -0,0 +1,62 @@
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+from lk_utils.register import ConfigKeys  # noqa: E402
+from lk_utils.register import config  # noqa: E402
+
+# redisx 在导入时创建 default 连接, 需要先设置配置
+setattr(config, ConfigKeys.Redis, {'default': {'host': 'localhost', 'port': 6379, 'db': 0}})
+
+import lk_utils.redisx as redisx  # noqa: E402
+import lk_utils.redisx.aio as redisx_aio  # noqa: E402
+from sqlalchemy import Column, Integer, String, create_engine  # noqa: E402
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+
+Base = declarative_base()
+engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+Session = scoped_session(sessionmaker(bind=engine))
+Base.query = Session.query_property()
+
+
+class User(Base):
+    __tablename__ = 'user'
+    db_name = 'test'
+    table_name = 'user'
+
+    id = Column(Integer, primary_key=True)
+    hash_id = Column(String(32))
+    name = Column(String(32))
+    deleted = Column(Integer, default=0)
+
+
+@pytest.fixture(autouse=True)
+def redis_server(monkeypatch):
+    """每个测试使用独立的 fakeredis 服务, 同步与异步连接共享数据"""
+    server = fakeredis.FakeServer()
+
+    class FakeRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            super().__init__(server=server, db=kwargs.get('db', 0))
+
+    class FakeAsyncRedis(fakeredis.FakeAsyncRedis):
+        def __init__(self, *args, **kwargs):
+            super().__init__(server=server, db=kwargs.get('db', 0))
+
+    monkeypatch.setattr(redisx, 'Redis', FakeRedis)
+    monkeypatch.setattr(redisx, 'client', FakeRedis())
+    monkeypatch.setattr(redisx_aio, 'Redis', FakeAsyncRedis)
+    return server
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(engine)
+    Session.add_all([User(id=i, hash_id='h%d' % i, name='n%d' % i, deleted=0) for i in range(1, 4)])
+    Session.commit()
+    yield Session
+    Session.remove()
+    Base.metadata.drop_all(engine)
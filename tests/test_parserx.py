@@ -0,0 +1,68 @@
+import pytest
+
+from lk_utils.tools.parserx import parser_redis_url
+
+
+def parse(url):
+    return parser_redis_url({'default': url})['default']
+
+
+@pytest.mark.parametrize('password', ['pa/ss#w', 'p?w', 'a@b:c', 'plain'])
+def test_password_with_url_delimiters(password):
+    params = parse(f'redis://:{password}@127.0.0.1:6379/2')
+
+    assert params['password'] == password
+    assert params['host'] == '127.0.0.1'
+    assert params['port'] == 6379
+    assert params['db'] == 2
+
+
+def test_username_and_options():
+    params = parse('redis://user:p/w@localhost/1?max_connections=10&socket_keepalive=true')
+
+    assert params['username'] == 'user'
+    assert params['password'] == 'p/w'
+    assert params['db'] == 1
+    assert params['port'] == 6379
+    assert params['max_connections'] == 10
+    assert params['socket_keepalive'] is True
+
+
+def test_no_password():
+    params = parse('redis://127.0.0.1:6380/0')
+
+    assert params['password'] is None
+    assert params['port'] == 6380
+
+
+def test_ssl_options_only_for_rediss():
+    query = '?ssl_cert_reqs=none&ssl_ca_certs=/etc/ca.pem'
+
+    params = parse('redis://:pwd@127.0.0.1:6379/0' + query)
+    assert 'ssl_cert_reqs' not in params
+    assert 'ssl_ca_certs' not in params
+
+    params = parse('rediss://:pwd@127.0.0.1:6379/0' + query)
+    assert params['ssl'] is True
+    assert params['ssl_cert_reqs'] == 'none'
+    assert params['ssl_ca_certs'] == '/etc/ca.pem'
+
+
+def test_cluster_and_sentinel_hosts():
+    params = parse('redis+cluster://:p#w@10.0.0.1:7000,10.0.0.2:7001')
+    assert params['password'] == 'p#w'
+    assert params['startup_nodes'] == [('10.0.0.1', 7000), ('10.0.0.2', 7001)]
+
+    params = parse('redis+sentinel://:p/w@10.0.0.1,10.0.0.2:26380/mymaster/3')
+    assert params['password'] == 'p/w'
+    assert params['sentinels'] == [('10.0.0.1', 26379), ('10.0.0.2', 26380)]
+    assert params['service_name'] == 'mymaster'
+    assert params['db'] == 3
+
+
+def test_unix_socket():
+    params = parse('unix://:pwd@/tmp/redis.sock?db=4')
+
+    assert params['unix_socket_path'] == '/tmp/redis.sock'
+    assert params['db'] == 4
+    assert params['password'] == 'pwd'
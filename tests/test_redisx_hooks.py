@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import Column, Integer, String, text
+
+from conftest import Base, User
+from lk_utils.redisx import operations
+from lk_utils.sqlalchemyx import redisx as sa_redisx
+
+
+class Counter(Base):
+    __tablename__ = 'counter'
+    db_name = 'test'
+    table_name = 'counter'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(32))
+    deleted = Column(Integer, default=0)
+    version = Column(Integer, server_default=text('1'), onupdate=text('version + 1'))
+
+
+@pytest.fixture
+def user_hooks(db):
+    sa_redisx.enable_cache_hooks(User, item_keys=[('id',), ('hash_id',)])
+    yield db
+    sa_redisx.disable_cache_hooks(User)
+
+
+def cached(model, filter_dict):
+    return operations.get_item(model, filter_dict, query_func=lambda m, f: None)
+
+
+def test_changed_field_evicts_previous_key(user_hooks):
+    db = user_hooks
+    operations.get_item(User, {'hash_id': 'h1'}, query_func=lambda m, f: m.query.filter_by(**f).first())
+    assert cached(User, {'hash_id': 'h1'}).id == 1
+
+    user = db.query(User).get(1)
+    user.hash_id = 'h9'
+    db.commit()
+    assert cached(User, {'hash_id': 'h1'}) is None
+
+
+def test_write_through_reloads_generated_columns(db):
+    sa_redisx.enable_cache_hooks(Counter, write_through=True)
+    try:
+        counter = Counter(id=1, name='a')
+        db.add(counter)
+        db.commit()
+        assert cached(Counter, {'id': 1}).version == 1
+
+        counter.name = 'b'
+        db.commit()
+        item = cached(Counter, {'id': 1})
+        assert (item.name, item.version) == ('b', 2)
+    finally:
+        sa_redisx.disable_cache_hooks(Counter)
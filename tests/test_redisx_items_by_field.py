@@ -0,0 +1,51 @@
+import asyncio
+
+from conftest import User
+from lk_utils.redisx import operations
+from lk_utils.redisx.aio import operations as aio_operations
+from lk_utils.sqlalchemyx import redisx as sa_redisx
+
+
+def query_item(model, filter_dict):
+    return model.query.filter_by(deleted=0, **filter_dict).first()
+
+
+def test_get_item_follows_pointer_with_stampede_protection(db):
+    items = sa_redisx.get_items_by_field(User, 'hash_id', ['h1', 'h2'])
+    assert {value: item.id for value, item in items.items()} == {'h1': 1, 'h2': 2}
+
+    for kwargs in ({'single_flight': True}, {'early_refresh': True}, {}):
+        item = operations.get_item(User, {'hash_id': 'h1'}, query_func=query_item, **kwargs)
+        assert item.id == 1
+
+
+def test_stale_pointer_is_rebuilt(db):
+    sa_redisx.get_items_by_field(User, 'hash_id', ['h1'])
+    user = db.query(User).get(1)
+    user.hash_id = 'h9'
+    db.commit()
+    operations.delete_item_cache(User, {'id': 1})
+
+    item = operations.get_item(User, {'hash_id': 'h1'}, query_func=query_item, single_flight=True)
+    assert item is None
+    item = operations.get_item(User, {'hash_id': 'h9'}, query_func=query_item, single_flight=True)
+    assert item.id == 1
+
+
+def test_aio_get_item_follows_pointer(db):
+    sa_redisx.get_items_by_field(User, 'hash_id', ['h2'])
+
+    async def main():
+        item = await aio_operations.get_item(User, {'hash_id': 'h2'})
+        items = await aio_operations.get_items_by_ids(User, [2])
+        return item, items
+
+    item, items = asyncio.run(main())
+    assert item.id == 2
+    assert items[2].hash_id == 'h2'
+
+
+def test_get_items_by_field_reads_objects_from_get_item(db):
+    operations.get_item(User, {'hash_id': 'h3'}, query_func=query_item)
+    items = sa_redisx.get_items_by_field(User, 'hash_id', ['h3'])
+    assert items['h3'].id == 3
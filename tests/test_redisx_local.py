@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import lk_utils.redisx as redisx
+from conftest import User
+from lk_utils.redisx import local
+from lk_utils.redisx import operations
+from lk_utils.redisx.aio import operations as aio_operations
+
+
+def query_by_ids(model, ids):
+    return model.query.filter(model.id.in_(ids)).all()
+
+
+def query_item(model, filter_dict):
+    return model.query.filter_by(**filter_dict).first()
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def local_cache(monkeypatch):
+    monkeypatch.setattr(local, 'RECONNECT_INTERVAL', 0.05)
+    monkeypatch.setattr(local, 'POLL_TIMEOUT', 0.05)
+    cache = local.enable_local_cache(ttl=30)
+    listener = local._listeners['default']
+    assert wait_until(lambda: local.get_local_cache() is cache and listener.is_alive())
+    # 订阅生效后 probe 才会被删除
+    cache.set('probe', 1)
+    channel = local.INVALIDATE_CHANNEL % 'default'
+    assert wait_until(lambda: (redisx.client.publish(channel, 'probe'), cache.get('probe') is None)[1])
+    yield cache
+    local.disable_local_cache()
+    local._publish_names.discard('default')
+    listener.join(5)
+
+
+def subscribe():
+    pubsub = redisx.client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(local.INVALIDATE_CHANNEL % 'default')
+    return pubsub
+
+
+def published(pubsub, count=3):
+    messages = [pubsub.get_message(timeout=0.1) for _ in range(count)]
+    return [message['data'] for message in messages if message]
+
+
+def test_writer_without_local_cache_publishes_by_default(monkeypatch):
+    monkeypatch.setattr(local, '_publish_names', set())
+    pubsub = subscribe()
+
+    local.invalidate('a')
+    local.invalidate_many(['b', 'c'])
+    assert published(pubsub, 4) == [b'a', b'b', b'c']
+
+
+def test_enable_invalidation_when_publish_is_off(monkeypatch):
+    monkeypatch.setattr(local, 'PUBLISH_INVALIDATION', False)
+    monkeypatch.setattr(local, '_publish_names', set())
+    pubsub = subscribe()
+
+    local.invalidate('a')
+    local.enable_invalidation()
+    local.invalidate('b')
+    assert published(pubsub) == [b'b']
+
+
+def test_force_reload_invalidates_other_processes(db):
+    pubsub = subscribe()
+    operations.get_items_by_ids(User, [1, 2], query_func=query_by_ids)
+    assert published(pubsub) == []
+
+    operations.get_items_by_ids(User, [1, 2], force_reload=True, query_func=query_by_ids)
+    key_prefix = operations.gen_item_cache_key(User, None)
+    assert published(pubsub) == [('%s?id=%s' % (key_prefix, pk)).encode() for pk in (1, 2)]
+
+    operations.get_item(User, {'id': 3}, force_reload=True, query_func=query_item)
+    assert published(pubsub) == [operations.gen_item_cache_key(User, {'id': 3}).encode()]
+
+
+def test_aio_force_reload_invalidates_other_processes(db):
+    pubsub = subscribe()
+
+    async def reload():
+        await aio_operations.get_items_by_ids(User, [1], force_reload=True, query_func=query_by_ids)
+        await aio_operations.get_item(User, {'id': 3}, force_reload=True, query_func=query_item)
+
+    asyncio.run(reload())
+    key_prefix = operations.gen_item_cache_key(User, None)
+    assert published(pubsub) == [
+        ('%s?id=1' % key_prefix).encode(), operations.gen_item_cache_key(User, {'id': 3}).encode(),
+    ]
+
+
+def test_listener_deletes_published_keys(local_cache):
+    local_cache.set('a', 1)
+    local_cache.set('b', 2)
+    assert wait_until(lambda: (local.invalidate('a', publish=True), local_cache.get('a') is None)[1])
+    assert local_cache.get('b') == 2
+
+
+def test_listener_clears_cache_after_reconnect(local_cache, redis_server, monkeypatch):
+    failed = threading.Event()
+    logger_exception = local.logger.exception
+
+    def exception(*args, **kwargs):
+        failed.set()
+        logger_exception(*args, **kwargs)
+
+    monkeypatch.setattr(local.logger, 'exception', exception)
+    local_cache.set('a', 1)
+    redis_server.connected = False
+    assert failed.wait(5)
+    redis_server.connected = True
+    assert wait_until(lambda: len(local_cache) == 0)
@@ -0,0 +1,47 @@
+import lk_utils.redisx as redisx
+from lk_utils.redisx.lock import Lock
+
+
+def test_fair_lock_without_timeout_does_not_expire():
+    lock = Lock('fair', timeout=None, fair=True, blocking=True)
+    assert lock.acquire(blocking_timeout=1)
+    assert redisx.client.pttl(lock.name) == -1
+    lock.release()
+
+
+def test_fair_lock_keys_share_a_hash_slot():
+    lock = Lock('fair', fair=True)
+    assert (lock.name, lock.queue_name, lock.alive_name) == ('{fair}', '{fair}:queue', '{fair}:alive')
+    assert Lock('{order}:fair', fair=True).name == '{order}:fair'
+    assert Lock('plain').name == 'plain'
+
+
+def queue_waiter(lock, token, alive_ms):
+    seconds, microseconds = redisx.client.time()
+    now = seconds * 1000 + microseconds // 1000
+    redisx.client.zadd(lock.queue_name, {token: now})
+    redisx.client.hset(lock.alive_name, token, now + alive_ms)
+
+
+def test_fair_non_blocking_acquire_respects_queue():
+    lock = Lock('fair', fair=True)
+    queue_waiter(lock, 'waiter', 60000)
+
+    assert not lock.acquire(blocking=False)
+    assert not redisx.client.exists(lock.name)
+    # 非阻塞获取不入队
+    assert redisx.client.zrange(lock.queue_name, 0, -1) == [b'waiter']
+
+    redisx.client.zrem(lock.queue_name, 'waiter')
+    assert lock.acquire(blocking=False)
+    lock.release()
+
+
+def test_fair_non_blocking_acquire_skips_stale_waiters():
+    lock = Lock('fair', fair=True)
+    queue_waiter(lock, 'gone', -1000)
+
+    assert lock.acquire(blocking=False)
+    assert redisx.client.zcard(lock.queue_name) == 0
+    assert not Lock('fair', fair=True).acquire(blocking=False)
+    lock.release()
@@ -0,0 +1,54 @@
+import pytest
+
+from lk_utils.redisx.memoize import cached
+
+
+class Shop(object):
+    calls = 0
+
+    def __init__(self, id):
+        self.id = id
+
+    @cached(60)
+    def name(self, lang='zh'):
+        Shop.calls += 1
+        return f'{lang}-{self.id}'
+
+    @classmethod
+    @cached(60)
+    def kind(cls):
+        return cls.__name__
+
+
+class Branch(Shop):
+    pass
+
+
+class Anonymous(object):
+
+    @cached(60)
+    def name(self):
+        return 'anonymous'
+
+    @cached(60, key_func=lambda self: 'singleton')
+    def title(self):
+        return 'title'
+
+
+def test_method_cache_key_includes_instance_id():
+    assert Shop(1).name() == 'zh-1'
+    assert Shop(2).name() == 'zh-2'
+    calls = Shop.calls
+    assert Shop(1).name() == 'zh-1'
+    assert Shop.calls == calls
+
+
+def test_classmethod_cache_key_includes_class():
+    assert Shop.kind() == 'Shop'
+    assert Branch.kind() == 'Branch'
+
+
+def test_method_without_identity():
+    with pytest.raises(TypeError):
+        Anonymous().name()
+    assert Anonymous().title() == 'title'
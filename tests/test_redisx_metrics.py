@@ -0,0 +1,158 @@
+import socket
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from conftest import User
+from lk_utils.redisx import metrics
+from lk_utils.redisx import operations
+from lk_utils.redisx.memoize import cached
+
+
+LABELS = (('cache', 'default'), ('model', 'User'))
+
+
+class Recorder(metrics.Exporter):
+
+    def __init__(self):
+        self.counters = []
+        self.timings = []
+
+    def incr(self, name, labels, amount):
+        self.counters.append((name, labels, amount))
+
+    def timing(self, name, labels, seconds):
+        self.timings.append((name, labels))
+
+
+@pytest.fixture
+def recorder():
+    recorder = Recorder()
+    metrics.reset()
+    metrics.enable(recorder)
+    yield recorder
+    metrics.disable()
+    metrics.reset()
+
+
+def query_item(model, filter_dict):
+    return model.query.filter_by(**filter_dict).first()
+
+
+def query_by_ids(model, ids):
+    return model.query.filter(model.id.in_(ids)).all()
+
+
+def counter(name, labels=LABELS):
+    return metrics.snapshot()[0].get((name, labels), 0)
+
+
+def histogram(name, op, labels=LABELS):
+    return metrics.snapshot()[1][(name, labels + (('op', op),))]
+
+
+def test_disabled_costs_nothing():
+    assert metrics.start() is None
+    with metrics.timer('redis_seconds', 'default', User, 'get') as timer:
+        pass
+    assert timer is metrics._null_timer
+    metrics.incr('hits', 'default', User)
+    assert metrics.snapshot() == ({}, {})
+
+
+def test_get_set_cycle(db, recorder):
+    assert operations.get_item(User, {'id': 1}, query_func=query_item).name == 'n1'
+    assert operations.get_item(User, {'id': 1}, query_func=query_item).name == 'n1'
+    items = operations.get_items_by_ids(User, [1, 2, 3], query_func=query_by_ids)
+    assert sorted(items) == [1, 2, 3]
+
+    # get_item: 1 次未命中、1 次命中; get_items_by_ids: id=1 命中, 其余未命中
+    assert counter('hits') == 2
+    assert counter('misses') == 3
+    assert counter('db_fallbacks') == 2
+    assert counter('bytes_serialized') > 0
+    assert counter('errors') == 0
+    assert histogram('redis_seconds', 'get').count == 2
+    assert histogram('redis_seconds', 'mget').count == 1
+    assert histogram('query_seconds', 'query').count == 2
+
+    assert ('hits', LABELS, 1) in recorder.counters
+    assert ('misses', LABELS, 2) in recorder.counters
+    assert recorder.timings.count(('redis_seconds', LABELS + (('op', 'get'),))) == 2
+
+
+def test_errors(db, recorder, redis_server):
+    def broken_query(model, filter_dict):
+        raise RuntimeError('db is down')
+
+    with pytest.raises(RuntimeError):
+        operations.get_item(User, {'id': 1}, query_func=broken_query)
+    assert counter('errors') == 1
+    assert histogram('query_seconds', 'query').count == 1
+
+    redis_server.connected = False
+    with pytest.raises(ConnectionError):
+        operations.get_item(User, {'id': 1}, query_func=query_item)
+    assert counter('errors') == 2
+    assert histogram('redis_seconds', 'get').count == 2
+
+
+def test_cached_counts(recorder):
+    @cached(60)
+    def double(value):
+        return value * 2
+
+    assert double(2) == 4
+    assert double(2) == 4
+    labels = (('cache', 'default'), ('model', 'double'))
+    assert counter('hits', labels) == 1
+    assert counter('misses', labels) == 1
+    assert counter('db_fallbacks', labels) == 1
+    assert histogram('query_seconds', 'call', labels).count == 1
+
+
+def test_prometheus_render(db, recorder):
+    exporter = metrics.PrometheusExporter()
+    operations.get_item(User, {'id': 1}, query_func=query_item)
+    operations.get_item(User, {'id': 1}, query_func=query_item)
+
+    lines = exporter.render().splitlines()
+    assert '# TYPE redisx_hits_total counter' in lines
+    assert 'redisx_hits_total{cache="default",model="User"} 1' in lines
+    assert 'redisx_misses_total{cache="default",model="User"} 1' in lines
+    assert '# TYPE redisx_redis_seconds histogram' in lines
+    assert 'redisx_redis_seconds_count{cache="default",model="User",op="get"} 2' in lines
+    assert 'redisx_redis_seconds_bucket{cache="default",model="User",op="get",le="+Inf"} 2' in lines
+
+
+def test_statsd_exporter(db, recorder):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(0.2)
+        metrics.enable(metrics.StatsdExporter(*server.getsockname()))
+        operations.get_item(User, {'id': 1}, query_func=query_item)
+        operations.get_item(User, {'id': 1}, query_func=query_item)
+
+        packets = []
+        while True:
+            try:
+                packets.append(server.recv(1024).decode())
+            except socket.timeout:
+                break
+
+    assert 'redisx.hits:1|c|#cache:default,model:User' in packets
+    assert 'redisx.misses:1|c|#cache:default,model:User' in packets
+    assert any(packet.startswith('redisx.redis_seconds:') and packet.endswith('|ms|#cache:default,model:User,op:get')
+               for packet in packets)
+
+
+def test_log_exporter(db, recorder, monkeypatch):
+    lines = []
+    monkeypatch.setattr(metrics, 'info', lambda logger_name, msg, *args: lines.append(msg % args))
+    metrics.enable(metrics.LogExporter())
+    operations.get_item(User, {'id': 1}, query_func=query_item)
+    metrics.flush()
+
+    assert '[metrics] misses{cache="default",model="User"} 1' in lines
+    assert any(line.startswith('[metrics] redis_seconds{cache="default",model="User",op="get"} count=1 avg=')
+               for line in lines)
@@ -0,0 +1,119 @@
+import asyncio
+import base64
+
+import pytest
+
+from conftest import User
+from lk_utils.redisx import hooks
+from lk_utils.redisx import operations
+from lk_utils.redisx.aio import operations as aio_operations
+
+
+def test_all_item_cache_accepts_sets(db):
+    users = {user.id: user for user in db.query(User).all()}
+    operations.set_all_item_cache(User)
+    assert operations.rem_all_item_cache({users[1], users[2]})
+    assert operations.get_item_ids(User) == [3]
+    assert operations.add_all_item_cache({users[1]})
+    assert operations.get_item_ids(User) == [3, 1]
+    assert not operations.clear_negative_caches({users[1], users[2]})
+
+
+def test_aio_all_item_cache_accepts_sets(db):
+    users = {user.id: user for user in db.query(User).all()}
+    operations.set_all_item_cache(User)
+
+    async def main():
+        await aio_operations.rem_all_item_cache({users[1], users[2]})
+        await aio_operations.add_all_item_cache({users[2]})
+        await aio_operations.clear_negative_caches({users[1]})
+        return await aio_operations.get_item_ids(User)
+
+    assert asyncio.run(main()) == [3, 2]
+
+
+def test_cursor_uses_last_member_as_tie_breaker(db):
+    def order_func(user):
+        return 1
+
+    def page(cursor):
+        return operations.get_items_by_cursor(User, cursor, page_size=1, value='id', order_func=order_func,
+                                              query_func=lambda m, ids: m.query.filter(m.id.in_(ids)).all())
+
+    items, cursor = page(None)
+    assert [item.id for item in items] == [3]
+    # 同分数、排在已读数据之前插入的成员不影响下一页
+    db.add(User(id=4, hash_id='h4', name='n4', deleted=0))
+    db.commit()
+    operations.add_all_item_cache(db.query(User).get(4), order_func=order_func)
+
+    seen = [3]
+    while cursor:
+        items, cursor = page(cursor)
+        seen.extend(item.id for item in items)
+    assert seen == [3, 2, 1]
+
+
+def test_aio_cursor_pages(db):
+    operations.set_all_item_cache(User)
+
+    async def main():
+        seen, cursor = [], None
+        while True:
+            items, cursor = await aio_operations.get_items_by_cursor(
+                User, cursor, page_size=2, query_func=lambda m, ids: m.query.filter(m.id.in_(ids)).all())
+            seen.extend(item.id for item in items)
+            if not cursor:
+                return seen
+
+    assert asyncio.run(main()) == [3, 2, 1]
+
+
+def test_clear_negative_caches_covers_field_keys(db):
+    def query_item(model, filter_dict):
+        return model.query.filter_by(**filter_dict).first()
+
+    assert operations.get_item(User, {'hash_id': 'h4'}, query_func=query_item, negative_ttl=60) is None
+    assert operations.get_item(User, {'id': 4}, query_func=query_item, negative_ttl=60) is None
+    user = User(id=4, hash_id='h4', name='n4', deleted=0)
+    db.add(user)
+    db.commit()
+
+    assert operations.clear_negative_cache(user, item_keys=[('hash_id',)])
+    assert operations.get_item(User, {'hash_id': 'h4'}, query_func=query_item).id == 4
+    assert operations.get_item(User, {'id': 4}, query_func=query_item).id == 4
+
+
+def test_aio_clear_negative_caches_uses_registered_item_keys(db):
+    def query_item(model, filter_dict):
+        return model.query.filter_by(**filter_dict).first()
+
+    hooks.register(User, item_keys=[('id',), ('hash_id',)])
+    try:
+        assert operations.get_item(User, {'hash_id': 'h4'}, query_func=query_item, negative_ttl=60) is None
+        user = User(id=4, hash_id='h4', name='n4', deleted=0)
+        assert asyncio.run(aio_operations.clear_negative_caches({user}))
+        assert not asyncio.run(aio_operations.clear_negative_caches([user]))
+    finally:
+        hooks.unregister(User)
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', base64.urlsafe_b64encode(b'\xff:0:1').decode()])
+def test_invalid_cursor_keeps_the_cause(cursor):
+    with pytest.raises(ValueError, match='invalid cursor') as exc_info:
+        operations.decode_cursor(cursor)
+    assert isinstance(exc_info.value.__cause__, ValueError)
+
+
+def test_item_key_template_is_cached_per_filter_shape(monkeypatch):
+    monkeypatch.setattr(operations, '_item_key_templates', {})
+    monkeypatch.setattr(operations, '_filter_key_templates', {})
+    prefix = '.'.join(operations.get_model_key_parts(User))
+
+    assert operations.build_item_cache_key(User, {'name': 'a{b}', 'id': [3, 1, 3]}) == prefix + '?id=1,3&name=a{b}'
+    assert operations.build_item_cache_key(User, {'id': [2], 'name': 'c'}, 'v2:') == 'v2:' + prefix + '?id=2&name=c'
+    assert operations.build_item_cache_key(User, {'id': 1}) == prefix + '?id=1'
+    assert operations.build_item_cache_key(User, {'id': lambda: 1}) == prefix + '?func(id)'
+    # 字段顺序不同的相同组合各缓存一次, 值类型不同时使用新的模板
+    assert len(operations._item_key_templates) == 4
+    assert operations.gen_filter_cache_str({'b': 2, 'a': [3, 1]}) == 'a=1,3&b=2'
@@ -0,0 +1,21 @@
+import gc
+import weakref
+
+import fakeredis
+
+from lk_utils.redisx.ratelimit import TokenBucketLimiter
+
+
+def test_scripts_are_released_with_their_client(redis_server):
+    limiter = TokenBucketLimiter('sms', rate=10)
+    assert limiter.acquire()
+
+    client = fakeredis.FakeRedis(server=redis_server)
+    script = limiter._script(client)
+    assert limiter._script(client) is script
+    assert TokenBucketLimiter('push', rate=10)._script(client) is script
+
+    ref = weakref.ref(client)
+    del client, script
+    gc.collect()
+    assert ref() is None
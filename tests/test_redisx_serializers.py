@@ -0,0 +1,44 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import Column, Date, DateTime, Integer, Numeric, String
+
+from conftest import Base
+from lk_utils.redisx import serializers
+
+
+class Order(Base):
+    __tablename__ = 'order'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(32))
+    amount = Column(Numeric(10, 2))
+    created_at = Column(DateTime)
+    day = Column(Date)
+
+
+@pytest.mark.parametrize('codec', ['orjson', 'msgpack'])
+def test_row_columns_keep_their_types(codec):
+    pytest.importorskip(codec)
+    order = Order(id=1, name='2020-01-01', amount=Decimal('9.90'),
+                  created_at=datetime.datetime(2020, 1, 2, 3, 4, 5, 6), day=datetime.date(2020, 1, 2))
+    data = serializers.Serializer(codec).dumps(order)
+    item = serializers.loads(data, Order)
+
+    assert item.amount == Decimal('9.90')
+    assert item.created_at == order.created_at
+    assert item.day == order.day
+    assert item.name == '2020-01-01'
+
+
+@pytest.mark.parametrize('value', [
+    {1: 'a', 2: 'b'},
+    (1, 'a', (2, 3)),
+    {'ids': (1, 2), (1, 2): [3, (4,)]},
+])
+def test_msgpack_round_trip(value):
+    pytest.importorskip('msgpack')
+    data = serializers.Serializer('msgpack').dumps(value)
+    assert serializers.loads(data) == value
+    assert type(serializers.loads(data)) is type(value)
@@ -0,0 +1,22 @@
+import lk_utils.redisx as redisx
+from lk_utils.redisx import stampede
+
+
+def test_empty_rebuild_clears_cache_and_stale():
+    client = redisx.client
+    key = 'test:stampede'
+    assert stampede.fetch(client, key, lambda: {'a': 1}, 60, single_flight=True) == {'a': 1}
+    assert client.exists(key, key + stampede.STALE_SUFFIX) == 2
+
+    assert stampede.fetch(client, key, lambda: None, 60, single_flight=True, force_reload=True) is None
+    assert client.exists(key, key + stampede.STALE_SUFFIX) == 0
+
+
+def test_empty_early_refresh_does_not_return_old_value(monkeypatch):
+    client = redisx.client
+    key = 'test:stampede'
+    stampede.fetch(client, key, lambda: {'a': 1}, 60, early_refresh=True)
+    monkeypatch.setattr(stampede, '_should_refresh', lambda *args: True)
+
+    assert stampede.fetch(client, key, lambda: None, 60, early_refresh=True) is None
+    assert not client.exists(key)
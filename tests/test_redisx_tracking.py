@@ -0,0 +1,224 @@
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+import redis
+from redis.exceptions import ConnectionError
+
+import lk_utils.redisx as redisx
+from lk_utils.redisx import tracking
+from lk_utils.register import ConfigKeys
+from lk_utils.register import config
+
+
+class TrackingServer(object):
+    """
+    模拟服务端的 CLIENT TRACKING REDIRECT, fakeredis 不支持该命令; 数据保存在 fakeredis 中
+    """
+
+    def __init__(self):
+        self.next_id = 0
+        self.listeners = {}
+        self.tracked = {}
+        self.reads = 0
+
+    def connect(self):
+        return Connection(self)
+
+    def set(self, key, value):
+        redisx.client.set(key, value)
+        for client_id in self.tracked.pop(key, set()):
+            listener = self.listeners.get(client_id)
+            if listener is not None:
+                listener.messages.put([b'message', tracking.INVALIDATE_CHANNEL.encode(), [key.encode()]])
+
+    def drop_listeners(self):
+        for listener in self.listeners.values():
+            listener.broken = True
+        self.listeners.clear()
+
+
+class Connection(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.messages = queue.Queue()
+        self.broken = False
+        self.redirect = None
+        self.reply = None
+
+    def send_command(self, *args):
+        command = ' '.join(str(arg) for arg in args[:2]).upper()
+        if command == 'CLIENT ID':
+            self.server.next_id += 1
+            self.reply = self.server.next_id
+        elif command.startswith('SUBSCRIBE'):
+            self.server.listeners[self.server.next_id] = self
+            self.reply = [b'subscribe', args[1].encode(), 1]
+        elif command == 'CLIENT TRACKING':
+            self.redirect = args[-1]
+            self.reply = b'OK'
+        elif args[0] == 'GET':
+            self.server.reads += 1
+            self.server.tracked.setdefault(args[1], set()).add(self.redirect)
+            self.reply = redisx.client.get(args[1])
+
+    def read_response(self):
+        if self.broken:
+            raise ConnectionError('connection lost')
+        if self.reply is not None:
+            reply, self.reply = self.reply, None
+            return reply
+        return self.messages.get_nowait()
+
+    def can_read(self, timeout=0):
+        if self.broken:
+            raise ConnectionError('connection lost')
+        try:
+            self.reply = self.messages.get(timeout=min(timeout, 0.05))
+        except queue.Empty:
+            return False
+        return True
+
+    def disconnect(self):
+        self.broken = True
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = TrackingServer()
+    monkeypatch.setattr(tracking.TrackingCache, '_new_connection', lambda self: server.connect())
+    tracker = tracking.TrackingCache(reconnect_interval=0.01).start()
+    assert tracker.stats()['ready']
+    yield server, tracker
+    tracker.stop()
+
+
+def test_write_invalidates_local_copy(server):
+    server, tracker = server
+    server.set('config', b'1')
+    assert tracker.get('config') == b'1'
+    assert tracker.get('config') == b'1'
+    assert server.reads == 1
+
+    server.set('config', b'2')
+    assert wait_until(lambda: tracker.stats()['size'] == 0)
+    assert tracker.get('config') == b'2'
+    assert server.reads == 2
+
+
+def test_redirect_connection_drop_flushes_cache(server):
+    server, tracker = server
+    server.set('a', b'1')
+    server.set('b', b'2')
+    tracker.get('a')
+    tracker.get('b')
+    assert tracker.stats()['size'] == 2
+
+    server.drop_listeners()
+    assert wait_until(lambda: tracker.stats()['size'] == 0)
+    # 重新建立 tracking 后继续缓存, 断线期间的修改不会读到旧值
+    redisx.client.set('a', b'3')
+    assert wait_until(lambda: tracker.stats()['ready'])
+    assert tracker.get('a') == b'3'
+    assert tracker.get('a') == b'3'
+    assert server.reads == 3
+
+
+@pytest.fixture
+def redis_server_port():
+    """
+    启动本地 redis-server, 未安装时跳过; 可以通过 REDIS_SERVER 指定可执行文件路径
+    """
+    executable = os.environ.get('REDIS_SERVER') or shutil.which('redis-server')
+    if not executable:
+        pytest.skip('redis-server is not available')
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [executable, '--port', str(port), '--bind', '127.0.0.1', '--save', '', '--appendonly', 'no'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    client = redis.Redis(port=port)
+    try:
+        if not wait_until(lambda: _ping(client)):
+            pytest.skip('redis-server did not start')
+        yield port
+    finally:
+        client.close()
+        process.terminate()
+        process.wait()
+
+
+def _ping(client):
+    try:
+        return client.ping()
+    except redis.ConnectionError:
+        return False
+
+
+@pytest.fixture
+def real_tracker(redis_server_port, monkeypatch):
+    alias = 'tracking_server'
+    monkeypatch.setattr(redisx, 'Redis', redis.Redis)
+    monkeypatch.setitem(getattr(config, ConfigKeys.Redis), alias,
+                        {'host': '127.0.0.1', 'port': redis_server_port, 'db': 0})
+    tracker = tracking.enable_tracking(alias)
+    client = redis.Redis(port=redis_server_port)
+    try:
+        assert tracker.stats()['ready']
+        yield client, tracker
+    finally:
+        tracking.disable_tracking(alias)
+        client.close()
+        pool = redisx._pools.pop(alias, None)
+        if pool is not None:
+            pool.disconnect()
+
+
+def test_real_server_invalidation(real_tracker):
+    client, tracker = real_tracker
+    client.set('config', '1')
+    assert tracking.get('config', 'tracking_server') == b'1'
+    assert tracking.get('config', 'tracking_server') == b'1'
+    assert tracker.stats()['hits'] == 1
+
+    client.set('config', '2')
+    assert wait_until(lambda: tracker.stats()['size'] == 0)
+    assert tracker.get('config') == b'2'
+
+    # FLUSHALL 的通知不带 key, 全部失效
+    client.flushall()
+    assert wait_until(lambda: tracker.stats()['size'] == 0)
+    assert tracker.get('config') is None
+
+
+def test_real_server_listener_killed(real_tracker):
+    client, tracker = real_tracker
+    client.set('config', '1')
+    assert tracker.get('config') == b'1'
+    assert tracker.stats()['size'] == 1
+
+    client.client_kill_filter(_type='pubsub')
+    assert wait_until(lambda: tracker.stats()['size'] == 0)
+    client.set('config', '2')
+    assert wait_until(lambda: tracker.stats()['ready'])
+    assert tracker.get('config') == b'2'
+    assert tracker.get('config') == b'2'
+    client.set('config', '3')
+    assert wait_until(lambda: tracker.get('config') == b'3')
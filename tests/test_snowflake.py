@@ -0,0 +1,147 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+from lk_utils.tools import snowflake
+
+
+@pytest.fixture
+def release_lease():
+    yield
+    if snowflake.id_worker is not None and snowflake.id_worker.lease is not None:
+        snowflake.id_worker.lease.release()
+    snowflake.id_worker = None
+
+
+def test_legacy_positional_call_takes_a_lease(release_lease):
+    worker = snowflake.init_snowflake(0)
+    assert worker.lease is not None
+    assert snowflake.generate_id() > 0
+
+
+def test_explicit_ids_need_both(release_lease):
+    worker = snowflake.init_snowflake(3, 4)
+    assert (worker.worker_id, worker.data_center_id, worker.lease) == (3, 4, None)
+    assert snowflake.init_snowflake(worker_id=3).lease is not None
+
+
+def test_get_center_id_shim(release_lease):
+    with pytest.deprecated_call():
+        center_id = snowflake.get_center_id()
+    assert center_id == snowflake.id_worker.data_center_id
+
+
+def test_decode_id_and_decode_ids_use_utc():
+    worker = snowflake.IdWorker(1, 2)
+    new_id = worker.get_id()
+    single = snowflake.decode_id(new_id)
+    batch = snowflake.decode_ids([new_id])
+
+    assert single['datetime'].utcoffset().total_seconds() == 0
+    assert single['datetime'].replace(tzinfo=None) == batch['datetime'][0].astype(object)
+    assert (single['data_center_id'], single['worker_id']) == (2, 1)
+
+
+def test_ids_are_unique_across_threads():
+    worker = snowflake.IdWorker(1, 2)
+    results = [None] * 8
+    barrier = threading.Barrier(len(results))
+
+    def run(index):
+        barrier.wait()
+        ids = []
+        for i in range(500):
+            ids.extend(worker.get_ids(7) if i % 2 else [worker.get_id()])
+        results[index] = ids
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_ids = [new_id for ids in results for new_id in ids]
+    assert len(all_ids) == len(results) * 250 * 8
+    assert len(set(all_ids)) == len(all_ids)
+    for ids in results:
+        assert ids == sorted(ids)
+        assert len(set(ids)) == len(ids)
+
+
+def test_benchmark_checks_duplicates():
+    (thread_num, size, rate), = snowflake.benchmark(total=2000, threads=(4,), batch=10)
+    assert (thread_num, size) == (4, 10)
+    assert rate > 0
+
+
+def rewind_wall_clock(monkeypatch, ms):
+    """系统时间回拨 ms 毫秒, 单调时钟不受影响"""
+    time_ns = time.time_ns
+    monkeypatch.setattr(time, 'time_ns', lambda: time_ns() - ms * 1000000)
+
+
+def test_ids_keep_increasing_when_clock_moves_backwards(monkeypatch):
+    worker = snowflake.IdWorker(1, 2)
+    worker.clock_resync_interval = 0
+    before = [worker.get_id() for _ in range(5)]
+
+    rewind_wall_clock(monkeypatch, 5000)
+    after = [worker.get_id() for _ in range(5)] + worker.get_ids(10)
+
+    ids = before + after
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    stats = worker.get_stats()
+    assert stats['regressions'] == 1
+    assert stats['logical'] == 1
+    # 逻辑时钟每次对齐最多回退 clock_tolerance_ms, 时间戳仍领先于系统时间
+    assert worker.get_timestamp() > time.time_ns() // 1000000 + 4000
+
+
+def test_small_regression_waits(monkeypatch):
+    worker = snowflake.IdWorker(1, 2)
+    worker.clock_resync_interval = 0
+    first = worker.get_id()
+
+    rewind_wall_clock(monkeypatch, worker.clock_tolerance_ms // 2)
+    second = worker.get_id()
+
+    assert second > first
+    stats = worker.get_stats()
+    assert (stats['regressions'], stats['logical']) == (1, 0)
+
+
+def test_clock_regression_raise(monkeypatch):
+    worker = snowflake.IdWorker(1, 2)
+    worker.clock_resync_interval = 0
+    worker.clock_regression = 'raise'
+    worker.get_id()
+
+    rewind_wall_clock(monkeypatch, 5000)
+    with pytest.raises(snowflake.InvalidSystemClock):
+        worker.get_id()
+
+
+def test_time_range_round_trips_decoded_datetimes():
+    new_id = snowflake.IdWorker(1, 2).get_id()
+    decoded = snowflake.decode_id(new_id)['datetime']
+
+    for value in (decoded, decoded.replace(tzinfo=None)):
+        min_id, max_id = snowflake.ids_for_time_range(value, value)
+        assert min_id <= new_id <= max_id
+
+
+def test_time_range_date_end_covers_the_whole_day():
+    day = datetime.date(2024, 5, 1)
+    min_id, max_id = snowflake.ids_for_time_range(day, day)
+    start = datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc)
+
+    assert snowflake.decode_id(min_id)['datetime'] == start
+    assert snowflake.decode_id(max_id)['datetime'] == start + datetime.timedelta(days=1, milliseconds=-1)
+
+
+def test_get_stats_without_worker(monkeypatch):
+    monkeypatch.setattr(snowflake, 'id_worker', None)
+    assert snowflake.get_stats() == {}